@@ -4,38 +4,75 @@ from flask import Flask
 from sqlalchemy import create_engine
 from flasgger import Swagger
 
+from app.utils.db_utils import close_request_connection
+from app.utils.json_provider import OrjsonProvider
+from app.utils.redis_utils import create_redis_client
+from app.utils.visit_buffer import VisitBuffer
+
 # Configuration du logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def _create_db_engine(database_url):
+    """
+    Crée un moteur SQLAlchemy avec la configuration de pool commune
+    """
+    # Configuration spécifique à MySQL
+    return create_engine(
+        database_url,
+        connect_args={
+            'charset': 'utf8mb4',  # Support complet des caractères Unicode
+            'connect_timeout': 30,  # Timeout de connexion
+        },
+        pool_size=int(os.environ.get('DB_POOL_SIZE', 20)),  # Connexions gardées ouvertes
+        max_overflow=int(os.environ.get('DB_MAX_OVERFLOW', 40)),  # Connexions supplémentaires en pic
+        pool_recycle=300,  # Recycler les connexions après 5 minutes
+        pool_pre_ping=True   # Vérifier la connexion avant utilisation
+    )
+
 def create_app():
     """
     Fonction de création de l'application Flask
     """
     # Création de l'application Flask
     app = Flask(__name__)
+    
+    # Sérialisation JSON avec orjson
+    app.json = OrjsonProvider(app)
 
     # Configuration de la base de données MySQL
     database_url = os.environ.get('DATABASE_URL')
     if database_url:
         try:
-            # Configuration spécifique à MySQL
-            engine = create_engine(
-                database_url,
-                connect_args={
-                    'charset': 'utf8mb4',  # Support complet des caractères Unicode
-                    'connect_timeout': 30,  # Timeout de connexion
-                },
-                pool_recycle=3600,  # Recycler les connexions après 1 heure
-                pool_pre_ping=True   # Vérifier la connexion avant utilisation
-            )
+            engine = _create_db_engine(database_url)
             app.config['db_engine'] = engine
             logger.info("MySQL database engine initialized")
+            
+            # Moteur des lectures (réplique si DATABASE_READ_URL est fourni)
+            read_database_url = os.environ.get('DATABASE_READ_URL')
+            if read_database_url:
+                app.config['db_engine_ro'] = _create_db_engine(read_database_url)
+                logger.info("Read replica database engine initialized")
+            else:
+                app.config['db_engine_ro'] = engine
+            
+            # Tampon des visites de tracking, écrites en base par lots
+            app.config['visit_buffer'] = VisitBuffer(engine)
+            
+            # Connexion partagée par requête (voir get_request_connection)
+            app.teardown_appcontext(close_request_connection)
         except Exception as e:
             logger.error(f"Error initializing MySQL database engine: {str(e)}")
     else:
         logger.warning("DATABASE_URL not provided, database features will be disabled")
 
+    # Configuration de Redis (blacklist des tokens et cache des profils)
+    app.config['redis_client'] = create_redis_client(os.environ.get('REDIS_URL'))
+    if app.config['redis_client'] is not None:
+        logger.info("Redis client initialized")
+    else:
+        logger.warning("REDIS_URL not provided, Redis features will be disabled")
+
     # Configuration de Stripe
     stripe_secret_key = os.environ.get('STRIPE_SECRET_KEY')
     if stripe_secret_key:
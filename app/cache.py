@@ -0,0 +1,54 @@
+import logging
+from typing import Any, Optional
+
+import orjson
+import redis
+
+from app.config import settings
+from app.utils.redis_utils import create_redis_client
+
+logger = logging.getLogger(__name__)
+
+# Shared Redis client (None when REDIS_URL is not configured)
+redis_client: Optional[redis.Redis] = create_redis_client(settings.REDIS_URL)
+
+if redis_client is None:
+    logger.warning("REDIS_URL not provided, Redis-backed features will be disabled")
+
+
+def cache_get_json(key: str) -> Optional[Any]:
+    """
+    Read a JSON value from Redis, returning None on miss or Redis error
+    """
+    if redis_client is None:
+        return None
+    try:
+        raw = redis_client.get(key)
+    except redis.RedisError as e:
+        logger.warning("Redis GET failed for %s: %s", key, e)
+        return None
+    return orjson.loads(raw) if raw is not None else None
+
+
+def cache_set_json(key: str, value: Any, ttl_seconds: int) -> None:
+    """
+    Store a JSON value in Redis with an expiration, ignoring Redis errors
+    """
+    if redis_client is None:
+        return
+    try:
+        redis_client.setex(key, ttl_seconds, orjson.dumps(value))
+    except redis.RedisError as e:
+        logger.warning("Redis SETEX failed for %s: %s", key, e)
+
+
+def cache_delete(key: str) -> None:
+    """
+    Remove a key from Redis, ignoring Redis errors
+    """
+    if redis_client is None:
+        return
+    try:
+        redis_client.delete(key)
+    except redis.RedisError as e:
+        logger.warning("Redis DEL failed for %s: %s", key, e)
@@ -42,6 +42,10 @@ class Settings(BaseSettings):
     DISCORD_CLIENT_SECRET: str = os.getenv("DISCORD_CLIENT_SECRET", "")
     DISCORD_REDIRECT_URI: str = os.getenv("DISCORD_REDIRECT_URI", "http://localhost:8000/auth/discord/callback")
 
+    # Redis settings
+    REDIS_URL: Optional[str] = os.getenv("REDIS_URL")
+    STRIPE_MAX_CONCURRENT_REQUESTS: int = int(os.getenv("STRIPE_MAX_CONCURRENT_REQUESTS", "5"))
+
     # Frontend URL
     FRONTEND_URL: str = os.getenv("FRONTEND_URL", "https://panel.bemynet.fr")
 
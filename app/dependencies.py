@@ -3,14 +3,40 @@ from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from sqlalchemy.orm import Session
 from datetime import datetime
+import secrets
+import time
+import redis
 
 from app.config import settings
+from app.cache import redis_client
 from app.database import get_db
 from app.models.users import User
 from app.schemas.auth import TokenData
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token")
 
+# In-flight requests older than this are considered dead (crashed worker)
+CONCURRENT_REQUEST_TTL_SECONDS = 60
+
+# Atomic check-and-reserve of a concurrency slot (sorted set scored by start time)
+_concurrent_request_script = None
+if redis_client is not None:
+    _concurrent_request_script = redis_client.register_script("""
+        local key = KEYS[1]
+        local now = tonumber(ARGV[1])
+        local ttl = tonumber(ARGV[2])
+        local capacity = tonumber(ARGV[3])
+        local request_id = ARGV[4]
+
+        redis.call('ZREMRANGEBYSCORE', key, '-inf', now - ttl)
+        if redis.call('ZCARD', key) >= capacity then
+            return 0
+        end
+        redis.call('ZADD', key, now, request_id)
+        redis.call('EXPIRE', key, ttl)
+        return 1
+    """)
+
 async def get_current_user(
     token: str = Depends(oauth2_scheme), 
     db: Session = Depends(get_db)
@@ -117,3 +143,45 @@ def check_agent_role(
             detail="Not enough permissions, agent role required"
         )
     return current_user
+
+def limit_concurrent_stripe_requests(
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Limit the number of in-flight Stripe requests per user
+    """
+    if _concurrent_request_script is None:
+        yield
+        return
+
+    key = f"concurrent:{current_user.id}"
+    request_id = secrets.token_hex(4)
+
+    try:
+        allowed = _concurrent_request_script(
+            keys=[key],
+            args=[
+                time.time(),
+                CONCURRENT_REQUEST_TTL_SECONDS,
+                settings.STRIPE_MAX_CONCURRENT_REQUESTS,
+                request_id
+            ]
+        )
+    except redis.RedisError:
+        # Fail open: the limiter must never take the Stripe endpoints down
+        yield
+        return
+
+    if not allowed:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many concurrent requests"
+        )
+
+    try:
+        yield
+    finally:
+        try:
+            redis_client.zrem(key, request_id)
+        except redis.RedisError:
+            pass
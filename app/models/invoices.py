@@ -11,7 +11,7 @@ class DevisFacture(Base):
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
     client_id = Column(Integer, ForeignKey("clients.id", ondelete="SET NULL"), nullable=True)
     type = Column(Enum("devis", "facture", name="type_document_enum"))
-    status = Column(Enum("en_attente", "envoyé", "payé", "annulé", name="status_document_enum"), default="en_attente")
+    status = Column(Enum("en_attente", "envoyé", "payé", "annulé", "en_paiement", name="status_document_enum"), default="en_attente")
     date = Column(DateTime, server_default=func.now())
     due_date = Column(DateTime)
     payment_date = Column(DateTime, nullable=True)
@@ -22,6 +22,8 @@ class DevisFacture(Base):
     paid_by_user_id = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
     pdf_url = Column(Text)
     notes = Column(Text)
+    stripe_session_id = Column(String(255), nullable=True)
+    payment_claimed_at = Column(DateTime, nullable=True)
     
     # Relationships
     freelance = relationship("User", foreign_keys=[user_id], back_populates="devis_factures")
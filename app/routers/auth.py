@@ -8,6 +8,7 @@ import urllib.parse
 import json
 import jwt
 
+from app.cache import redis_client
 from app.database import get_db
 from app.models.users import User
 from app.models.auth import Authentification
@@ -24,6 +25,7 @@ from app.utils.auth import (
 )
 from app.dependencies import get_current_user
 from app.config import settings
+from app.utils.redis_utils import invalidate_user
 
 router = APIRouter()
 
@@ -96,6 +98,7 @@ async def login_for_access_token(
     user.last_login_at = datetime.utcnow()
     auth.last_login_at = datetime.utcnow()
     db.commit()
+    invalidate_user(redis_client, user.id)
 
     tokens = create_tokens(
         user.id,
@@ -132,6 +135,7 @@ async def login(
     user.last_login_at = datetime.utcnow()
     auth.last_login_at = datetime.utcnow()
     db.commit()
+    invalidate_user(redis_client, user.id)
 
     tokens = create_tokens(
         user.id,
@@ -348,6 +352,7 @@ async def find_or_create_social_user(
         if user:
             user.last_login_at = datetime.utcnow()
             db.commit()
+            invalidate_user(redis_client, user.id)
             return user
     
     # Check if user exists with the same email
@@ -379,4 +384,5 @@ async def find_or_create_social_user(
         db.add(auth)
     
     db.commit()
+    invalidate_user(redis_client, user.id)
     return user
@@ -6,6 +6,7 @@ from decimal import Decimal
 import os
 from fastapi.responses import FileResponse
 
+from app.cache import redis_client
 from app.database import get_db
 from app.models.users import User
 from app.models.clients import Client
@@ -18,6 +19,7 @@ from app.schemas.invoices import (
 )
 from app.dependencies import get_current_user, get_current_active_user, check_admin_role
 from app.utils.pdf import generate_invoice_pdf
+from app.utils.redis_utils import invalidate_payment_session
 
 router = APIRouter()
 
@@ -232,12 +234,17 @@ async def update_devis_facture(
         )
     
     # Update document attributes
-    for key, value in document_data.dict(exclude_unset=True).items():
+    update_data = document_data.dict(exclude_unset=True)
+    for key, value in update_data.items():
         setattr(document, key, value)
     
     db.commit()
     db.refresh(document)
     
+    # A status change invalidates the cached Stripe payment session
+    if "status" in update_data:
+        invalidate_payment_session(redis_client, document_id)
+    
     return document
 
 @router.delete("/{document_id}", response_model=Dict[str, str])
@@ -278,6 +285,7 @@ async def delete_devis_facture(
     # Delete document
     db.delete(document)
     db.commit()
+    invalidate_payment_session(redis_client, document_id)
     
     return {"message": "Document deleted successfully"}
 
@@ -599,4 +607,7 @@ async def mark_as_paid(
     db.commit()
     db.refresh(document)
     
+    # The cached Stripe payment session must not be served for a paid document
+    invalidate_payment_session(redis_client, document_id)
+    
     return document
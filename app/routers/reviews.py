@@ -4,6 +4,7 @@ from typing import List, Dict, Any, Optional, Union
 from datetime import datetime
 from sqlalchemy import func
 
+from app.cache import redis_client, cache_delete
 from app.database import get_db
 from app.models.users import User
 from app.models.clients import Client
@@ -15,9 +16,18 @@ from app.schemas.reviews import (
     AvisPlatformeUpdate, AvisPlatformeResponse, AvisListResponse
 )
 from app.dependencies import get_current_user, get_current_active_user, check_admin_role
+from app.routers.users import freelance_profile_cache_key
+from app.utils.redis_utils import invalidate_user
 
 router = APIRouter()
 
+def invalidate_freelancer_caches(user_id: int) -> None:
+    """
+    Drop the cached profiles that include a freelancer's rating
+    """
+    invalidate_user(redis_client, user_id)
+    cache_delete(freelance_profile_cache_key(user_id))
+
 @router.post("/freelance", response_model=AvisFreelanceResponse)
 async def create_freelance_review(
     review_data: AvisFreelanceCreate,
@@ -95,6 +105,7 @@ async def create_freelance_review(
         freelancer.rating = review_data.note
     
     db.commit()
+    invalidate_freelancer_caches(freelancer.id)
     db.refresh(new_review)
     
     return new_review
@@ -234,6 +245,8 @@ async def update_freelance_review(
                 freelancer.rating = avg_rating
     
     db.commit()
+    if review_data.note is not None and review_data.note != old_note:
+        invalidate_freelancer_caches(review.user_id)
     db.refresh(review)
     
     return review
@@ -283,6 +296,7 @@ async def delete_freelance_review(
             freelancer.rating = None
     
     db.commit()
+    invalidate_freelancer_caches(review.user_id)
     
     return {"message": "Review deleted successfully"}
 
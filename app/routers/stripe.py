@@ -1,5 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Request, Body, Header
 from fastapi.responses import RedirectResponse
+from sqlalchemy import func, update
 from sqlalchemy.orm import Session
 from typing import Dict, Any, Optional
 import stripe
@@ -8,11 +9,15 @@ from decimal import Decimal
 
 from app.database import get_db
 from app.models.users import User
-from app.models.sales import Vente
+from app.models.sales import Vente, Affiliation
 from app.models.clients import Client
 from app.models.products import Produit
+from app.models.partners import Commercial, Partenaire
 from app.schemas.sales import VenteCreate
-from app.dependencies import get_current_user, get_current_active_user, check_admin_role
+from app.dependencies import (
+    get_current_user, get_current_active_user, check_admin_role,
+    limit_concurrent_stripe_requests
+)
 from app.utils.stripe import (
     create_stripe_connect_account, get_stripe_dashboard_link,
     create_payment_intent, create_checkout_session,
@@ -25,7 +30,8 @@ router = APIRouter()
 # Initialize Stripe with API key
 stripe.api_key = settings.STRIPE_SECRET_KEY
 
-@router.post("/onboard", response_model=Dict[str, str])
+@router.post("/onboard", response_model=Dict[str, str],
+             dependencies=[Depends(limit_concurrent_stripe_requests)])
 async def create_stripe_onboarding(
     current_user: User = Depends(get_current_active_user),
     db: Session = Depends(get_db)
@@ -66,7 +72,8 @@ async def create_stripe_onboarding(
             detail=f"Error creating Stripe account: {str(e)}"
         )
 
-@router.get("/dashboard", response_model=Dict[str, str])
+@router.get("/dashboard", response_model=Dict[str, str],
+             dependencies=[Depends(limit_concurrent_stripe_requests)])
 async def get_stripe_dashboard_url(
     current_user: User = Depends(get_current_active_user)
 ):
@@ -82,7 +89,8 @@ async def get_stripe_dashboard_url(
     dashboard_url = get_stripe_dashboard_link(current_user.stripe_account_id)
     return {"dashboard_url": dashboard_url}
 
-@router.get("/account-status", response_model=Dict[str, Any])
+@router.get("/account-status", response_model=Dict[str, Any],
+             dependencies=[Depends(limit_concurrent_stripe_requests)])
 async def check_stripe_account_status(
     current_user: User = Depends(get_current_active_user),
     db: Session = Depends(get_db)
@@ -118,7 +126,8 @@ async def check_stripe_account_status(
             detail=f"Error checking Stripe account: {str(e)}"
         )
 
-@router.post("/payment-intent", response_model=Dict[str, Any])
+@router.post("/payment-intent", response_model=Dict[str, Any],
+             dependencies=[Depends(limit_concurrent_stripe_requests)])
 async def create_stripe_payment_intent(
     data: Dict[str, Any] = Body(...),
     current_user: User = Depends(get_current_active_user),
@@ -137,7 +146,7 @@ async def create_stripe_payment_intent(
             )
     
     # Get freelancer
-    freelancer = db.query(User).filter(User.id == data["freelance_id"]).first()
+    freelancer = db.get(User, data["freelance_id"])
     if not freelancer:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -152,7 +161,7 @@ async def create_stripe_payment_intent(
         )
     
     # Get product
-    product = db.query(Produit).filter(Produit.id == data["product_id"]).first()
+    product = db.get(Produit, data["product_id"])
     if not product:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -160,7 +169,7 @@ async def create_stripe_payment_intent(
         )
     
     # Get client
-    client = db.query(Client).filter(Client.id == data["client_id"]).first()
+    client = db.get(Client, data["client_id"])
     if not client:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -176,12 +185,12 @@ async def create_stripe_payment_intent(
     partner_rate = None
     
     if commercial_id:
-        commercial = db.query(Commercial).filter(Commercial.id == commercial_id).first()
+        commercial = db.get(Commercial, commercial_id)
         if commercial:
             commercial_rate = commercial.pourcentage / 100
     
     if partenaire_id:
-        partenaire = db.query(Partenaire).filter(Partenaire.id == partenaire_id).first()
+        partenaire = db.get(Partenaire, partenaire_id)
         if partenaire:
             partner_rate = partenaire.pourcentage / 100
     
@@ -214,13 +223,14 @@ async def create_stripe_payment_intent(
     payment_intent = create_payment_intent(
         amount=amount,
         freelance_stripe_account=freelancer.stripe_account_id,
-        application_fee=commission_data["platform_fee"] + commission_data["commercial_commission"] + commission_data["partner_commission"],
+        application_fee=commission_data["total_fees"],
         metadata=metadata
     )
     
     return payment_intent
 
-@router.post("/checkout-session", response_model=Dict[str, Any])
+@router.post("/checkout-session", response_model=Dict[str, Any],
+             dependencies=[Depends(limit_concurrent_stripe_requests)])
 async def create_stripe_checkout(
     data: Dict[str, Any] = Body(...),
     current_user: User = Depends(get_current_active_user),
@@ -239,7 +249,7 @@ async def create_stripe_checkout(
             )
     
     # Get freelancer
-    freelancer = db.query(User).filter(User.id == data["freelance_id"]).first()
+    freelancer = db.get(User, data["freelance_id"])
     if not freelancer:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -254,7 +264,7 @@ async def create_stripe_checkout(
         )
     
     # Get product
-    product = db.query(Produit).filter(Produit.id == data["product_id"]).first()
+    product = db.get(Produit, data["product_id"])
     if not product:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -262,7 +272,7 @@ async def create_stripe_checkout(
         )
     
     # Get client
-    client = db.query(Client).filter(Client.id == data["client_id"]).first()
+    client = db.get(Client, data["client_id"])
     if not client:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -278,12 +288,12 @@ async def create_stripe_checkout(
     partner_rate = None
     
     if commercial_id:
-        commercial = db.query(Commercial).filter(Commercial.id == commercial_id).first()
+        commercial = db.get(Commercial, commercial_id)
         if commercial:
             commercial_rate = commercial.pourcentage / 100
     
     if partenaire_id:
-        partenaire = db.query(Partenaire).filter(Partenaire.id == partenaire_id).first()
+        partenaire = db.get(Partenaire, partenaire_id)
         if partenaire:
             partner_rate = partenaire.pourcentage / 100
     
@@ -316,7 +326,7 @@ async def create_stripe_checkout(
     checkout_session = create_checkout_session(
         amount=amount,
         freelance_stripe_account=freelancer.stripe_account_id,
-        application_fee=commission_data["platform_fee"] + commission_data["commercial_commission"] + commission_data["partner_commission"],
+        application_fee=commission_data["total_fees"],
         metadata=metadata,
         success_url=data["success_url"],
         cancel_url=data["cancel_url"],
@@ -408,20 +418,17 @@ async def handle_payment_success(payment_intent, db: Session):
         source="stripe"
     )
     
-    # Get freelancer
-    freelancer = db.query(User).filter(User.id == freelance_id).first()
-    
     # Get commercial commission rate if applicable
     commercial_rate = None
     if commercial_id:
-        commercial = db.query(Commercial).filter(Commercial.id == commercial_id).first()
+        commercial = db.get(Commercial, commercial_id)
         if commercial:
             commercial_rate = commercial.pourcentage / 100 if commercial.pourcentage else None
     
     # Get partner commission rate if applicable
     partner_rate = None
     if partenaire_id:
-        partner = db.query(Partenaire).filter(Partenaire.id == partenaire_id).first()
+        partner = db.get(Partenaire, partenaire_id)
         if partner:
             partner_rate = partner.pourcentage / 100 if partner.pourcentage else None
     
@@ -439,7 +446,6 @@ async def handle_payment_success(payment_intent, db: Session):
         produit_id=product_id,
         montant=amount,
         description=f"Payment for product ID: {product_id}",
-        date=datetime.utcnow(),
         source="stripe",
         commission_plateforme=commission_data['platform_fee'],
         commission_commerciale=commission_data['commercial_commission'],
@@ -453,15 +459,22 @@ async def handle_payment_success(payment_intent, db: Session):
     
     db.add(new_sale)
     
-    # Update client lifetime value
-    client = db.query(Client).filter(Client.id == client_id).first()
-    if client:
-        client.lifetime_value = (client.lifetime_value or Decimal('0.0')) + amount
-        client.last_purchase_date = datetime.utcnow()
+    # Update client lifetime value (atomic increment, safe under concurrent webhooks)
+    db.execute(
+        update(Client)
+        .where(Client.id == client_id)
+        .values(
+            lifetime_value=func.coalesce(Client.lifetime_value, 0) + amount,
+            last_purchase_date=func.now()
+        )
+    )
     
     # Update freelancer revenue
-    if freelancer:
-        freelancer.total_revenue = (freelancer.total_revenue or Decimal('0.0')) + commission_data['net_amount']
+    db.execute(
+        update(User)
+        .where(User.id == freelance_id)
+        .values(total_revenue=func.coalesce(User.total_revenue, 0) + commission_data['net_amount'])
+    )
     
     db.commit()
     
@@ -510,7 +523,8 @@ async def handle_account_updated(account, db: Session):
     
     db.commit()
 
-@router.get("/refresh-account", response_model=Dict[str, Any])
+@router.get("/refresh-account", response_model=Dict[str, Any],
+             dependencies=[Depends(limit_concurrent_stripe_requests)])
 async def refresh_stripe_account(
     current_user: User = Depends(get_current_active_user),
     db: Session = Depends(get_db)
@@ -1,16 +1,30 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query
-from sqlalchemy.orm import Session
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session, load_only
 from typing import List, Dict, Any, Optional
 from decimal import Decimal
+import time
 
+from app.cache import cache_get_json, cache_set_json, cache_delete
 from app.database import get_db
 from app.models.users import User
 from app.schemas.users import UserCreate, UserUpdate, UserResponse, FreelanceProfileResponse
 from app.dependencies import get_current_user, get_current_active_user, check_admin_role
 from app.utils.stripe import create_stripe_connect_account, get_stripe_dashboard_link
+from app.utils.redis_utils import user_cache_key
 
 router = APIRouter()
 
+# Public freelance profile cache: fresh for 1 minute, served stale for up to 10 minutes on DB errors
+FREELANCE_PROFILE_TTL_SECONDS = 60
+FREELANCE_PROFILE_STALE_TTL_SECONDS = 600
+
+def freelance_profile_cache_key(user_id: int) -> str:
+    return f"freelance:{user_id}"
+
+# Only load the columns exposed by UserResponse when listing users
+USER_RESPONSE_COLUMNS = tuple(UserResponse.model_fields)
+
 @router.get("/", response_model=List[UserResponse])
 async def get_users(
     skip: int = Query(0, ge=0),
@@ -23,7 +37,9 @@ async def get_users(
     """
     Get list of users (admin only)
     """
-    query = db.query(User)
+    query = db.query(User).options(
+        load_only(*(getattr(User, column) for column in USER_RESPONSE_COLUMNS))
+    )
     
     # Apply filters
     if search:
@@ -37,7 +53,6 @@ async def get_users(
         query = query.filter(User.role == role)
     
     # Apply pagination
-    total = query.count()
     users = query.order_by(User.id).offset(skip).limit(limit).all()
     
     return users
@@ -63,7 +78,10 @@ async def update_user_me(
         setattr(current_user, key, value)
     
     db.commit()
-    db.refresh(current_user)
+    
+    # The role may just have changed, so the public profile is dropped in any case
+    cache_delete(user_cache_key(current_user.id))
+    cache_delete(freelance_profile_cache_key(current_user.id))
     
     return current_user
 
@@ -84,7 +102,7 @@ async def get_user(
         )
     
     # Get user
-    user = db.query(User).filter(User.id == user_id).first()
+    user = db.get(User, user_id)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -104,7 +122,7 @@ async def update_user(
     Update user information (admin only)
     """
     # Get user
-    user = db.query(User).filter(User.id == user_id).first()
+    user = db.get(User, user_id)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -116,7 +134,10 @@ async def update_user(
         setattr(user, key, value)
     
     db.commit()
-    db.refresh(user)
+    
+    # The role may just have changed, so the public profile is dropped in any case
+    cache_delete(user_cache_key(user.id))
+    cache_delete(freelance_profile_cache_key(user.id))
     
     return user
 
@@ -178,14 +199,25 @@ async def get_freelance_profile(
     db: Session = Depends(get_db)
 ):
     """
-    Get public freelancer profile by ID
+    Get public freelancer profile by ID (stale-while-revalidate cached)
     """
+    cache_key = freelance_profile_cache_key(user_id)
+    cached = cache_get_json(cache_key)
+    if cached and time.time() - cached["cached_at"] < FREELANCE_PROFILE_TTL_SECONDS:
+        return cached["profile"]
+    
     # Get user with role 'freelance'
-    user = db.query(User).filter(
-        User.id == user_id,
-        User.role == "freelance",
-        User.account_status == "active"
-    ).first()
+    try:
+        user = db.query(User).filter(
+            User.id == user_id,
+            User.role == "freelance",
+            User.account_status == "active"
+        ).first()
+    except SQLAlchemyError:
+        # Serve the stale copy rather than failing while the database is unavailable
+        if cached:
+            return cached["profile"]
+        raise
     
     if not user:
         raise HTTPException(
@@ -193,7 +225,14 @@ async def get_freelance_profile(
             detail="Freelancer not found"
         )
     
-    return user
+    profile = FreelanceProfileResponse.model_validate(user, from_attributes=True).model_dump(mode="json")
+    cache_set_json(
+        cache_key,
+        {"cached_at": time.time(), "profile": profile},
+        FREELANCE_PROFILE_STALE_TTL_SECONDS
+    )
+    
+    return profile
 
 @router.get("/stats/dashboard", response_model=Dict[str, Any])
 async def get_freelance_dashboard_stats(
@@ -1,8 +1,16 @@
 import logging
-from flask import Blueprint, request, jsonify, current_app, redirect
+from flask import Blueprint, Response, request, jsonify, current_app, redirect, stream_with_context
 from sqlalchemy import text
-from functools import wraps
-import uuid
+from sqlalchemy.exc import IntegrityError
+from functools import lru_cache, wraps
+import secrets
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+
+from app.utils.json_provider import dumps_bytes
+from app.utils.jwt_utils import get_bearer_token, verify_access_token
+from app.utils.pagination import encode_cursor, decode_cursor
+from app.utils.user_management import get_user_role
+from app.utils.visit_buffer import invalidate_tracking_code
 
 # Configurer le logging
 logger = logging.getLogger(__name__)
@@ -10,26 +18,204 @@ logger = logging.getLogger(__name__)
 # Créer le blueprint pour les routes d'affiliation
 affiliation_bp = Blueprint('affiliation', __name__, url_prefix='/affiliations')
 
+# Types de source d'affiliation, et ceux qui disposent d'un code de tracking
+AFFILIATION_SOURCE_TYPES = frozenset({'commercial', 'partenaire', 'lien'})
+TRACKING_SOURCE_TYPES = frozenset({'commercial', 'partenaire'})
+
+def _tracking_code_update_query(table, name_column):
+    """
+    Construit la requête qui, en un seul aller-retour, résout la source
+    (par id ou par utilisateur), vérifie l'accès puis met à jour le code
+    de tracking. L'unicité du code est garantie par un index unique.
+    
+    La ligne retournée contient toujours resolved_id et allowed pour
+    distinguer les cas d'erreur, previous_code (l'ancien code), et
+    id/tracking_code/name si la mise à jour a eu lieu.
+    """
+    return text(f"""
+        WITH src AS (
+            SELECT id, user_id, tracking_code FROM {table}
+            WHERE id = :source_id OR (:source_id IS NULL AND user_id = :user_id)
+            ORDER BY id
+            LIMIT 1
+        ),
+        allowed AS (
+            SELECT id FROM src WHERE user_id = :user_id OR :is_admin
+        ),
+        upd AS (
+            UPDATE {table}
+            SET tracking_code = :code
+            WHERE id IN (SELECT id FROM allowed)
+            RETURNING id, tracking_code, {name_column} AS name
+        )
+        SELECT
+            (SELECT id FROM src) AS resolved_id,
+            (SELECT tracking_code FROM src) AS previous_code,
+            EXISTS (SELECT 1 FROM allowed) AS allowed,
+            upd.id, upd.tracking_code, upd.name
+        FROM (SELECT 1) AS one
+        LEFT JOIN upd ON true
+    """)
+
+# Nombre de tentatives pour générer un code de tracking unique
+TRACKING_CODE_MAX_ATTEMPTS = 3
+
+_TRACKING_CODE_UPDATE_QUERIES = {
+    'commercial': _tracking_code_update_query('commerciaux', 'full_name'),
+    'partenaire': _tracking_code_update_query('partenaires', 'nom'),
+}
+
+# Requêtes invariantes, construites une seule fois au chargement du module
+_COMMERCIAL_BY_CODE_QUERY = text("SELECT id FROM commerciaux WHERE tracking_code = :code")
+_PARTENAIRE_BY_CODE_QUERY = text("SELECT id FROM partenaires WHERE tracking_code = :code")
+
+_AFFILIATIONS_BASE_SQL = """
+    SELECT a.*, v.montant, v.date, sn.source_name
+    FROM affiliations a
+    LEFT JOIN ventes v ON a.vente_id = v.id
+    LEFT JOIN LATERAL (
+        -- Ne consulter que la table correspondant au type de source de la ligne
+        SELECT CASE a.source_type
+            WHEN 'commercial' THEN (SELECT full_name FROM commerciaux WHERE id = a.source_id)
+            WHEN 'partenaire' THEN (SELECT nom FROM partenaires WHERE id = a.source_id)
+        END AS source_name
+    ) sn ON true
+    WHERE 1=1
+"""
+
+# Clé de tri seule, sans le nom de la source (curseur d'une page envoyée en flux)
+_AFFILIATIONS_KEY_SQL = """
+    SELECT v.date, a.id
+    FROM affiliations a
+    LEFT JOIN ventes v ON a.vente_id = v.id
+    WHERE 1=1
+"""
+
+_AFFILIATIONS_OWNER_FILTER_SQL = """
+    AND (
+        (a.source_type = 'commercial' AND EXISTS (
+            SELECT 1 FROM commerciaux c2 WHERE c2.id = a.source_id AND c2.user_id = :user_id
+        )) OR
+        (a.source_type = 'partenaire' AND EXISTS (
+            SELECT 1 FROM partenaires p2 WHERE p2.id = a.source_id AND p2.user_id = :user_id
+        )) OR
+        v.user_id = :user_id
+    )
+"""
+
+@lru_cache(maxsize=64)
+def _build_affiliations_query(is_admin, has_source_type, has_source_id, has_vente_id, has_cursor, last_key=False):
+    """
+    Construit la requête de liste des affiliations pour une combinaison de
+    filtres. Le résultat est mis en cache, il n'y a que 64 variantes.
+    
+    Avec last_key, la requête ne renvoie que la clé de tri (date, id) de la
+    dernière ligne de la page, pour construire le curseur de la page suivante.
+    """
+    query_parts = [_AFFILIATIONS_KEY_SQL if last_key else _AFFILIATIONS_BASE_SQL]
+    
+    if not is_admin:
+        query_parts.append(_AFFILIATIONS_OWNER_FILTER_SQL)
+    if has_source_type:
+        query_parts.append("AND a.source_type = :source_type")
+    if has_source_id:
+        query_parts.append("AND a.source_id = :source_id")
+    if has_vente_id:
+        query_parts.append("AND a.vente_id = :vente_id")
+    # Les affiliations sans vente (date NULL) sont classées en dernier ; la même
+    # expression sert au tri et au curseur pour que la pagination les atteigne
+    if has_cursor:
+        query_parts.append(
+            "AND (COALESCE(v.date, '-infinity'::timestamp), a.id)"
+            " < (COALESCE(CAST(:cursor_date AS TIMESTAMP), '-infinity'::timestamp), :cursor_id)"
+        )
+    
+    query_parts.append("ORDER BY COALESCE(v.date, '-infinity'::timestamp) DESC, a.id DESC")
+    if last_key:
+        query_parts.append("LIMIT 1 OFFSET :limit - 1" if has_cursor else "LIMIT 1 OFFSET :offset + :limit - 1")
+    elif has_cursor:
+        query_parts.append("LIMIT :limit")
+    else:
+        query_parts.append("LIMIT :limit OFFSET :offset")
+    
+    return text(" ".join(query_parts))
+
+# Au-delà de cette taille de page, la liste des affiliations est envoyée en flux
+AFFILIATIONS_STREAM_THRESHOLD = 200
+AFFILIATIONS_STREAM_BATCH_SIZE = 200
+
+def _stream_affiliations(rows, first):
+    """
+    Génère le tableau JSON des affiliations ligne par ligne, sans construire
+    la liste complète en mémoire (la première ligne est lue avant l'envoi
+    de la réponse).
+    """
+    yield b'['
+    try:
+        if first is not None:
+            yield dumps_bytes(dict(first))
+            for affiliation in rows:
+                yield b','
+                yield dumps_bytes(dict(affiliation))
+    except Exception as e:
+        # La réponse est déjà partiellement envoyée : le tableau est refermé
+        # pour rester du JSON valide, et l'erreur est journalisée
+        logger.error("Error streaming affiliations: %s", e, exc_info=True)
+    yield b']'
+
+def _affiliations_stream_response(engine, query, params, is_admin, source_type, source_id, vente_id, cursor):
+    """
+    Prépare la réponse en flux d'une grande page d'affiliations. Le curseur de
+    la page suivante et la première ligne sont lus avant l'envoi du statut 200,
+    dans une même transaction REPEATABLE READ que la lecture en flux, pour
+    qu'une erreur de requête donne une réponse 500 et que le curseur
+    corresponde aux lignes envoyées.
+    """
+    conn = engine.connect().execution_options(
+        isolation_level="REPEATABLE READ",
+        yield_per=AFFILIATIONS_STREAM_BATCH_SIZE
+    )
+    try:
+        conn.begin()
+        last = conn.execute(_build_affiliations_query(
+            is_admin,
+            bool(source_type),
+            source_id is not None,
+            vente_id is not None,
+            bool(cursor),
+            last_key=True
+        ), params).first()
+        rows = conn.execute(query, params).mappings()
+        first = rows.fetchone()
+    except Exception:
+        conn.close()
+        raise
+    
+    response = Response(
+        stream_with_context(_stream_affiliations(rows, first)),
+        mimetype='application/json'
+    )
+    # La connexion est rendue au pool une fois le flux terminé ou interrompu
+    response.call_on_close(conn.close)
+    
+    # Curseur de la page suivante si la page est complète
+    if last is not None:
+        response.headers['X-Next-Cursor'] = encode_cursor(last.date, last.id)
+    
+    return response
+
 # Middleware d'authentification (identique aux autres routes)
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = None
-        auth_header = request.headers.get('Authorization')
-        
-        if auth_header:
-            parts = auth_header.split()
-            if len(parts) == 2 and parts[0].lower() == 'bearer':
-                token = parts[1]
+        token = get_bearer_token(request.headers.get('Authorization'))
         
         if not token:
             return jsonify({'message': 'Token is missing!'}), 401
         
-        # Importer decode_token depuis jwt_utils
-        from app.utils.jwt_utils import decode_token
-        
         try:
-            payload = decode_token(token)
+            # Signature, type et révocation du token vérifiés au même endroit pour toutes les routes
+            payload = verify_access_token(token, current_app.config.get('redis_client'))
             if not payload:
                 return jsonify({'message': 'Token is invalid!'}), 401
             
@@ -38,7 +224,7 @@ def token_required(f):
             
             return f(*args, **kwargs)
         except Exception as e:
-            logger.error(f"Token verification error: {str(e)}")
+            logger.error("Token verification error: %s", e)
             return jsonify({'message': 'Token is invalid!'}), 401
         
     return decorated
@@ -77,10 +263,14 @@ def get_affiliations():
         name: offset
         type: integer
         default: 0
-        description: Décalage pour la pagination
+        description: Décalage pour la pagination (ignoré si cursor est fourni)
+      - in: query
+        name: cursor
+        type: string
+        description: Curseur de pagination renvoyé dans l'en-tête X-Next-Cursor de la page précédente
     responses:
       200:
-        description: Liste des affiliations
+        description: Liste des affiliations (l'en-tête X-Next-Cursor contient le curseur de la page suivante)
         schema:
           type: array
           items:
@@ -115,6 +305,8 @@ def get_affiliations():
                 format: date-time
                 description: Date de la vente
               
+      400:
+        description: Filtre ou pagination invalide
       401:
         description: Non authentifié
       404:
@@ -130,93 +322,90 @@ def get_affiliations():
     vente_id = request.args.get('vente_id')
     limit = request.args.get('limit', 50, type=int)
     offset = request.args.get('offset', 0, type=int)
+    cursor = request.args.get('cursor')
+    
+    if limit <= 0 or offset < 0:
+        return jsonify({'message': 'limit doit être strictement positif et offset positif ou nul'}), 400
+    
+    if source_type and source_type not in AFFILIATION_SOURCE_TYPES:
+        return jsonify({'message': 'source_type doit être commercial, partenaire ou lien'}), 400
+    
+    # Un identifiant mal formé ne doit pas retirer le filtre en silence
+    try:
+        source_id = int(source_id) if source_id is not None else None
+        vente_id = int(vente_id) if vente_id is not None else None
+    except ValueError:
+        return jsonify({'message': 'source_id et vente_id doivent être des entiers'}), 400
+    
+    if cursor:
+        try:
+            cursor_date, cursor_id = decode_cursor(cursor)
+        except ValueError:
+            return jsonify({'message': 'Invalid cursor'}), 400
     
     engine = current_app.config.get('db_engine')
     if not engine:
         return jsonify({'message': 'Database connection error'}), 500
     
     try:
-        with engine.connect() as conn:
-            # Vérifier le rôle de l'utilisateur
-            role_query = text("SELECT role FROM users WHERE id = :user_id")
-            role_result = conn.execute(role_query, {"user_id": user_id}).fetchone()
+        # Lecture seule: pas de transaction à ouvrir ni à valider
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            # Vérifier le rôle de l'utilisateur (mis en cache)
+            role = get_user_role(conn, user_id)
             
-            if not role_result:
+            if not role:
                 return jsonify({'message': 'User not found'}), 404
             
-            is_admin = role_result.role == 'admin'
+            is_admin = role == 'admin'
             
-            # Construire la requête SQL avec les filtres
-            query_parts = [
-                "SELECT a.*, v.montant, v.date,",
-                "CASE",
-                "    WHEN a.source_type = 'commercial' THEN c.full_name",
-                "    WHEN a.source_type = 'partenaire' THEN p.nom",
-                "    ELSE NULL",
-                "END as source_name",
-                "FROM affiliations a",
-                "LEFT JOIN ventes v ON a.vente_id = v.id",
-                "LEFT JOIN commerciaux c ON a.source_type = 'commercial' AND a.source_id = c.id",
-                "LEFT JOIN partenaires p ON a.source_type = 'partenaire' AND a.source_id = p.id",
-                "WHERE 1=1"
-            ]
-            
-            params = {}
+            # Paramètres de la requête selon les filtres actifs
+            params = {"limit": limit}
             
             # Si non admin, limiter aux affiliations dont l'utilisateur est la source ou le propriétaire de la vente
             if not is_admin:
-                query_parts.append("""
-                    AND (
-                        (a.source_type = 'commercial' AND a.source_id IN (
-                            SELECT id FROM commerciaux WHERE user_id = :user_id
-                        )) OR
-                        (a.source_type = 'partenaire' AND a.source_id IN (
-                            SELECT id FROM partenaires WHERE user_id = :user_id
-                        )) OR
-                        v.user_id = :user_id
-                    )
-                """)
                 params["user_id"] = user_id
-            
-            # Ajouter les filtres
             if source_type:
-                query_parts.append("AND a.source_type = :source_type")
                 params["source_type"] = source_type
-                
-            if source_id:
-                query_parts.append("AND a.source_id = :source_id")
-                params["source_id"] = int(source_id)
-                
-            if vente_id:
-                query_parts.append("AND a.vente_id = :vente_id")
-                params["vente_id"] = int(vente_id)
+            if source_id is not None:
+                params["source_id"] = source_id
+            if vente_id is not None:
+                params["vente_id"] = vente_id
+            
+            # Pagination par curseur sur (date, id) si fourni, sinon par décalage
+            if cursor:
+                params["cursor_date"] = cursor_date
+                params["cursor_id"] = cursor_id
+            else:
+                params["offset"] = offset
+            
+            # Exécuter la requête (une seule construction par combinaison de filtres)
+            query = _build_affiliations_query(
+                is_admin,
+                bool(source_type),
+                source_id is not None,
+                vente_id is not None,
+                bool(cursor)
+            )
             
-            # Ajouter l'ordre et la pagination
-            query_parts.append("ORDER BY v.date DESC")
-            query_parts.append("LIMIT :limit OFFSET :offset")
-            params["limit"] = limit
-            params["offset"] = offset
+            # Les grandes pages sont envoyées en flux au fil de la lecture
+            if limit > AFFILIATIONS_STREAM_THRESHOLD:
+                return _affiliations_stream_response(engine, query, params, is_admin, source_type, source_id, vente_id, cursor)
             
-            # Exécuter la requête
-            query = text(" ".join(query_parts))
-            affiliations = conn.execute(query, params).fetchall()
+            affiliations = conn.execute(query, params).mappings().all()
             
-            # Convertir les résultats en liste de dictionnaires
-            result = []
-            for affiliation in affiliations:
-                affiliation_dict = {column: getattr(affiliation, column) for column in affiliation._mapping.keys()}
-                
-                # Conversion des valeurs décimales en float pour la sérialisation JSON
-                if affiliation_dict.get('commission'):
-                    affiliation_dict['commission'] = float(affiliation_dict['commission'])
-                if affiliation_dict.get('montant'):
-                    affiliation_dict['montant'] = float(affiliation_dict['montant'])
-                
-                result.append(affiliation_dict)
+            # Convertir les résultats en liste de dictionnaires (les Decimal sont gérés par le fournisseur JSON)
+            result = [dict(affiliation) for affiliation in affiliations]
             
-            return jsonify(result)
+            response = jsonify(result)
+            
+            # Curseur de la page suivante à partir de la dernière ligne
+            if limit > 0 and len(result) == limit:
+                last = result[-1]
+                response.headers['X-Next-Cursor'] = encode_cursor(last['date'], last['id'])
+            
+            return response
     except Exception as e:
-        logger.error(f"Error getting affiliations: {str(e)}")
+        logger.error("Error getting affiliations: %s", e)
         return jsonify({'message': f'An error occurred: {str(e)}'}), 500
 
 # Endpoint pour créer un tracking code
@@ -293,7 +482,7 @@ def create_tracking_code():
     source_id = data.get('id')  # ID du commercial ou partenaire
     code = data.get('code')  # Code personnalisé (optionnel)
     
-    if source_type not in ['commercial', 'partenaire']:
+    if source_type not in TRACKING_SOURCE_TYPES:
         return jsonify({'message': 'Type doit être commercial ou partenaire'}), 400
     
     engine = current_app.config.get('db_engine')
@@ -301,121 +490,67 @@ def create_tracking_code():
         return jsonify({'message': 'Database connection error'}), 500
     
     try:
-        with engine.connect() as conn:
-            # Vérifier le rôle de l'utilisateur
-            role_query = text("SELECT role FROM users WHERE id = :user_id")
-            role_result = conn.execute(role_query, {"user_id": user_id}).fetchone()
+        # Une seule transaction, validée à la sortie du bloc
+        with engine.begin() as conn:
+            # Vérifier le rôle de l'utilisateur (mis en cache)
+            role = get_user_role(conn, user_id)
             
-            if not role_result:
+            if not role:
                 return jsonify({'message': 'User not found'}), 404
             
-            is_admin = role_result.role == 'admin'
-            
-            # Si pas d'ID spécifié, vérifier si l'utilisateur est lui-même un commercial/partenaire
-            if not source_id:
-                if source_type == 'commercial':
-                    source_query = text("""
-                        SELECT id FROM commerciaux
-                        WHERE user_id = :user_id
-                        LIMIT 1
-                    """)
-                else:  # partenaire
-                    source_query = text("""
-                        SELECT id FROM partenaires
-                        WHERE user_id = :user_id
-                        LIMIT 1
-                    """)
-                
-                source = conn.execute(source_query, {"user_id": user_id}).fetchone()
-                
-                if source:
-                    source_id = source.id
-                else:
-                    return jsonify({'message': f'Aucun {source_type} associé à cet utilisateur'}), 400
-            
-            # Vérifier que le source_id existe et que l'utilisateur y a accès
-            if source_type == 'commercial':
-                check_query = text("""
-                    SELECT id FROM commerciaux
-                    WHERE id = :source_id AND (user_id = :user_id OR :is_admin)
-                """)
-            else:  # partenaire
-                check_query = text("""
-                    SELECT id FROM partenaires
-                    WHERE id = :source_id AND (user_id = :user_id OR :is_admin)
-                """)
+            is_admin = role == 'admin'
             
-            source = conn.execute(check_query, {
-                "source_id": source_id,
+            params = {
+                "source_id": source_id or None,
                 "user_id": user_id,
-                "is_admin": is_admin
-            }).fetchone()
+                "is_admin": is_admin,
+                "code": code
+            }
             
-            if not source:
-                return jsonify({'message': f'{source_type.capitalize()} non trouvé ou non autorisé'}), 403
-            
-            # Générer un code unique si non fourni
-            if not code:
-                code = str(uuid.uuid4()).split('-')[0].upper()
+            # Résoudre la source, vérifier l'accès puis mettre à jour en une requête
+            if code:
+                outcome = conn.execute(_TRACKING_CODE_UPDATE_QUERIES[source_type], params).fetchone()
             else:
-                # Vérifier que le code n'existe pas déjà
-                if source_type == 'commercial':
-                    check_code_query = text("""
-                        SELECT id FROM commerciaux
-                        WHERE tracking_code = :code AND id != :source_id
-                    """)
-                else:  # partenaire
-                    check_code_query = text("""
-                        SELECT id FROM partenaires
-                        WHERE tracking_code = :code AND id != :source_id
-                    """)
-                
-                existing_code = conn.execute(check_code_query, {
-                    "code": code,
-                    "source_id": source_id
-                }).fetchone()
-                
-                if existing_code:
-                    return jsonify({'message': 'Ce code de tracking existe déjà'}), 409
-            
-            # Mettre à jour le code de tracking
-            if source_type == 'commercial':
-                update_query = text("""
-                    UPDATE commerciaux
-                    SET tracking_code = :code
-                    WHERE id = :source_id
-                    RETURNING id, tracking_code, full_name
-                """)
-            else:  # partenaire
-                update_query = text("""
-                    UPDATE partenaires
-                    SET tracking_code = :code
-                    WHERE id = :source_id
-                    RETURNING id, tracking_code, nom as name
-                """)
-            
-            result = conn.execute(update_query, {
-                "code": code,
-                "source_id": source_id
-            })
+                # Générer un code, et en tirer un autre en cas de collision avec l'index unique
+                for attempt in range(TRACKING_CODE_MAX_ATTEMPTS):
+                    params["code"] = secrets.token_urlsafe(6)
+                    try:
+                        with conn.begin_nested():
+                            outcome = conn.execute(_TRACKING_CODE_UPDATE_QUERIES[source_type], params).fetchone()
+                        break
+                    except IntegrityError:
+                        if attempt == TRACKING_CODE_MAX_ATTEMPTS - 1:
+                            raise
+                code = params["code"]
             
-            updated = result.fetchone()
-            
-            # Commit les changements
-            conn.commit()
-            
-            # Construire l'URL de tracking
-            base_url = request.host_url.rstrip('/')
-            tracking_url = f"{base_url}/track/{source_type}/{code}"
+            if outcome.resolved_id is None:
+                if not source_id:
+                    return jsonify({'message': f'Aucun {source_type} associé à cet utilisateur'}), 400
+                return jsonify({'message': f'{source_type.capitalize()} non trouvé ou non autorisé'}), 403
             
-            return jsonify({
-                'id': updated.id,
-                'code': updated.tracking_code,
-                'name': updated.name if hasattr(updated, 'name') else updated.full_name,
-                'tracking_url': tracking_url
-            })
+            if not outcome.allowed:
+                return jsonify({'message': f'{source_type.capitalize()} non trouvé ou non autorisé'}), 403
+        
+        # Les visites sur l'ancien et le nouveau code doivent être résolues à
+        # nouveau, une fois la modification validée
+        invalidate_tracking_code(source_type, outcome.previous_code)
+        invalidate_tracking_code(source_type, code)
+        
+        # Construire l'URL de tracking
+        base_url = request.host_url.rstrip('/')
+        tracking_url = f"{base_url}/track/{source_type}/{code}"
+        
+        return jsonify({
+            'id': outcome.id,
+            'code': outcome.tracking_code,
+            'name': outcome.name,
+            'tracking_url': tracking_url
+        })
+    except IntegrityError:
+        # Violation de l'index unique sur tracking_code
+        return jsonify({'message': 'Ce code de tracking existe déjà'}), 409
     except Exception as e:
-        logger.error(f"Error creating tracking code: {str(e)}")
+        logger.error("Error creating tracking code: %s", e)
         return jsonify({'message': f'An error occurred: {str(e)}'}), 500
 
 # Route publique pour le tracking
@@ -446,45 +581,23 @@ def track_visit(source_type, code):
     responses:
       302:
         description: Redirection vers l'URL spécifiée avec paramètres de tracking ajoutés
-      500:
-        description: Erreur serveur (redirige quand même vers l'URL spécifiée)
     """
     redirect_url = request.args.get('url', '/')
     
-    engine = current_app.config.get('db_engine')
-    if not engine:
-        return redirect(redirect_url)  # En cas d'erreur, rediriger sans tracking
+    # Ajouter les paramètres de tracking à l'URL (le frontend valide le code)
+    parsed_url = urlparse(redirect_url)
+    query = parse_qsl(parsed_url.query, keep_blank_values=True)
+    query += [('ref_type', source_type), ('ref_code', code)]
+    redirect_url = urlunparse(parsed_url._replace(query=urlencode(query)))
     
-    try:
-        with engine.connect() as conn:
-            # Enregistrer la visite et rediriger
-            # Dans un système réel, on stockerait la visite, les cookies, etc.
-            
-            # Récupérer l'ID correspondant au code
-            if source_type == 'commercial':
-                query = text("""
-                    SELECT id FROM commerciaux
-                    WHERE tracking_code = :code
-                """)
-            else:  # partenaire
-                query = text("""
-                    SELECT id FROM partenaires
-                    WHERE tracking_code = :code
-                """)
-            
-            result = conn.execute(query, {"code": code}).fetchone()
-            
-            if result:
-                # Stocker l'information dans une table de tracking (à implémenter)
-                # ...
-                
-                # Pour l'exemple, on pourrait ajouter des paramètres à l'URL
-                if '?' in redirect_url:
-                    redirect_url += f"&ref_type={source_type}&ref_code={code}"
-                else:
-                    redirect_url += f"?ref_type={source_type}&ref_code={code}"
-            
-            return redirect(redirect_url)
-    except Exception as e:
-        logger.error(f"Error tracking visit: {str(e)}")
-        return redirect(redirect_url)  # En cas d'erreur, rediriger sans tracking
\ No newline at end of file
+    # Mettre la visite en tampon, elle sera écrite en base par lots
+    visit_buffer = current_app.config.get('visit_buffer')
+    if visit_buffer and source_type in TRACKING_SOURCE_TYPES:
+        visit_buffer.add(
+            source_type,
+            code,
+            request.remote_addr,
+            request.headers.get('User-Agent')
+        )
+    
+    return redirect(redirect_url)
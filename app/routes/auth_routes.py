@@ -1,12 +1,18 @@
 import logging
+import secrets
 from flask import Blueprint, request, jsonify, current_app
 from sqlalchemy import text
-from datetime import datetime
+from sqlalchemy.exc import IntegrityError
 from functools import wraps
 from flasgger import swag_from
+from pydantic import BaseModel, ValidationError
 
-from app.utils.password_utils import hash_password, verify_password
-from app.utils.jwt_utils import create_access_token, create_refresh_token, decode_token
+from app.utils.password_utils import hash_password, verify_password, password_needs_rehash
+from app.utils.jwt_utils import create_access_token, create_token_pair, decode_token, get_bearer_token, verify_access_token
+from app.utils.json_provider import dumps_bytes
+from app.utils.redis_utils import (
+    blacklist_token, is_token_blacklisted, get_cached_user, cache_user, invalidate_user
+)
 
 # Configurer le logging
 logger = logging.getLogger(__name__)
@@ -14,30 +20,154 @@ logger = logging.getLogger(__name__)
 # Créer le blueprint pour les routes d'authentification par email
 auth_bp = Blueprint('auth', __name__, url_prefix='/auth')
 
+# Hash vérifié quand l'email est inconnu, pour que la durée de réponse ne révèle pas l'existence du compte
+_DUMMY_HASH = hash_password(secrets.token_urlsafe(16))
+
+# Requêtes SQL construites une seule fois au chargement du module
+# Inscription: vérifie que l'email est libre puis crée l'utilisateur et son authentification
+# (aucune ligne retournée si l'email est déjà utilisé)
+_SIGNUP_QUERY = text("""
+    WITH taken AS (
+        SELECT EXISTS (SELECT 1 FROM authentifications WHERE email = :email)
+            OR EXISTS (SELECT 1 FROM users WHERE email = :email) AS taken
+    ),
+    new_user AS (
+        INSERT INTO users (
+            email, full_name, role, created_at, last_login_at, account_status
+        )
+        SELECT :email, :full_name, :role, NOW(), NOW(), 'pending'
+        FROM taken
+        WHERE NOT taken.taken
+        RETURNING id
+    ),
+    new_auth AS (
+        INSERT INTO authentifications (
+            user_id, provider, email, password_hash, created_at
+        )
+        SELECT id, 'email', :email, :password_hash, NOW()
+        FROM new_user
+    )
+    SELECT id FROM new_user
+""")
+
+# Connexion: authentification par email et utilisateur associé
+_LOGIN_QUERY = text("""
+    SELECT a.id as auth_id, a.password_hash, a.user_id,
+           u.email, u.full_name, u.role
+    FROM authentifications a
+    JOIN users u ON a.user_id = u.id
+    WHERE a.email = :email AND a.provider = 'email'
+""")
+
+# Migration d'un hash de mot de passe obsolète
+_UPDATE_PASSWORD_HASH_QUERY = text("""
+    UPDATE authentifications
+    SET password_hash = :password_hash
+    WHERE id = :auth_id
+""")
+
+# Dates de dernière connexion (authentification et utilisateur en une requête)
+_TOUCH_LOGIN_QUERY = text("""
+    WITH touched_auth AS (
+        UPDATE authentifications
+        SET last_login_at = NOW()
+        WHERE id = :auth_id
+        RETURNING 1
+    )
+    UPDATE users
+    SET last_login_at = NOW()
+    WHERE id = :user_id
+""")
+
+# Profil de l'utilisateur connecté
+_ME_QUERY = text("""
+    SELECT id, email, full_name, role, bio, phone_number, stripe_account_id,
+           payout_enabled, rating, account_status, kyc_status, created_at,
+           last_login_at, total_revenue
+    FROM users
+    WHERE id = :user_id
+""")
+
+# Rôles acceptés à l'inscription
+VALID_ROLES = frozenset({'freelance', 'client', 'admin', 'agent'})
+
+# Corps JSON attendus par les routes d'authentification
+class SignupBody(BaseModel):
+    email: str
+    password: str
+    full_name: str
+    role: str = 'freelance'
+
+class LoginBody(BaseModel):
+    email: str
+    password: str
+
+class RefreshBody(BaseModel):
+    refresh_token: str
+
+def _parse_body(model):
+    """
+    Décode et valide le corps JSON de la requête en une seule passe
+
+    Returns:
+        tuple: (corps validé, None) ou (None, réponse d'erreur 400)
+    """
+    raw_body = request.get_data(cache=False)
+    if not raw_body:
+        return None, (jsonify({'message': 'No input data provided'}), 400)
+
+    try:
+        return model.model_validate_json(raw_body), None
+    except ValidationError as e:
+        error = e.errors()[0]
+        if error['type'] == 'missing':
+            message = f"Field {error['loc'][0]} is required"
+        elif error['loc'] and error['type'] != 'json_invalid':
+            message = f"Field {error['loc'][0]}: {error['msg']}"
+        else:
+            message = 'Invalid JSON body'
+        return None, (jsonify({'message': message}), 400)
+
+# Routes dont le corps doit être du JSON, et taille maximale acceptée pour ce corps
+_JSON_BODY_ENDPOINTS = frozenset({'auth.signup', 'auth.login', 'auth.refresh'})
+MAX_AUTH_BODY_BYTES = 16 * 1024
+
+@auth_bp.before_request
+def reject_invalid_body():
+    """
+    Rejette les corps non JSON ou trop volumineux avant tout décodage
+    """
+    if request.method != 'POST' or request.endpoint not in _JSON_BODY_ENDPOINTS:
+        return None
+
+    if not request.is_json:
+        return jsonify({'message': 'Content-Type must be application/json'}), 415
+
+    if request.content_length is not None and request.content_length > MAX_AUTH_BODY_BYTES:
+        return jsonify({'message': 'Request body too large'}), 413
+
+    # S'applique aussi aux corps sans Content-Length (transfert par blocs)
+    request.max_content_length = MAX_AUTH_BODY_BYTES
+    return None
+
 # Middleware d'authentification pour les routes protégées
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = None
-        auth_header = request.headers.get('Authorization')
-        
-        if auth_header:
-            parts = auth_header.split()
-            if len(parts) == 2 and parts[0].lower() == 'bearer':
-                token = parts[1]
+        # Format attendu: "Bearer <token>"
+        token = get_bearer_token(request.headers.get('Authorization'))
         
         if not token:
             return jsonify({'message': 'Token is missing!'}), 401
         
-        payload = decode_token(token)
+        # Signature, type et révocation du token vérifiés comme sur les autres blueprints
+        payload = verify_access_token(token, current_app.config.get('redis_client'))
         if not payload:
             return jsonify({'message': 'Token is invalid!'}), 401
         
-        if payload.get('type') != 'access':
-            return jsonify({'message': 'Invalid token type. Access token required.'}), 401
-        
-        # Add user_id to request for route handlers
+        # Add user_id and token payload to request for route handlers
         request.user_id = int(payload['sub'])
+        request.jwt_payload = payload
         
         return f(*args, **kwargs)
     
@@ -102,27 +232,21 @@ def signup():
       500:
         description: Erreur serveur
     """
-    data = request.json
-    
     # Vérifier les données requises
-    if not data:
-        return jsonify({'message': 'No input data provided'}), 400
+    body, error = _parse_body(SignupBody)
+    if error:
+        return error
     
-    required_fields = ['email', 'password', 'full_name']
-    for field in required_fields:
-        if field not in data:
-            return jsonify({'message': f'Field {field} is required'}), 400
-    
-    email = data.get('email')
-    password = data.get('password')
-    full_name = data.get('full_name')
-    role = data.get('role', 'freelance')
+    email = body.email
+    password = body.password
+    full_name = body.full_name
+    role = body.role
     
     # Validation des données
     if len(password) < 8:
         return jsonify({'message': 'Password must be at least 8 characters long'}), 400
     
-    if role not in ['freelance', 'client', 'admin', 'agent']:
+    if role not in VALID_ROLES:
         return jsonify({'message': 'Invalid role. Must be one of: freelance, client, admin, agent'}), 400
     
     # Hachage du mot de passe
@@ -133,80 +257,36 @@ def signup():
         return jsonify({'message': 'Database connection error'}), 500
     
     try:
-        with engine.connect() as conn:
-            # Vérifier si l'email existe déjà
-            check_query = text("""
-                SELECT id FROM authentifications WHERE email = :email
-                UNION
-                SELECT id FROM users WHERE email = :email
-            """)
-            
-            existing_user = conn.execute(check_query, {"email": email}).fetchone()
-            
-            if existing_user:
-                return jsonify({'message': 'Email already in use'}), 409
-            
-            # Créer l'utilisateur
-            insert_user_query = text("""
-                INSERT INTO users (
-                    email, full_name, role, created_at, account_status
-                )
-                VALUES (
-                    :email, :full_name, :role, NOW(), 'pending'
-                )
-                RETURNING id
-            """)
-            
-            user_result = conn.execute(insert_user_query, {
+        # Transaction validée automatiquement à la sortie du bloc
+        with engine.begin() as conn:
+            # Vérifier que l'email est libre, créer l'utilisateur et son authentification en une requête
+            # (None si l'email est déjà utilisé)
+            user_id = conn.execute(_SIGNUP_QUERY, {
                 "email": email,
                 "full_name": full_name,
-                "role": role
-            })
-            
-            user_id = user_result.fetchone()[0]
-            
-            # Créer l'authentification
-            insert_auth_query = text("""
-                INSERT INTO authentifications (
-                    user_id, provider, email, password_hash, created_at
-                )
-                VALUES (
-                    :user_id, 'email', :email, :password_hash, NOW()
-                )
-            """)
-            
-            conn.execute(insert_auth_query, {
-                "user_id": user_id,
-                "email": email,
+                "role": role,
                 "password_hash": hashed_password
-            })
-            
-            # Mettre à jour la date de dernière connexion
-            update_login_query = text("""
-                UPDATE users
-                SET last_login_at = NOW()
-                WHERE id = :user_id
-            """)
-            
-            conn.execute(update_login_query, {"user_id": user_id})
-            
-            # Créer les JWT tokens
-            access_token = create_access_token(user_id)
-            refresh_token = create_refresh_token(user_id)
+            }).scalar()
             
-            # Valider la transaction
-            conn.commit()
-            
-            return jsonify({
-                'message': 'User created successfully',
-                'user_id': user_id,
-                'access_token': access_token,
-                'refresh_token': refresh_token
-            }), 201
+            if user_id is None:
+                return jsonify({'message': 'Email already in use'}), 409
+        
+        # Créer les JWT tokens
+        access_token, refresh_token = create_token_pair(user_id)
+        
+        return jsonify({
+            'message': 'User created successfully',
+            'user_id': user_id,
+            'access_token': access_token,
+            'refresh_token': refresh_token
+        }), 201
     
-    except Exception as e:
-        logger.error(f"Error creating user: {str(e)}")
-        return jsonify({'message': f'An error occurred: {str(e)}'}), 500
+    except IntegrityError:
+        # Inscription concurrente avec le même email (index unique sur users.email)
+        return jsonify({'message': 'Email already in use'}), 409
+    except Exception:
+        logger.exception("Error creating user")
+        return jsonify({'message': 'Internal error'}), 500
 
 @auth_bp.route('/login', methods=['POST'])
 def login():
@@ -269,76 +349,58 @@ def login():
       500:
         description: Erreur serveur
     """
-    data = request.json
-    
     # Vérifier les données requises
-    if not data:
-        return jsonify({'message': 'No input data provided'}), 400
+    body, error = _parse_body(LoginBody)
+    if error:
+        return error
     
-    required_fields = ['email', 'password']
-    for field in required_fields:
-        if field not in data:
-            return jsonify({'message': f'Field {field} is required'}), 400
-    
-    email = data.get('email')
-    password = data.get('password')
+    email = body.email
+    password = body.password
     
     engine = current_app.config.get('db_engine')
     if not engine:
         return jsonify({'message': 'Database connection error'}), 500
     
     try:
-        with engine.connect() as conn:
+        # Transaction validée automatiquement à la sortie du bloc
+        with engine.begin() as conn:
             # Récupérer l'utilisateur
-            query = text("""
-                SELECT a.id as auth_id, a.password_hash, a.user_id,
-                       u.email, u.full_name, u.role
-                FROM authentifications a
-                JOIN users u ON a.user_id = u.id
-                WHERE a.email = :email AND a.provider = 'email'
-            """)
-            
-            user = conn.execute(query, {"email": email}).fetchone()
+            user = conn.execute(_LOGIN_QUERY, {"email": email}).first()
             
-            if not user or not verify_password(password, user.password_hash):
+            stored_hash = user.password_hash if user else _DUMMY_HASH
+            password_ok = verify_password(password, stored_hash)
+            if not user or not password_ok:
                 return jsonify({'message': 'Invalid email or password'}), 401
             
-            # Mettre à jour la date de dernière connexion
-            conn.execute(text("""
-                UPDATE authentifications
-                SET last_login_at = NOW()
-                WHERE id = :auth_id
-            """), {"auth_id": user.auth_id})
-
-            conn.execute(text("""
-                UPDATE users
-                SET last_login_at = NOW()
-                WHERE id = :user_id
-            """), {"user_id": user.user_id})
+            # Migrer les anciens hashs (bcrypt) vers argon2id dans la même transaction
+            if password_needs_rehash(user.password_hash):
+                conn.execute(_UPDATE_PASSWORD_HASH_QUERY, {"password_hash": hash_password(password), "auth_id": user.auth_id})
             
-            # Créer les JWT tokens
-            access_token = create_access_token(user.user_id)
-            refresh_token = create_refresh_token(user.user_id)
-            
-            # Valider la transaction
-            conn.commit()
-            
-            return jsonify({
-                'message': 'Login successful',
-                'user_id': user.user_id,
-                'access_token': access_token,
-                'refresh_token': refresh_token,
-                'user': {
-                    'id': user.user_id,
-                    'email': user.email,
-                    'full_name': user.full_name,
-                    'role': user.role
-                }
-            }), 200
+            # Mettre à jour la date de dernière connexion
+            conn.execute(_TOUCH_LOGIN_QUERY, {"auth_id": user.auth_id, "user_id": user.user_id})
+        
+        # last_login_at a changé, le profil en cache n'est plus à jour
+        invalidate_user(current_app.config.get('redis_client'), user.user_id)
+        
+        # Créer les JWT tokens
+        access_token, refresh_token = create_token_pair(user.user_id)
+        
+        return jsonify({
+            'message': 'Login successful',
+            'user_id': user.user_id,
+            'access_token': access_token,
+            'refresh_token': refresh_token,
+            'user': {
+                'id': user.user_id,
+                'email': user.email,
+                'full_name': user.full_name,
+                'role': user.role
+            }
+        }), 200
     
-    except Exception as e:
-        logger.error(f"Error during login: {str(e)}")
-        return jsonify({'message': f'An error occurred: {str(e)}'}), 500
+    except Exception:
+        logger.exception("Error during login")
+        return jsonify({'message': 'Internal error'}), 500
 
 @auth_bp.route('/refresh', methods=['POST'])
 def refresh():
@@ -375,13 +437,12 @@ def refresh():
       500:
         description: Erreur serveur
     """
-    data = request.json
-    
     # Vérifier les données requises
-    if not data or 'refresh_token' not in data:
-        return jsonify({'message': 'Refresh token is required'}), 400
+    body, error = _parse_body(RefreshBody)
+    if error:
+        return error
     
-    refresh_token = data.get('refresh_token')
+    refresh_token = body.refresh_token
     
     # Vérifier et décoder le token
     payload = decode_token(refresh_token)
@@ -392,6 +453,10 @@ def refresh():
     if payload.get('type') != 'refresh':
         return jsonify({'message': 'Invalid token type. Refresh token required.'}), 401
     
+    # Un refresh token révoqué à la déconnexion ne permet plus d'obtenir de token d'accès
+    if is_token_blacklisted(current_app.config.get('redis_client'), payload):
+        return jsonify({'message': 'Token has been revoked!'}), 401
+    
     try:
         # Créer un nouveau token d'accès
         user_id = payload['sub']
@@ -401,9 +466,9 @@ def refresh():
             'access_token': new_access_token
         }), 200
     
-    except Exception as e:
-        logger.error(f"Error refreshing token: {str(e)}")
-        return jsonify({'message': f'An error occurred: {str(e)}'}), 500
+    except Exception:
+        logger.exception("Error refreshing token")
+        return jsonify({'message': 'Internal error'}), 500
 
 @auth_bp.route('/me', methods=['GET'])
 @token_required
@@ -433,9 +498,38 @@ def get_me():
             role:
               type: string
               description: Rôle de l'utilisateur
+            bio:
+              type: string
+              description: Biographie de l'utilisateur
+            phone_number:
+              type: string
+              description: Numéro de téléphone
+            stripe_account_id:
+              type: string
+              description: ID du compte Stripe Connect
+            payout_enabled:
+              type: boolean
+              description: Versements Stripe activés
+            kyc_status:
+              type: string
+              description: Statut de vérification d'identité
             account_status:
               type: string
               description: Statut du compte
+            created_at:
+              type: string
+              format: date-time
+              description: Date de création du compte
+            last_login_at:
+              type: string
+              format: date-time
+              description: Date de dernière connexion
+            rating:
+              type: number
+              description: Note moyenne
+            total_revenue:
+              type: number
+              description: Revenu total
       401:
         description: Non authentifié ou token invalide
       404:
@@ -444,6 +538,12 @@ def get_me():
         description: Erreur serveur
     """
     user_id = request.user_id
+    redis_client = current_app.config.get('redis_client')
+    
+    # Profil en cache (déjà encodé en JSON)
+    cached_user = get_cached_user(redis_client, user_id)
+    if cached_user is not None:
+        return current_app.response_class(cached_user, mimetype='application/json')
     
     engine = current_app.config.get('db_engine')
     if not engine:
@@ -452,49 +552,41 @@ def get_me():
     try:
         with engine.connect() as conn:
             # Récupérer les informations de l'utilisateur
-            query = text("""
-                SELECT id, email, full_name, role, bio, phone_number, stripe_account_id,
-                       payout_enabled, rating, account_status, kyc_status, created_at,
-                       last_login_at, total_revenue
-                FROM users
-                WHERE id = :user_id
-            """)
-            
-            user = conn.execute(query, {"user_id": user_id}).fetchone()
+            user = conn.execute(_ME_QUERY, {"user_id": user_id}).first()
             
             if not user:
                 return jsonify({'message': 'User not found'}), 404
             
-            # Convertir en dictionnaire
-            user_dict = {column: getattr(user, column) for column in user._mapping.keys()}
-            
-            # Conversion des objets datetime en chaînes
-            for key, value in user_dict.items():
-                if isinstance(value, datetime):
-                    user_dict[key] = value.isoformat()
-            
-            # Conversion des valeurs décimales en float pour la sérialisation JSON
-            if user_dict.get('rating'):
-                user_dict['rating'] = float(user_dict['rating'])
-            if user_dict.get('total_revenue'):
-                user_dict['total_revenue'] = float(user_dict['total_revenue'])
+            # orjson encode les dates en ISO 8601 et les Decimal en nombres
+            user_json = dumps_bytes(dict(user._mapping), iso_dates=True)
+            cache_user(redis_client, user_id, user_json)
             
-            return jsonify(user_dict), 200
+            return current_app.response_class(user_json, mimetype='application/json')
     
-    except Exception as e:
-        logger.error(f"Error getting user data: {str(e)}")
-        return jsonify({'message': f'An error occurred: {str(e)}'}), 500
+    except Exception:
+        logger.exception("Error getting user data")
+        return jsonify({'message': 'Internal error'}), 500
 
 @auth_bp.route('/logout', methods=['POST'])
 @token_required
 def logout():
     """
-    Déconnexion de l'utilisateur (blacklist du token)
+    Déconnexion de l'utilisateur (blacklist du token d'accès et du refresh token)
     ---
     tags:
       - Authentification
     security:
       - Bearer: []
+    parameters:
+      - in: body
+        name: body
+        required: false
+        schema:
+          type: object
+          properties:
+            refresh_token:
+              type: string
+              description: Refresh token de la session, révoqué avec le token d'accès
     responses:
       200:
         description: Déconnexion réussie
@@ -509,8 +601,19 @@ def logout():
       500:
         description: Erreur serveur
     """
-    # Dans une implémentation réelle, on ajouterait le token à une blacklist
-    # Pour simplifier, on considère que le client supprimera le token côté frontend
+    redis_client = current_app.config.get('redis_client')
+    
+    # Révoquer le token jusqu'à son expiration (sans Redis, le client supprime le token côté frontend)
+    blacklist_token(redis_client, request.jwt_payload)
+    
+    # Révoquer aussi le refresh token de la session s'il est fourni et appartient à l'utilisateur
+    data = request.get_json(silent=True) or {}
+    refresh_token = data.get('refresh_token') if isinstance(data, dict) else None
+    if isinstance(refresh_token, str):
+        refresh_payload = decode_token(refresh_token)
+        if (refresh_payload and refresh_payload.get('type') == 'refresh'
+                and refresh_payload.get('sub') == request.jwt_payload.get('sub')):
+            blacklist_token(redis_client, refresh_payload)
     
     return jsonify({
         'message': 'Successfully logged out'
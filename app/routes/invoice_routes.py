@@ -1,14 +1,22 @@
+import io
 import os
 import logging
-import json
 from datetime import datetime, timedelta
+from typing import List, Literal, Optional
 from flask import Blueprint, request, jsonify, send_file, current_app
 from sqlalchemy import text
-from functools import wraps
-import tempfile
+from functools import lru_cache, wraps
 import uuid
+from pydantic import BaseModel, Field, ValidationError
 
+from app.utils.jwt_utils import get_bearer_token, verify_access_token
+from app.utils.json_provider import dumps_bytes
+from app.utils.pagination import encode_cursor, decode_cursor
+from app.utils.redis_utils import (
+    get_cached_payment_session, cache_payment_session, invalidate_payment_session
+)
 from app.utils.stripe_utils import create_checkout_session
+from app.utils.user_management import load_user_role
 
 # Configurer le logging
 logger = logging.getLogger(__name__)
@@ -16,37 +24,263 @@ logger = logging.getLogger(__name__)
 # Créer le blueprint pour les routes des devis et factures
 invoice_bp = Blueprint('invoice', __name__, url_prefix='/devis')
 
+# Client existant et appartenant à l'utilisateur (ou utilisateur admin)
+_CLIENT_ACCESS_QUERY = text("""
+    SELECT id 
+    FROM clients 
+    WHERE id = :client_id AND (created_by_user = :user_id OR :is_admin)
+""")
+
+# Création d'un devis/facture et de ses lignes en une requête
+# (les lignes sont passées en tableaux parallèles, dans l'ordre du document)
+_INSERT_INVOICE_QUERY = text("""
+    WITH new_doc AS (
+        INSERT INTO devis_factures (
+            user_id, client_id, type, status, date, due_date,
+            total_ht, total_tva, total_ttc, notes
+        )
+        VALUES (
+            :user_id, :client_id, :type, :status, NOW(),
+            :due_date, :total_ht, :total_tva, :total_ttc, :notes
+        )
+        RETURNING id
+    ),
+    new_lines AS (
+        INSERT INTO devis_factures_lignes (
+            devis_id, ordre, type_ligne, description,
+            quantite, prix_unitaire_ht, tva
+        )
+        SELECT new_doc.id, l.ordre, CAST(l.type_ligne AS type_ligne_enum), l.description,
+               l.quantite, l.prix_unitaire_ht, l.tva
+        FROM new_doc, unnest(
+            CAST(:ordres AS int[]),
+            CAST(:types_ligne AS text[]),
+            CAST(:descriptions AS text[]),
+            CAST(:quantites AS numeric[]),
+            CAST(:prix_unitaires_ht AS numeric[]),
+            CAST(:tvas AS numeric[])
+        ) AS l(ordre, type_ligne, description, quantite, prix_unitaire_ht, tva)
+    )
+    SELECT id FROM new_doc
+""")
+
+# Document et ses lignes en une requête (accès réservé au propriétaire et aux admins)
+_INVOICE_QUERY = text("""
+    SELECT df.*, c.full_name as client_name, c.email as client_email,
+           u.full_name as freelance_name, u.email as freelance_email,
+           COALESCE((
+               SELECT json_agg(l ORDER BY l.ordre)
+               FROM (
+                   SELECT id, ordre, type_ligne, description, quantite, prix_unitaire_ht, tva,
+                          total_ht, total_tva, total_ttc
+                   FROM devis_factures_lignes
+                   WHERE devis_id = df.id
+               ) l
+           ), '[]'::json) as lignes
+    FROM devis_factures df
+    LEFT JOIN clients c ON df.client_id = c.id
+    LEFT JOIN users u ON df.user_id = u.id
+    WHERE df.id = :doc_id AND (df.user_id = :user_id OR :is_admin)
+""")
+
+# URL du PDF généré
+_UPDATE_PDF_URL_QUERY = text("""
+    UPDATE devis_factures
+    SET pdf_url = :pdf_url
+    WHERE id = :doc_id
+""")
+
+# Changement de statut d'un document, accès vérifié dans la même requête
+# (la date de paiement est celle du serveur de base de données)
+_UPDATE_STATUS_QUERY = text("""
+    UPDATE devis_factures
+    SET status = :status,
+        payment_date = CASE WHEN :status = 'payé' THEN NOW() ELSE NULL END
+    WHERE id = :doc_id AND (user_id = :user_id OR :is_admin)
+    RETURNING id, status, payment_date
+""")
+
+# Passage au statut en_paiement du document à payer et lecture des informations
+# de paiement en une requête (les documents payés ou sans client sont exclus, de même
+# qu'un paiement en cours réservé depuis moins de PAYMENT_CLAIM_TIMEOUT secondes ;
+# une ligne déjà verrouillée par une autre requête est ignorée sans attente).
+# Une réservation expirée, dont le statut d'origine est perdu, sera rétablie en_attente.
+_CLAIM_PAYMENT_QUERY = text("""
+    WITH upd AS (
+        UPDATE devis_factures df
+        SET status = 'en_paiement', payment_claimed_at = NOW()
+        FROM (
+            SELECT id, status FROM devis_factures
+            WHERE id = :doc_id
+            FOR UPDATE SKIP LOCKED
+        ) old
+        WHERE df.id = old.id
+          AND df.client_id IS NOT NULL
+          AND df.status <> 'payé'
+          AND (df.status <> 'en_paiement'
+               OR df.payment_claimed_at IS NULL
+               OR df.payment_claimed_at < NOW() - :claim_timeout * INTERVAL '1 second')
+        RETURNING df.id, df.type, df.client_id, df.total_ttc, df.user_id,
+                  CASE WHEN old.status = 'en_paiement' THEN 'en_attente'
+                       ELSE old.status::text END as previous_status
+    )
+    SELECT upd.id, upd.type, upd.client_id, upd.previous_status,
+           (upd.total_ttc * 100)::bigint as amount_cents,
+           upd.user_id as freelance_id, u.stripe_account_id, u.payout_enabled,
+           c.full_name as client_name, u.full_name as freelance_name
+    FROM upd
+    JOIN users u ON upd.user_id = u.id
+    JOIN clients c ON upd.client_id = c.id
+""")
+
+# Statut d'un document qui n'a pas pu être passé en paiement
+# (un document sans client est traité comme introuvable)
+_DOCUMENT_STATUS_QUERY = text("""
+    SELECT status FROM devis_factures
+    WHERE id = :doc_id AND client_id IS NOT NULL
+""")
+
+# Document passé au statut envoyé une fois la session de paiement créée
+_MARK_SENT_QUERY = text("""
+    UPDATE devis_factures
+    SET status = 'envoyé', stripe_session_id = :session_id, payment_claimed_at = NULL
+    WHERE id = :doc_id AND status = 'en_paiement'
+""")
+
+# Statut précédent rétabli si la session de paiement n'a pas pu être créée ou enregistrée
+_RESTORE_STATUS_QUERY = text("""
+    UPDATE devis_factures
+    SET status = :previous_status, payment_claimed_at = NULL
+    WHERE id = :doc_id AND status = 'en_paiement'
+""")
+
+# Durée (en secondes) après laquelle un document resté en_paiement peut être réservé à nouveau
+PAYMENT_CLAIM_TIMEOUT = 600
+
+# Types et statuts de document acceptés par les filtres de la liste (en_paiement est
+# posé par le paiement uniquement, les corps de requête ne l'acceptent pas)
+INVOICE_TYPES = frozenset({'devis', 'facture'})
+INVOICE_STATUSES = frozenset({'en_attente', 'envoyé', 'payé', 'annulé', 'en_paiement'})
+
+# Libellé de chaque type de document (description du paiement)
+_DOC_LABELS = {'devis': 'Devis', 'facture': 'Facture'}
+
+# Corps JSON attendus par les routes de création et de mise à jour
+class InvoiceLineBody(BaseModel):
+    type_ligne: Literal['produit', 'service', 'texte', 'remise', 'custom'] = 'produit'
+    description: str = ''
+    quantite: float = 1
+    prix_unitaire_ht: float = 0
+    tva: float = 20
+
+class InvoiceCreateBody(BaseModel):
+    type: Literal['devis', 'facture']
+    client_id: int
+    lignes: List[InvoiceLineBody] = Field(min_length=1)
+    status: Literal['en_attente', 'envoyé', 'payé', 'annulé'] = 'en_attente'
+    due_date: Optional[datetime] = None
+    notes: Optional[str] = ''
+
+class InvoiceStatusBody(BaseModel):
+    status: Literal['en_attente', 'envoyé', 'payé', 'annulé']
+
+def _parse_body(model, field_messages):
+    """
+    Décode et valide le corps JSON de la requête en une seule passe
+    
+    Args:
+        model: Modèle pydantic attendu
+        field_messages: Messages d'erreur par champ (tuple loc -> message)
+    
+    Returns:
+        tuple: (corps validé, None) ou (None, réponse d'erreur 400)
+    """
+    try:
+        return model.model_validate_json(request.get_data(cache=False)), None
+    except ValidationError as e:
+        error = e.errors()[0]
+        loc = tuple(error['loc'])
+        if error['type'] == 'missing':
+            message = f'Le champ {loc[0]} est requis'
+        elif loc in field_messages:
+            message = field_messages[loc]
+        elif loc and error['type'] != 'json_invalid':
+            message = f"Champ {'.'.join(str(part) for part in loc)} invalide: {error['msg']}"
+        else:
+            message = 'Corps JSON invalide'
+        return None, (jsonify({'message': message}), 400)
+
+def _invoices_query_parts(is_admin, has_type, has_status, has_client_id, has_cursor):
+    """
+    Produit les fragments SQL de la requête de liste des devis/factures
+    """
+    yield "SELECT df.*, c.full_name as client_name, c.email as client_email"
+    # Le nombre total de résultats n'est calculé (fenêtre sur la même requête)
+    # que pour la pagination par décalage
+    if not has_cursor:
+        yield "    , COUNT(*) OVER () as _total_count"
+    yield "FROM devis_factures df LEFT JOIN clients c ON df.client_id = c.id WHERE 1=1"
+    
+    if not is_admin:
+        yield "AND df.user_id = :user_id"
+    if has_type:
+        yield "AND df.type = :type"
+    if has_status:
+        yield "AND df.status = :status"
+    if has_client_id:
+        yield "AND df.client_id = :client_id"
+    if has_cursor:
+        yield "AND (df.date, df.id) < (:cursor_date, :cursor_id)"
+    
+    yield "ORDER BY df.date DESC, df.id DESC"
+    yield "LIMIT :limit" if has_cursor else "LIMIT :limit OFFSET :offset"
+
+@lru_cache(maxsize=32)
+def _build_invoices_query(is_admin, has_type, has_status, has_client_id, has_cursor):
+    """
+    Construit la requête de liste des devis/factures pour une combinaison de
+    filtres. Le résultat est mis en cache, il n'y a que 32 variantes.
+    """
+    return text(" ".join(_invoices_query_parts(is_admin, has_type, has_status, has_client_id, has_cursor)))
+
 # Middleware d'authentification (identique à celui dans stripe_routes.py)
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = None
-        auth_header = request.headers.get('Authorization')
-        
-        if auth_header:
-            parts = auth_header.split()
-            if len(parts) == 2 and parts[0].lower() == 'bearer':
-                token = parts[1]
+        # Format attendu: "Bearer <token>"
+        token = get_bearer_token(request.headers.get('Authorization'))
         
         if not token:
             return jsonify({'message': 'Token is missing!'}), 401
         
-        # Importer decode_token depuis jwt_utils
-        from app.utils.jwt_utils import decode_token
-        
         try:
-            payload = decode_token(token)
+            # Signature, type et révocation du token vérifiés au même endroit pour toutes les routes
+            payload = verify_access_token(token, current_app.config.get('redis_client'))
             if not payload:
                 return jsonify({'message': 'Token is invalid!'}), 401
             
             # Add user_id to request for route handlers
             request.user_id = int(payload['sub'])
-            
-            return f(*args, **kwargs)
         except Exception as e:
             logger.error(f"Token verification error: {str(e)}")
             return jsonify({'message': 'Token is invalid!'}), 401
         
+        engine = current_app.config.get('db_engine')
+        if not engine:
+            return jsonify({'message': 'Database connection error'}), 500
+        
+        try:
+            # Rôle mis en cache quelques secondes, partagé par toutes les routes
+            request.user_role = load_user_role(engine, request.user_id)
+        except Exception as e:
+            logger.error(f"Error loading user role: {str(e)}")
+            return jsonify({'message': f'An error occurred: {str(e)}'}), 500
+        
+        if request.user_role is None:
+            return jsonify({'message': 'User not found'}), 404
+        
+        return f(*args, **kwargs)
+    
     return decorated
 
 # Endpoint pour lister tous les devis/factures
@@ -69,7 +303,7 @@ def get_invoices():
       - in: query
         name: status
         type: string
-        enum: [en_attente, envoyé, payé, annulé]
+        enum: [en_attente, envoyé, payé, annulé, en_paiement]
         description: Filtrer par statut du document
       - in: query
         name: client_id
@@ -84,10 +318,14 @@ def get_invoices():
         name: offset
         type: integer
         default: 0
-        description: Décalage pour la pagination
+        description: Décalage pour la pagination (obsolète, ignoré si cursor est fourni)
+      - in: query
+        name: cursor
+        type: string
+        description: Curseur de pagination renvoyé dans l'en-tête X-Next-Cursor de la page précédente
     responses:
       200:
-        description: Liste des devis et factures
+        description: Liste des devis et factures (l'en-tête X-Next-Cursor contient le curseur de la page suivante, et X-Total-Count le nombre total de résultats hors pagination par curseur)
         schema:
           type: array
           items:
@@ -102,7 +340,7 @@ def get_invoices():
                 description: Type de document
               status:
                 type: string
-                enum: [en_attente, envoyé, payé, annulé]
+                enum: [en_attente, envoyé, payé, annulé, en_paiement]
                 description: Statut du document
               date:
                 type: string
@@ -136,80 +374,91 @@ def get_invoices():
         description: Erreur serveur
     """
     user_id = request.user_id
+    is_admin = request.user_role == 'admin'
     
     # Récupérer les filtres de la requête
     type_doc = request.args.get('type')  # 'devis' ou 'facture'
-    status = request.args.get('status')  # 'en_attente', 'envoyé', 'payé', 'annulé'
+    status = request.args.get('status')  # 'en_attente', 'envoyé', 'payé', 'annulé', 'en_paiement'
     client_id = request.args.get('client_id')
     limit = request.args.get('limit', 50, type=int)
     offset = request.args.get('offset', 0, type=int)
+    cursor = request.args.get('cursor')
     
-    engine = current_app.config.get('db_engine')
+    if limit <= 0 or offset < 0:
+        return jsonify({'message': 'limit doit être strictement positif et offset positif ou nul'}), 400
+    
+    if type_doc and type_doc not in INVOICE_TYPES:
+        return jsonify({'message': 'Le type doit être devis ou facture'}), 400
+    
+    if status and status not in INVOICE_STATUSES:
+        return jsonify({'message': 'Statut invalide'}), 400
+    
+    if cursor:
+        try:
+            cursor_date, cursor_id = decode_cursor(cursor)
+        except ValueError:
+            return jsonify({'message': 'Invalid cursor'}), 400
+    
+    # Lectures sur la réplique si elle est configurée
+    engine = current_app.config.get('db_engine_ro') or current_app.config.get('db_engine')
     if not engine:
         return jsonify({'message': 'Database connection error'}), 500
     
     try:
-        with engine.connect() as conn:
-            # Vérifier le rôle de l'utilisateur
-            role_query = text("SELECT role FROM users WHERE id = :id")
-            role_result = conn.execute(role_query, {"id": user_id}).fetchone()
-            
-            if not role_result:
-                return jsonify({'message': 'User not found'}), 404
-            
-            is_admin = role_result.role == 'admin'
-            
-            # Construire la requête SQL avec les filtres
-            query_parts = [
-                "SELECT df.*, c.full_name as client_name, c.email as client_email",
-                "FROM devis_factures df",
-                "LEFT JOIN clients c ON df.client_id = c.id",
-                "WHERE 1=1"
-            ]
-            
-            params = {}
+        # Lecture seule: pas de transaction à ouvrir ni à valider
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT", postgresql_readonly=True) as conn:
+            # Paramètres de la requête selon les filtres actifs
+            params = {"limit": limit}
             
             # Filtrer par utilisateur sauf pour les admins
             if not is_admin:
-                query_parts.append("AND df.user_id = :user_id")
                 params["user_id"] = user_id
-            
-            # Ajouter les filtres
             if type_doc:
-                query_parts.append("AND df.type = :type")
                 params["type"] = type_doc
-                
             if status:
-                query_parts.append("AND df.status = :status")
                 params["status"] = status
-                
             if client_id:
-                query_parts.append("AND df.client_id = :client_id")
                 params["client_id"] = int(client_id)
             
-            # Ajouter l'ordre et la pagination
-            query_parts.append("ORDER BY df.date DESC")
-            query_parts.append("LIMIT :limit OFFSET :offset")
-            params["limit"] = limit
-            params["offset"] = offset
+            # Pagination par curseur sur (date, id) si fourni, sinon par décalage
+            if cursor:
+                params["cursor_date"] = cursor_date
+                params["cursor_id"] = cursor_id
+            else:
+                params["offset"] = offset
             
-            # Exécuter la requête
-            query = text(" ".join(query_parts))
+            # Exécuter la requête (une seule construction par combinaison de filtres)
+            query = _build_invoices_query(
+                is_admin,
+                bool(type_doc),
+                bool(status),
+                bool(client_id),
+                bool(cursor)
+            )
             invoices = conn.execute(query, params).fetchall()
             
             # Convertir les résultats en liste de dictionnaires
-            result = []
-            for invoice in invoices:
-                invoice_dict = {column: getattr(invoice, column) for column in invoice._mapping.keys()}
-                
-                # Conversion des valeurs décimales en float pour la sérialisation JSON
-                for key in ['total_ht', 'total_tva', 'total_ttc']:
-                    if invoice_dict.get(key):
-                        invoice_dict[key] = float(invoice_dict[key])
-                
-                result.append(invoice_dict)
+            # (les montants Decimal sont convertis par le fournisseur JSON)
+            result = [dict(invoice._mapping) for invoice in invoices]
             
-            return jsonify(result)
+            # Nombre total de résultats (pagination par décalage uniquement)
+            total_count = None
+            for invoice_dict in result:
+                total_count = invoice_dict.pop('_total_count', None)
+            if not cursor and not result and offset == 0:
+                total_count = 0
+            
+            response = jsonify(result)
+            
+            if total_count is not None:
+                response.headers['X-Total-Count'] = str(total_count)
+            
+            # Curseur de la page suivante à partir de la dernière ligne
+            if limit > 0 and len(result) == limit and result[-1]['date'] is not None:
+                last = result[-1]
+                response.headers['X-Next-Cursor'] = encode_cursor(last['date'], last['id'])
+            
+            return response
     except Exception as e:
         logger.error(f"Error getting invoices: {str(e)}")
         return jsonify({'message': f'An error occurred: {str(e)}'}), 500
@@ -310,117 +559,70 @@ def create_invoice():
         description: Erreur serveur
     """
     user_id = request.user_id
-    data = request.json
+    is_admin = request.user_role == 'admin'
     
-    # Valider les données requises
-    required_fields = ['type', 'client_id', 'lignes']
-    for field in required_fields:
-        if field not in data:
-            return jsonify({'message': f'Le champ {field} est requis'}), 400
+    # Valider et convertir les données (type, statut, au moins une ligne, montants numériques)
+    body, error = _parse_body(InvoiceCreateBody, {
+        ('type',): 'Le type doit être devis ou facture',
+        ('status',): 'Statut invalide',
+        ('lignes',): 'Le document doit contenir au moins une ligne'
+    })
+    if error:
+        return error
     
     # Extraire les données
-    type_doc = data['type']
-    client_id = data['client_id']
-    lignes = data['lignes']
-    status = data.get('status', 'en_attente')
-    due_date = data.get('due_date')
-    notes = data.get('notes', '')
-    
-    # Valider le type de document
-    if type_doc not in ['devis', 'facture']:
-        return jsonify({'message': 'Le type doit être devis ou facture'}), 400
-    
-    # Valider le statut
-    if status not in ['en_attente', 'envoyé', 'payé', 'annulé']:
-        return jsonify({'message': 'Statut invalide'}), 400
-    
-    # Valider qu'il y a au moins une ligne
-    if not lignes or not isinstance(lignes, list) or len(lignes) == 0:
-        return jsonify({'message': 'Le document doit contenir au moins une ligne'}), 400
+    type_doc = body.type
+    client_id = body.client_id
+    lignes = body.lignes
+    status = body.status
+    due_date = body.due_date
+    notes = body.notes
     
     engine = current_app.config.get('db_engine')
     if not engine:
         return jsonify({'message': 'Database connection error'}), 500
     
     try:
-        with engine.connect() as conn:
+        # Transaction validée automatiquement à la sortie du bloc
+        with engine.begin() as conn:
             # Vérifier si le client existe et appartient à l'utilisateur
-            client_query = text("""
-                SELECT id 
-                FROM clients 
-                WHERE id = :client_id AND (created_by_user = :user_id OR EXISTS (
-                    SELECT 1 FROM users WHERE id = :user_id AND role = 'admin'
-                ))
-            """)
-            
-            client = conn.execute(client_query, {
+            client = conn.execute(_CLIENT_ACCESS_QUERY, {
                 "client_id": client_id,
-                "user_id": user_id
+                "user_id": user_id,
+                "is_admin": is_admin
             }).fetchone()
             
             if not client:
                 return jsonify({'message': 'Client invalide ou non autorisé'}), 403
             
-            # Calculer les totaux
-            total_ht = sum(float(ligne.get('prix_unitaire_ht', 0)) * float(ligne.get('quantite', 1)) for ligne in lignes)
-            total_tva = sum(float(ligne.get('prix_unitaire_ht', 0)) * float(ligne.get('quantite', 1)) * float(ligne.get('tva', 20)) / 100 for ligne in lignes)
+            # Calculer les totaux en un seul parcours des lignes
+            total_ht = total_tva = 0.0
+            for ligne in lignes:
+                base_ht = ligne.prix_unitaire_ht * ligne.quantite
+                total_ht += base_ht
+                total_tva += base_ht * ligne.tva / 100
             total_ttc = total_ht + total_tva
             
-            # Créer le document
-            insert_query = text("""
-                INSERT INTO devis_factures (
-                    user_id, client_id, type, status, date, due_date,
-                    total_ht, total_tva, total_ttc, notes
-                )
-                VALUES (
-                    :user_id, :client_id, :type, :status, NOW(),
-                    :due_date, :total_ht, :total_tva, :total_ttc, :notes
-                )
-                RETURNING id
-            """)
-            
+            # Créer le document et ses lignes en un seul aller-retour
             params = {
                 "user_id": user_id,
                 "client_id": client_id,
                 "type": type_doc,
                 "status": status,
-                "due_date": due_date if due_date else (datetime.now() + timedelta(days=30)).isoformat(),
+                "due_date": due_date or datetime.now() + timedelta(days=30),
                 "total_ht": total_ht,
                 "total_tva": total_tva,
                 "total_ttc": total_ttc,
-                "notes": notes
+                "notes": notes,
+                "ordres": list(range(1, len(lignes) + 1)),
+                "types_ligne": [ligne.type_ligne for ligne in lignes],
+                "descriptions": [ligne.description for ligne in lignes],
+                "quantites": [ligne.quantite for ligne in lignes],
+                "prix_unitaires_ht": [ligne.prix_unitaire_ht for ligne in lignes],
+                "tvas": [ligne.tva for ligne in lignes]
             }
             
-            result = conn.execute(insert_query, params)
-            doc_id = result.fetchone()[0]
-            
-            # Insérer les lignes
-            for i, ligne in enumerate(lignes):
-                insert_line_query = text("""
-                    INSERT INTO devis_factures_lignes (
-                        devis_id, ordre, type_ligne, description,
-                        quantite, prix_unitaire_ht, tva
-                    )
-                    VALUES (
-                        :devis_id, :ordre, :type_ligne, :description,
-                        :quantite, :prix_unitaire_ht, :tva
-                    )
-                """)
-                
-                line_params = {
-                    "devis_id": doc_id,
-                    "ordre": i + 1,
-                    "type_ligne": ligne.get('type_ligne', 'produit'),
-                    "description": ligne.get('description', ''),
-                    "quantite": float(ligne.get('quantite', 1)),
-                    "prix_unitaire_ht": float(ligne.get('prix_unitaire_ht', 0)),
-                    "tva": float(ligne.get('tva', 20))
-                }
-                
-                conn.execute(insert_line_query, line_params)
-            
-            # Commit les changements
-            conn.commit()
+            doc_id = conn.execute(_INSERT_INVOICE_QUERY, params).scalar_one()
             
             # Retourner l'ID du document créé
             return jsonify({
@@ -434,6 +636,30 @@ def create_invoice():
         logger.error(f"Error creating invoice: {str(e)}")
         return jsonify({'message': f'An error occurred: {str(e)}'}), 500
 
+def _load_invoice(conn, doc_id, user_id, is_admin):
+    """
+    Charge un devis/facture avec ses lignes, si l'utilisateur y a accès
+    
+    Returns:
+        dict: Le document et ses lignes, ou None si non trouvé ou non autorisé
+    """
+    # Récupérer le document et ses lignes en une requête (accès réservé au propriétaire et aux admins)
+    document = conn.execute(_INVOICE_QUERY, {
+        "doc_id": doc_id,
+        "user_id": user_id,
+        "is_admin": is_admin
+    }).fetchone()
+    
+    if not document:
+        return None
+    
+    # Convertir en dictionnaire
+    doc_dict = dict(document._mapping)
+    
+    # Les lignes arrivent déjà décodées (json_agg), avec leurs totaux calculés
+    # par le trigger calculate_totals_trigger
+    return doc_dict
+
 # Endpoint pour récupérer un devis/facture spécifique
 @invoice_bp.route('/<int:doc_id>', methods=['GET'])
 @token_required
@@ -466,7 +692,7 @@ def get_invoice(doc_id):
               description: Type de document
             status:
               type: string
-              enum: [en_attente, envoyé, payé, annulé]
+              enum: [en_attente, envoyé, payé, annulé, en_paiement]
               description: Statut du document
             date:
               type: string
@@ -544,79 +770,21 @@ def get_invoice(doc_id):
         description: Erreur serveur
     """
     user_id = request.user_id
+    is_admin = request.user_role == 'admin'
     
-    engine = current_app.config.get('db_engine')
+    # Lectures sur la réplique si elle est configurée
+    engine = current_app.config.get('db_engine_ro') or current_app.config.get('db_engine')
     if not engine:
         return jsonify({'message': 'Database connection error'}), 500
     
     try:
-        with engine.connect() as conn:
-            # Vérifier le rôle de l'utilisateur
-            role_query = text("SELECT role FROM users WHERE id = :id")
-            role_result = conn.execute(role_query, {"id": user_id}).fetchone()
+        # Lecture seule: pas de transaction à ouvrir ni à valider
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT", postgresql_readonly=True) as conn:
+            doc_dict = _load_invoice(conn, doc_id, user_id, is_admin)
             
-            if not role_result:
-                return jsonify({'message': 'User not found'}), 404
-            
-            is_admin = role_result.role == 'admin'
-            
-            # Récupérer le document
-            doc_query = text("""
-                SELECT df.*, c.full_name as client_name, c.email as client_email,
-                       u.full_name as freelance_name, u.email as freelance_email
-                FROM devis_factures df
-                LEFT JOIN clients c ON df.client_id = c.id
-                LEFT JOIN users u ON df.user_id = u.id
-                WHERE df.id = :doc_id AND (df.user_id = :user_id OR :is_admin)
-            """)
-            
-            document = conn.execute(doc_query, {
-                "doc_id": doc_id,
-                "user_id": user_id,
-                "is_admin": is_admin
-            }).fetchone()
-            
-            if not document:
+            if not doc_dict:
                 return jsonify({'message': 'Document not found or unauthorized'}), 404
             
-            # Convertir en dictionnaire
-            doc_dict = {column: getattr(document, column) for column in document._mapping.keys()}
-            
-            # Conversion des valeurs décimales en float pour la sérialisation JSON
-            for key in ['total_ht', 'total_tva', 'total_ttc']:
-                if doc_dict.get(key):
-                    doc_dict[key] = float(doc_dict[key])
-            
-            # Récupérer les lignes du document
-            lines_query = text("""
-                SELECT id, ordre, type_ligne, description, quantite, prix_unitaire_ht, tva
-                FROM devis_factures_lignes
-                WHERE devis_id = :doc_id
-                ORDER BY ordre
-            """)
-            
-            lines = conn.execute(lines_query, {"doc_id": doc_id}).fetchall()
-            
-            # Convertir les lignes en liste de dictionnaires
-            lines_list = []
-            for line in lines:
-                line_dict = {column: getattr(line, column) for column in line._mapping.keys()}
-                
-                # Conversion des valeurs décimales en float pour la sérialisation JSON
-                for key in ['quantite', 'prix_unitaire_ht', 'tva']:
-                    if line_dict.get(key):
-                        line_dict[key] = float(line_dict[key])
-                
-                # Calculer les totaux de la ligne
-                line_dict['total_ht'] = line_dict['quantite'] * line_dict['prix_unitaire_ht']
-                line_dict['total_tva'] = line_dict['total_ht'] * (line_dict['tva'] / 100)
-                line_dict['total_ttc'] = line_dict['total_ht'] + line_dict['total_tva']
-                
-                lines_list.append(line_dict)
-            
-            # Ajouter les lignes au document
-            doc_dict['lignes'] = lines_list
-            
             return jsonify(doc_dict)
     except Exception as e:
         logger.error(f"Error getting invoice details: {str(e)}")
@@ -655,71 +823,45 @@ def generate_invoice_pdf(doc_id):
         description: Erreur serveur
     """
     user_id = request.user_id
+    is_admin = request.user_role == 'admin'
     
     engine = current_app.config.get('db_engine')
     if not engine:
         return jsonify({'message': 'Database connection error'}), 500
     
     try:
-        with engine.connect() as conn:
-            # Vérifier l'accès au document
-            access_query = text("""
-                SELECT 1
-                FROM devis_factures df
-                WHERE df.id = :doc_id AND (df.user_id = :user_id OR EXISTS (
-                    SELECT 1 FROM users WHERE id = :user_id AND role = 'admin'
-                ))
-            """)
-            
-            access = conn.execute(access_query, {
-                "doc_id": doc_id,
-                "user_id": user_id
-            }).fetchone()
+        # Transaction validée automatiquement à la sortie du bloc, avant la génération du PDF
+        with engine.begin() as conn:
+            # Récupérer le document et vérifier l'accès sur la même connexion
+            doc_data = _load_invoice(conn, doc_id, user_id, is_admin)
             
-            if not access:
+            if not doc_data:
                 return jsonify({'message': 'Document not found or unauthorized'}), 404
             
-            # Utiliser l'endpoint GET du document pour récupérer toutes les données
-            from flask import url_for
-            doc_data = json.loads(get_invoice(doc_id).data)
-            
-            # Générer le PDF avec les données
-            from app.utils.pdf_utils import generate_invoice_pdf
-            
-            pdf_bytes = generate_invoice_pdf(doc_data)
-            
-            # Créer un fichier temporaire pour le PDF
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
-            temp_file.write(pdf_bytes)
-            temp_file.close()
-            
-            # Déterminer le nom du fichier en fonction du type
-            doc_type = "Devis" if doc_data['type'] == 'devis' else "Facture"
-            filename = f"{doc_type}_{doc_id}_{uuid.uuid4().hex[:8]}.pdf"
-            
             # Mettre à jour l'URL du PDF dans la base de données
-            update_query = text("""
-                UPDATE devis_factures
-                SET pdf_url = :pdf_url
-                WHERE id = :doc_id
-            """)
-            
             # Dans un environnement réel, on stockerait le PDF dans un service comme S3
             # et on mettrait à jour l'URL. Ici on simule juste.
             pdf_url = f"/devis/{doc_id}/pdf"
             
-            conn.execute(update_query, {
+            conn.execute(_UPDATE_PDF_URL_QUERY, {
                 "pdf_url": pdf_url,
                 "doc_id": doc_id
             })
-            
-            conn.commit()
-            
-            # Renvoyer le PDF
-            return send_file(temp_file.name, 
-                            mimetype='application/pdf',
-                            as_attachment=True,
-                            download_name=filename)
+        
+        # Générer le PDF avec les données (connexion déjà rendue au pool)
+        from app.utils.pdf_utils import generate_invoice_pdf
+        
+        pdf_bytes = generate_invoice_pdf(doc_data)
+        
+        # Déterminer le nom du fichier en fonction du type
+        doc_type = "Devis" if doc_data['type'] == 'devis' else "Facture"
+        filename = f"{doc_type}_{doc_id}_{uuid.uuid4().hex[:8]}.pdf"
+        
+        # Renvoyer le PDF directement depuis la mémoire
+        return send_file(io.BytesIO(pdf_bytes),
+                        mimetype='application/pdf',
+                        as_attachment=True,
+                        download_name=filename)
     except Exception as e:
         logger.error(f"Error generating PDF: {str(e)}")
         return jsonify({'message': f'An error occurred: {str(e)}'}), 500
@@ -783,67 +925,41 @@ def update_invoice_status(doc_id):
         description: Erreur serveur
     """
     user_id = request.user_id
-    data = request.json
-    
-    if 'status' not in data:
-        return jsonify({'message': 'Le statut est requis'}), 400
-    
-    new_status = data['status']
+    is_admin = request.user_role == 'admin'
     
     # Valider le statut
-    if new_status not in ['en_attente', 'envoyé', 'payé', 'annulé']:
-        return jsonify({'message': 'Statut invalide'}), 400
+    body, error = _parse_body(InvoiceStatusBody, {('status',): 'Statut invalide'})
+    if error:
+        return error
+    
+    new_status = body.status
     
     engine = current_app.config.get('db_engine')
     if not engine:
         return jsonify({'message': 'Database connection error'}), 500
     
     try:
-        with engine.connect() as conn:
-            # Vérifier l'accès au document
-            access_query = text("""
-                SELECT df.id, df.type, df.client_id, df.total_ttc, u.stripe_account_id, u.payout_enabled
-                FROM devis_factures df
-                JOIN users u ON df.user_id = u.id
-                WHERE df.id = :doc_id AND (df.user_id = :user_id OR EXISTS (
-                    SELECT 1 FROM users WHERE id = :user_id AND role = 'admin'
-                ))
-            """)
-            
-            document = conn.execute(access_query, {
+        # Transaction validée automatiquement à la sortie du bloc
+        with engine.begin() as conn:
+            # Mettre à jour le statut (et la date de paiement s'il passe à 'payé')
+            document = conn.execute(_UPDATE_STATUS_QUERY, {
+                "status": new_status,
                 "doc_id": doc_id,
-                "user_id": user_id
-            }).fetchone()
+                "user_id": user_id,
+                "is_admin": is_admin
+            }).first()
             
             if not document:
                 return jsonify({'message': 'Document not found or unauthorized'}), 404
             
-            # Si le statut passe à 'payé', mettre à jour la date de paiement
-            payment_date = None
-            if new_status == 'payé':
-                payment_date = datetime.now().isoformat()
-            
-            # Mettre à jour le statut
-            update_query = text("""
-                UPDATE devis_factures
-                SET status = :status, 
-                    payment_date = :payment_date
-                WHERE id = :doc_id
-            """)
-            
-            conn.execute(update_query, {
-                "status": new_status,
-                "payment_date": payment_date,
-                "doc_id": doc_id
-            })
-            
-            conn.commit()
+            # La session de paiement mémorisée ne correspond plus au nouveau statut
+            invalidate_payment_session(current_app.config.get('redis_client'), doc_id)
             
             return jsonify({
                 'message': 'Statut mis à jour avec succès',
-                'id': doc_id,
-                'status': new_status,
-                'payment_date': payment_date
+                'id': document.id,
+                'status': document.status,
+                'payment_date': document.payment_date.isoformat() if document.payment_date else None
             })
     except Exception as e:
         logger.error(f"Error updating invoice status: {str(e)}")
@@ -884,6 +1000,8 @@ def pay_invoice(doc_id):
         description: Non authentifié
       404:
         description: Document non trouvé
+      409:
+        description: Paiement déjà en cours pour ce document
       500:
         description: Erreur serveur
     """
@@ -893,42 +1011,50 @@ def pay_invoice(doc_id):
     if not engine:
         return jsonify({'message': 'Database connection error'}), 500
     
+    # Une demande répétée renvoie la session déjà créée, sans base ni appel à Stripe
+    redis_client = current_app.config.get('redis_client')
+    cached_session = get_cached_payment_session(redis_client, doc_id)
+    if cached_session is not None:
+        return current_app.response_class(cached_session, mimetype='application/json')
+    
     try:
-        with engine.connect() as conn:
-            # Récupérer les informations du document
-            doc_query = text("""
-                SELECT df.id, df.type, df.client_id, df.total_ttc, df.status,
-                       df.user_id as freelance_id, u.stripe_account_id, u.payout_enabled,
-                       c.full_name as client_name, u.full_name as freelance_name
-                FROM devis_factures df
-                JOIN users u ON df.user_id = u.id
-                JOIN clients c ON df.client_id = c.id
-                WHERE df.id = :doc_id
-            """)
-            
-            document = conn.execute(doc_query, {"doc_id": doc_id}).fetchone()
-            
+        # Réserver le document (statut en_paiement) et lire ses informations en
+        # une requête, puis rendre la connexion au pool avant l'appel à Stripe
+        with engine.begin() as conn:
+            document = conn.execute(_CLAIM_PAYMENT_QUERY, {
+                "doc_id": doc_id,
+                "claim_timeout": PAYMENT_CLAIM_TIMEOUT
+            }).fetchone()
+            current_status = None
             if not document:
+                current_status = conn.execute(_DOCUMENT_STATUS_QUERY, {"doc_id": doc_id}).scalar()
+        
+        if not document:
+            if current_status is None:
                 return jsonify({'message': 'Document not found'}), 404
-            
-            # Vérifier que le document n'est pas déjà payé
-            if document.status == 'payé':
+            if current_status == 'payé':
                 return jsonify({'message': 'Ce document est déjà payé'}), 400
-            
+            # Document en_paiement ou verrouillé par une requête concurrente
+            return jsonify({'message': 'Un paiement est déjà en cours pour ce document'}), 409
+        
+        # Le document réservé est rétabli dans son statut précédent si une étape échoue
+        try:
             # Créer la description du paiement
-            description = f"{'Devis' if document.type == 'devis' else 'Facture'} #{document.id} - {document.freelance_name}"
+            description = f"{_DOC_LABELS[document.type]} #{document.id} - {document.freelance_name}"
             
             # Déterminer si on peut faire un paiement direct avec Stripe Connect
             freelance_stripe_id = None
             if document.stripe_account_id and document.payout_enabled:
                 freelance_stripe_id = document.stripe_account_id
             
-            # Créer la session de paiement
+            # Créer la session de paiement (aucune connexion n'est tenue pendant l'appel réseau)
+            # puis passer le document au statut envoyé et enregistrer la session Stripe
             checkout_session = create_checkout_session(
                 client_id=document.client_id,
                 product_id=0,  # Pas de produit spécifique pour un devis/facture
                 freelance_id=document.freelance_id,
-                montant=float(document.total_ttc),
+                montant=None,
+                montant_cents=document.amount_cents,
                 description=description,
                 freelance_stripe_id=freelance_stripe_id,
                 metadata={
@@ -938,21 +1064,25 @@ def pay_invoice(doc_id):
                 }
             )
             
-            # Mettre à jour le statut du document
-            update_query = text("""
-                UPDATE devis_factures
-                SET status = 'envoyé'
-                WHERE id = :doc_id
-            """)
-            
-            conn.execute(update_query, {"doc_id": doc_id})
-            conn.commit()
-            
-            # Retourner l'URL de paiement
-            return jsonify({
-                'session_id': checkout_session.id,
-                'checkout_url': checkout_session.url
-            })
+            with engine.begin() as conn:
+                conn.execute(_MARK_SENT_QUERY, {"doc_id": doc_id, "session_id": checkout_session.id})
+        except Exception:
+            # Rétablir le statut précédent du document (sinon la réservation expirera
+            # au bout de PAYMENT_CLAIM_TIMEOUT secondes)
+            try:
+                with engine.begin() as conn:
+                    conn.execute(_RESTORE_STATUS_QUERY, {"doc_id": doc_id, "previous_status": document.previous_status})
+            except Exception as restore_error:
+                logger.error("Error restoring status of document %s: %s", doc_id, restore_error)
+            raise
+        
+        # Retourner l'URL de paiement
+        session_json = dumps_bytes({
+            'session_id': checkout_session.id,
+            'checkout_url': checkout_session.url
+        })
+        cache_payment_session(redis_client, doc_id, session_json)
+        return current_app.response_class(session_json, mimetype='application/json')
     except Exception as e:
-        logger.error(f"Error creating payment session: {str(e)}")
+        logger.error("Error creating payment session: %s", e, exc_info=True)
         return jsonify({'message': f'An error occurred: {str(e)}'}), 500
\ No newline at end of file
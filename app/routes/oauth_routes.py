@@ -4,11 +4,13 @@ from flask import Blueprint, request, redirect, jsonify, url_for, current_app
 from sqlalchemy import text
 
 from app.utils.oauth import (
-    get_google_auth_url, get_google_token, get_google_user_info,
+    get_google_auth_url, get_google_token, get_google_user_info, get_google_id_token_claims,
     get_discord_auth_url, get_discord_token, get_discord_user_info
 )
+from app.utils.db_utils import get_request_connection
 from app.utils.user_management import find_or_create_social_user
 from app.utils.jwt_utils import create_oauth_tokens, generate_oauth_redirect_url
+from app.utils.redis_utils import invalidate_user
 
 # Configurer le logging
 logger = logging.getLogger(__name__)
@@ -19,6 +21,112 @@ oauth_bp = Blueprint('oauth', __name__, url_prefix='/auth')
 # Base URL pour les redirections
 BASE_URL = "https://api.bemynet.fr"
 
+# URIs de redirection OAuth, calculées une fois à l'enregistrement du blueprint
+_REDIRECT_URIS = {}
+
+
+def _google_user_info(token_data):
+    # Les informations sont lues dans l'id_token, l'endpoint userinfo n'est appelé qu'en secours
+    return get_google_id_token_claims(token_data) or get_google_user_info(token_data.get('access_token'))
+
+def _google_full_name(userinfo):
+    return userinfo.get('name') or f"{userinfo.get('given_name', '')} {userinfo.get('family_name', '')}".strip()
+
+# Configuration des fournisseurs OAuth utilisée par _oauth_callback
+_OAUTH_PROVIDERS = {
+    'google': {
+        'label': 'Google',
+        'get_token': get_google_token,
+        'get_user_info': _google_user_info,
+        'id_key': 'sub',
+        'verified_key': 'email_verified',
+        'get_full_name': _google_full_name,
+    },
+    'discord': {
+        'label': 'Discord',
+        'get_token': get_discord_token,
+        'get_user_info': lambda token_data: get_discord_user_info(token_data.get('access_token')),
+        'id_key': 'id',
+        'verified_key': 'verified',
+        'get_full_name': lambda userinfo: userinfo.get('username'),
+    },
+}
+
+def _oauth_callback(provider):
+    """
+    Traitement commun des callbacks OAuth : échange du code, lecture des
+    informations de l'utilisateur, création du compte et redirection vers
+    le frontend avec les tokens JWT
+    """
+    config = _OAUTH_PROVIDERS[provider]
+    label = config['label']
+    
+    code = request.args.get('code')
+    if not code:
+        return jsonify({'error': 'Authorization code missing'}), 400
+    
+    try:
+        # Échanger le code contre un token
+        token_data = config['get_token'](code, _REDIRECT_URIS[provider])
+        
+        if not token_data.get('access_token'):
+            logger.error("Failed to get %s access token: %s", label, token_data)
+            return jsonify({'error': f'Failed to get access token from {label}'}), 500
+        
+        # Récupérer les informations de l'utilisateur
+        userinfo = config['get_user_info'](token_data)
+        
+        # Vérifier que l'email est vérifié
+        if not userinfo.get(config['verified_key'], False):
+            return jsonify({'error': f'{label} email not verified'}), 403
+        
+        provider_user_id = userinfo.get(config['id_key'])
+        email = userinfo.get('email')
+        full_name = config['get_full_name'](userinfo)
+        
+        if not provider_user_id or not email:
+            return jsonify({'error': f'Unable to get user info from {label}'}), 500
+        
+        # Trouver ou créer l'utilisateur
+        conn = get_request_connection()
+        if conn is None:
+            return jsonify({'error': 'Database connection error'}), 500
+        
+        # Transaction limitée à l'accès base, validée à la sortie du bloc
+        with conn.begin():
+            user = find_or_create_social_user(
+                conn=conn,
+                provider=provider,
+                provider_user_id=provider_user_id,
+                email=email,
+                full_name=full_name
+            )
+        
+        # last_login_at a changé: le profil en cache de /auth/me est périmé
+        invalidate_user(current_app.config.get('redis_client'), user['id'])
+        
+        # Créer les tokens JWT
+        access_token, refresh_token = create_oauth_tokens(
+            user_id=user['id'],
+            full_name=user['full_name'],
+            email=user['email'],
+            role=user['role']
+        )
+        
+        # Générer l'URL de redirection
+        redirect_url = generate_oauth_redirect_url(
+            access_token=access_token,
+            refresh_token=refresh_token,
+            is_new_user=user['is_new']
+        )
+        
+        # Rediriger vers le frontend
+        return redirect(redirect_url)
+    
+    except Exception as e:
+        logger.error("Error in %s OAuth callback: %s", label, e, exc_info=True)
+        return jsonify({'error': f'Authentication error: {str(e)}'}), 500
+
 
 # Routes Google OAuth
 @oauth_bp.route('/google/login')
@@ -32,7 +140,7 @@ def google_login():
       302:
         description: Redirection vers la page d'authentification Google
     """
-    redirect_uri = f"{BASE_URL}{url_for('oauth.google_callback')}"
+    redirect_uri = _REDIRECT_URIS['google']
     auth_url = get_google_auth_url(redirect_uri)
     return redirect(auth_url)
 
@@ -60,72 +168,7 @@ def google_callback():
       500:
         description: Erreur serveur
     """
-    code = request.args.get('code')
-    if not code:
-        return jsonify({'error': 'Authorization code missing'}), 400
-    
-    redirect_uri = f"{BASE_URL}{url_for('oauth.google_callback')}"
-    
-    try:
-        # Échanger le code contre un token
-        token_data = get_google_token(code, redirect_uri)
-        access_token = token_data.get('access_token')
-        
-        if not access_token:
-            logger.error(f"Failed to get Google access token: {token_data}")
-            return jsonify({'error': 'Failed to get access token from Google'}), 500
-        
-        # Récupérer les informations de l'utilisateur
-        userinfo = get_google_user_info(access_token)
-        
-        if not userinfo.get('email_verified'):
-            return jsonify({'error': 'Google email not verified'}), 403
-        
-        provider_user_id = userinfo.get('sub')
-        email = userinfo.get('email')
-        full_name = userinfo.get('name') or f"{userinfo.get('given_name', '')} {userinfo.get('family_name', '')}".strip()
-        
-        if not provider_user_id or not email:
-            return jsonify({'error': 'Unable to get user info from Google'}), 500
-        
-        # Trouver ou créer l'utilisateur
-        engine = current_app.config.get('db_engine')
-        if not engine:
-            return jsonify({'error': 'Database connection error'}), 500
-        
-        with engine.connect() as conn:
-            user = find_or_create_social_user(
-                conn=conn,
-                provider="google",
-                provider_user_id=provider_user_id,
-                email=email,
-                full_name=full_name
-            )
-            
-            # Créer les tokens JWT
-            access_token, refresh_token = create_oauth_tokens(
-                user_id=user['id'],
-                full_name=user['full_name'],
-                email=user['email'],
-                role=user['role']
-            )
-            
-            # Générer l'URL de redirection
-            redirect_url = generate_oauth_redirect_url(
-                access_token=access_token,
-                refresh_token=refresh_token,
-                is_new_user=user['is_new']
-            )
-            
-            # Valider la transaction
-            conn.commit()
-            
-            # Rediriger vers le frontend
-            return redirect(redirect_url)
-    
-    except Exception as e:
-        logger.error(f"Error in Google OAuth callback: {str(e)}")
-        return jsonify({'error': f'Authentication error: {str(e)}'}), 500
+    return _oauth_callback('google')
 
 # Routes Discord OAuth
 @oauth_bp.route('/discord/login')
@@ -139,7 +182,7 @@ def discord_login():
       302:
         description: Redirection vers la page d'authentification Discord
     """
-    redirect_uri = f"{BASE_URL}{url_for('oauth.discord_callback')}"
+    redirect_uri = _REDIRECT_URIS['discord']
     auth_url = get_discord_auth_url(redirect_uri)
     return redirect(auth_url)
 
@@ -167,70 +210,13 @@ def discord_callback():
       500:
         description: Erreur serveur
     """
-    code = request.args.get('code')
-    if not code:
-        return jsonify({'error': 'Authorization code missing'}), 400
-    
-    redirect_uri = f"{BASE_URL}{url_for('oauth.discord_callback')}"
-    
-    try:
-        # Échanger le code contre un token
-        token_data = get_discord_token(code, redirect_uri)
-        access_token = token_data.get('access_token')
-        
-        if not access_token:
-            logger.error(f"Failed to get Discord access token: {token_data}")
-            return jsonify({'error': 'Failed to get access token from Discord'}), 500
-        
-        # Récupérer les informations de l'utilisateur
-        userinfo = get_discord_user_info(access_token)
-        
-        provider_user_id = userinfo.get('id')
-        email = userinfo.get('email')
-        full_name = userinfo.get('username')
-        
-        if not provider_user_id or not email:
-            return jsonify({'error': 'Unable to get user info from Discord'}), 500
-        
-        # Vérifier que l'email est vérifié
-        if not userinfo.get('verified', False):
-            return jsonify({'error': 'Discord email not verified'}), 403
-        
-        # Trouver ou créer l'utilisateur
-        engine = current_app.config.get('db_engine')
-        if not engine:
-            return jsonify({'error': 'Database connection error'}), 500
-        
-        with engine.connect() as conn:
-            user = find_or_create_social_user(
-                conn=conn,
-                provider="discord",
-                provider_user_id=provider_user_id,
-                email=email,
-                full_name=full_name
-            )
-            
-            # Créer les tokens JWT
-            access_token, refresh_token = create_oauth_tokens(
-                user_id=user['id'],
-                full_name=user['full_name'],
-                email=user['email'],
-                role=user['role']
-            )
-            
-            # Générer l'URL de redirection
-            redirect_url = generate_oauth_redirect_url(
-                access_token=access_token,
-                refresh_token=refresh_token,
-                is_new_user=user['is_new']
-            )
-            
-            # Valider la transaction
-            conn.commit()
-            
-            # Rediriger vers le frontend
-            return redirect(redirect_url)
-    
-    except Exception as e:
-        logger.error(f"Error in Discord OAuth callback: {str(e)}")
-        return jsonify({'error': f'Authentication error: {str(e)}'}), 500
\ No newline at end of file
+    return _oauth_callback('discord')
+
+@oauth_bp.record_once
+def _build_redirect_uris(state):
+    """
+    Calcule les URIs de redirection une fois les routes du blueprint enregistrées
+    """
+    with state.app.test_request_context():
+        for provider in ('google', 'discord'):
+            _REDIRECT_URIS[provider] = f"{BASE_URL}{url_for(f'oauth.{provider}_callback')}"
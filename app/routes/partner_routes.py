@@ -1,8 +1,13 @@
 import logging
 from flask import Blueprint, request, jsonify, current_app
-from sqlalchemy import text
-from functools import wraps
-import uuid
+from sqlalchemy import bindparam, text
+from sqlalchemy.exc import IntegrityError
+from functools import lru_cache, wraps
+import secrets
+
+from app.utils.jwt_utils import get_bearer_token, verify_access_token
+from app.utils.user_management import get_user_role, load_user_role
+from app.utils.visit_buffer import invalidate_tracking_code
 
 # Configurer le logging
 logger = logging.getLogger(__name__)
@@ -10,37 +15,214 @@ logger = logging.getLogger(__name__)
 # Créer le blueprint pour les routes de commerciaux et partenaires
 partner_bp = Blueprint('partner', __name__)
 
+# Commercial avec le nom de son créateur et ses statistiques de vente
+_COMMERCIAL_WITH_STATS_QUERY = text("""
+    SELECT c.*, u.full_name as creator_name,
+           s.total_sales, s.total_amount, s.total_commission
+    FROM commerciaux c
+    LEFT JOIN users u ON c.user_id = u.id
+    CROSS JOIN LATERAL (
+        SELECT COUNT(v.id) as total_sales,
+               SUM(v.montant) as total_amount,
+               SUM(v.commission_commerciale) as total_commission
+        FROM ventes v
+        WHERE v.commercial_id = c.id
+    ) s
+    WHERE c.id = :commercial_id AND (c.user_id = :user_id OR :is_admin)
+""")
+
+# Statistiques de vente groupées par commercial / partenaire, pour une page de résultats
+_COMMERCIAL_STATS_QUERY = text("""
+    SELECT commercial_id as source_id,
+           COUNT(id) as total_sales,
+           SUM(montant) as total_amount,
+           SUM(commission_commerciale) as total_commission
+    FROM ventes
+    WHERE commercial_id IN :ids
+    GROUP BY commercial_id
+""").bindparams(bindparam('ids', expanding=True))
+
+_PARTENAIRE_STATS_QUERY = text("""
+    SELECT partenaire_id as source_id,
+           COUNT(id) as total_sales,
+           SUM(montant) as total_amount,
+           SUM(commission_partenaire) as total_commission
+    FROM ventes
+    WHERE partenaire_id IN :ids
+    GROUP BY partenaire_id
+""").bindparams(bindparam('ids', expanding=True))
+
+def _attach_sales_stats(conn, stats_query, items):
+    """
+    Ajoute à chaque élément ses statistiques de vente, en une requête pour toute la liste
+    """
+    if not items:
+        return
+    
+    stats_by_id = {
+        row.source_id: row
+        for row in conn.execute(stats_query, {"ids": [item['id'] for item in items]})
+    }
+    for item in items:
+        stats = stats_by_id.get(item['id'])
+        item['stats'] = {
+            'total_sales': stats.total_sales if stats else 0,
+            'total_amount': float(stats.total_amount or 0) if stats else 0.0,
+            'total_commission': float(stats.total_commission or 0) if stats else 0.0
+        }
+
+def _commerciaux_query_parts(is_admin, has_status):
+    """
+    Produit les fragments SQL de la requête de liste des commerciaux
+    """
+    yield "SELECT c.*, u.full_name as creator_name"
+    yield "FROM commerciaux c LEFT JOIN users u ON c.user_id = u.id WHERE 1=1"
+    
+    # Si non admin, limiter aux commerciaux créés par l'utilisateur
+    if not is_admin:
+        yield "AND c.user_id = :user_id"
+    if has_status:
+        yield "AND c.status = :status"
+    
+    yield "ORDER BY c.created_at DESC"
+    yield "LIMIT :limit OFFSET :offset"
+
+@lru_cache(maxsize=4)
+def _build_commerciaux_query(is_admin, has_status):
+    """
+    Construit la requête de liste des commerciaux pour une combinaison de
+    filtres. Le résultat est mis en cache, il n'y a que 4 variantes.
+    """
+    return text(" ".join(_commerciaux_query_parts(is_admin, has_status)))
+
+def _partenaires_query_parts(is_admin, has_status, has_type):
+    """
+    Produit les fragments SQL de la requête de liste des partenaires
+    """
+    yield "SELECT p.*, u.full_name as creator_name"
+    yield "FROM partenaires p LEFT JOIN users u ON p.user_id = u.id WHERE 1=1"
+    
+    # Si non admin, limiter aux partenaires créés par l'utilisateur
+    if not is_admin:
+        yield "AND p.user_id = :user_id"
+    if has_status:
+        yield "AND p.status = :status"
+    if has_type:
+        yield "AND p.type = :type"
+    
+    yield "ORDER BY p.created_at DESC"
+    yield "LIMIT :limit OFFSET :offset"
+
+@lru_cache(maxsize=8)
+def _build_partenaires_query(is_admin, has_status, has_type):
+    """
+    Construit la requête de liste des partenaires pour une combinaison de
+    filtres. Le résultat est mis en cache, il n'y a que 8 variantes.
+    """
+    return text(" ".join(_partenaires_query_parts(is_admin, has_status, has_type)))
+
+def _insert_query(table, columns, email_column):
+    """
+    Requête d'insertion d'un commercial / partenaire ; aucune ligne n'est
+    renvoyée si l'email est déjà utilisé.
+    """
+    return text(
+        f"INSERT INTO {table} ({', '.join(columns)}, created_at) "
+        f"VALUES ({', '.join(':' + column for column in columns)}, NOW()) "
+        f"ON CONFLICT ({email_column}) DO NOTHING "
+        "RETURNING id, tracking_code"
+    )
+
+_INSERT_COMMERCIAL_QUERY = _insert_query(
+    'commerciaux',
+    ('full_name', 'email', 'pourcentage', 'status', 'tracking_code', 'user_id'),
+    'email'
+)
+_INSERT_PARTENAIRE_QUERY = _insert_query(
+    'partenaires',
+    ('nom', 'type', 'email_contact', 'pourcentage', 'tracking_url', 'tracking_code', 'status', 'user_id'),
+    'email_contact'
+)
+
+# Nombre de tentatives pour générer un code de tracking unique
+TRACKING_CODE_MAX_ATTEMPTS = 3
+
+def _insert_with_tracking_code(conn, insert_query, params):
+    """
+    Exécute l'insertion d'un commercial / partenaire. Sans code fourni par le
+    client, un code est généré, et un autre est tiré en cas de collision avec
+    l'index unique sur tracking_code.
+    """
+    if params["tracking_code"]:
+        return conn.execute(insert_query, params).first()
+    
+    for attempt in range(TRACKING_CODE_MAX_ATTEMPTS):
+        params["tracking_code"] = secrets.token_urlsafe(6)
+        try:
+            with conn.begin_nested():
+                return conn.execute(insert_query, params).first()
+        except IntegrityError:
+            if attempt == TRACKING_CODE_MAX_ATTEMPTS - 1:
+                raise
+
+# Cause de l'échec d'une mise à jour de commercial (requête exécutée seulement en cas d'échec)
+_COMMERCIAL_UPDATE_FAILURE_QUERY = text("""
+    SELECT
+        EXISTS (
+            SELECT 1 FROM commerciaux
+            WHERE id = :commercial_id AND (user_id = :user_id OR :is_admin)
+        ) as found,
+        EXISTS (
+            SELECT 1 FROM commerciaux
+            WHERE email = :email AND id <> :commercial_id
+        ) as email_taken,
+        EXISTS (
+            SELECT 1 FROM commerciaux
+            WHERE tracking_code = :tracking_code AND id <> :commercial_id
+        ) as code_taken
+""")
+
+# Cause de l'échec d'une mise à jour de partenaire (requête exécutée seulement en cas d'échec)
+_PARTENAIRE_UPDATE_FAILURE_QUERY = text("""
+    SELECT
+        EXISTS (
+            SELECT 1 FROM partenaires
+            WHERE id = :partenaire_id AND (user_id = :user_id OR :is_admin)
+        ) as found,
+        EXISTS (
+            SELECT 1 FROM partenaires
+            WHERE email_contact = :email_contact AND id <> :partenaire_id
+        ) as email_taken,
+        EXISTS (
+            SELECT 1 FROM partenaires
+            WHERE tracking_code = :tracking_code AND id <> :partenaire_id
+        ) as code_taken
+""")
+
 # Middleware d'authentification (identique aux autres routes)
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = None
-        auth_header = request.headers.get('Authorization')
-        
-        if auth_header:
-            parts = auth_header.split()
-            if len(parts) == 2 and parts[0].lower() == 'bearer':
-                token = parts[1]
+        # Format attendu: "Bearer <token>"
+        token = get_bearer_token(request.headers.get('Authorization'))
         
         if not token:
             return jsonify({'message': 'Token is missing!'}), 401
         
-        # Importer decode_token depuis jwt_utils
-        from app.utils.jwt_utils import decode_token
-        
         try:
-            payload = decode_token(token)
+            # Signature, type et révocation du token vérifiés au même endroit pour toutes les routes
+            payload = verify_access_token(token, current_app.config.get('redis_client'))
             if not payload:
                 return jsonify({'message': 'Token is invalid!'}), 401
             
             # Add user_id to request for route handlers
             request.user_id = int(payload['sub'])
-            
-            return f(*args, **kwargs)
         except Exception as e:
             logger.error(f"Token verification error: {str(e)}")
             return jsonify({'message': 'Token is invalid!'}), 401
         
+        return f(*args, **kwargs)
+        
     return decorated
 
 # Middleware pour vérifier si l'utilisateur est admin
@@ -54,18 +236,17 @@ def admin_required(f):
             return jsonify({'message': 'Database connection error'}), 500
         
         try:
-            with engine.connect() as conn:
-                role_query = text("SELECT role FROM users WHERE id = :user_id")
-                role_result = conn.execute(role_query, {"user_id": user_id}).fetchone()
-                
-                if not role_result or role_result.role != 'admin':
-                    return jsonify({'message': 'Admin role required'}), 403
-                
-                return f(*args, **kwargs)
+            # Rôle mis en cache, la connexion n'est ouverte qu'en cas d'absence
+            role = load_user_role(engine, user_id)
         except Exception as e:
             logger.error(f"Admin check error: {str(e)}")
             return jsonify({'message': 'An error occurred'}), 500
         
+        if role != 'admin':
+            return jsonify({'message': 'Admin role required'}), 403
+        
+        return f(*args, **kwargs)
+        
     return decorated
 
 # Routes pour les commerciaux
@@ -103,6 +284,11 @@ def get_commerciaux():
         type: integer
         default: 0
         description: Décalage pour la pagination
+      - in: query
+        name: include
+        type: string
+        enum: [stats]
+        description: Inclure les statistiques de vente de chaque élément
     responses:
       200:
         description: Liste des commerciaux
@@ -155,6 +341,7 @@ def get_commerciaux():
     status = request.args.get('status')
     limit = request.args.get('limit', 50, type=int)
     offset = request.args.get('offset', 0, type=int)
+    include_stats = 'stats' in request.args.get('include', '').split(',')
     
     engine = current_app.config.get('db_engine')
     if not engine:
@@ -162,55 +349,31 @@ def get_commerciaux():
     
     try:
         with engine.connect() as conn:
-            # Vérifier le rôle de l'utilisateur
-            role_query = text("SELECT role FROM users WHERE id = :user_id")
-            role_result = conn.execute(role_query, {"user_id": user_id}).fetchone()
+            # Vérifier le rôle de l'utilisateur (mis en cache)
+            role = get_user_role(conn, user_id)
             
-            if not role_result:
+            if not role:
                 return jsonify({'message': 'User not found'}), 404
             
-            is_admin = role_result.role == 'admin'
-            
-            # Construire la requête SQL avec les filtres
-            query_parts = [
-                "SELECT c.*, u.full_name as creator_name",
-                "FROM commerciaux c",
-                "LEFT JOIN users u ON c.user_id = u.id",
-                "WHERE 1=1"
-            ]
+            is_admin = role == 'admin'
             
-            params = {}
-            
-            # Si non admin, limiter aux commerciaux créés par l'utilisateur
+            # Requête correspondant aux filtres fournis
+            params = {"limit": limit, "offset": offset}
             if not is_admin:
-                query_parts.append("AND c.user_id = :user_id")
                 params["user_id"] = user_id
-            
-            # Ajouter les filtres
             if status:
-                query_parts.append("AND c.status = :status")
                 params["status"] = status
             
-            # Ajouter l'ordre et la pagination
-            query_parts.append("ORDER BY c.created_at DESC")
-            query_parts.append("LIMIT :limit OFFSET :offset")
-            params["limit"] = limit
-            params["offset"] = offset
-            
-            # Exécuter la requête
-            query = text(" ".join(query_parts))
+            query = _build_commerciaux_query(is_admin, bool(status))
             commerciaux = conn.execute(query, params).fetchall()
             
-            # Convertir les résultats en liste de dictionnaires
-            result = []
-            for commercial in commerciaux:
-                commercial_dict = {column: getattr(commercial, column) for column in commercial._mapping.keys()}
-                
-                # Conversion des valeurs décimales en float pour la sérialisation JSON
-                if commercial_dict.get('pourcentage'):
-                    commercial_dict['pourcentage'] = float(commercial_dict['pourcentage'])
-                
-                result.append(commercial_dict)
+            # Convertir les résultats en liste de dictionnaires (les Decimal sont
+            # encodés en nombres directement par le fournisseur JSON orjson)
+            result = [dict(commercial._mapping) for commercial in commerciaux]
+            
+            # Statistiques de vente de toute la page en une requête
+            if include_stats:
+                _attach_sales_stats(conn, _COMMERCIAL_STATS_QUERY, result)
             
             return jsonify(result)
     except Exception as e:
@@ -284,7 +447,7 @@ def create_commercial():
       401:
         description: Non authentifié
       409:
-        description: Un commercial avec cet email existe déjà
+        description: Un commercial avec cet email ou ce code de tracking existe déjà
       500:
         description: Erreur serveur
     """
@@ -302,7 +465,8 @@ def create_commercial():
     email = data['email']
     pourcentage = float(data['pourcentage'])
     status = data.get('status', 'actif')
-    tracking_code = data.get('tracking_code', str(uuid.uuid4()).split('-')[0].upper())
+    # Sans code fourni, un code de tracking est généré à l'insertion
+    tracking_code = data.get('tracking_code')
     
     # Valider le pourcentage (entre 0 et 20)
     if not 0 <= pourcentage <= 20:
@@ -313,28 +477,9 @@ def create_commercial():
         return jsonify({'message': 'Database connection error'}), 500
     
     try:
-        with engine.connect() as conn:
-            # Vérifier si un commercial avec cet email existe déjà
-            check_query = text("SELECT id FROM commerciaux WHERE email = :email")
-            existing = conn.execute(check_query, {"email": email}).fetchone()
-            
-            if existing:
-                return jsonify({'message': 'Un commercial avec cet email existe déjà'}), 409
-            
-            # Insérer le commercial
-            insert_query = text("""
-                INSERT INTO commerciaux (
-                    full_name, email, pourcentage, status,
-                    tracking_code, user_id, created_at
-                )
-                VALUES (
-                    :full_name, :email, :pourcentage, :status,
-                    :tracking_code, :user_id, NOW()
-                )
-                RETURNING id
-            """)
-            
-            result = conn.execute(insert_query, {
+        with engine.begin() as conn:
+            # Insérer le commercial (aucune ligne si l'email existe déjà)
+            commercial = _insert_with_tracking_code(conn, _INSERT_COMMERCIAL_QUERY, {
                 "full_name": full_name,
                 "email": email,
                 "pourcentage": pourcentage,
@@ -342,17 +487,21 @@ def create_commercial():
                 "tracking_code": tracking_code,
                 "user_id": user_id
             })
-            
-            commercial_id = result.fetchone()[0]
-            
-            # Commit les changements
-            conn.commit()
-            
-            return jsonify({
-                'id': commercial_id,
-                'message': 'Commercial créé avec succès',
-                'tracking_code': tracking_code
-            }), 201
+        
+        if not commercial:
+            return jsonify({'message': 'Un commercial avec cet email existe déjà'}), 409
+        
+        # Un code déjà demandé a pu être mis en cache comme inconnu
+        invalidate_tracking_code('commercial', commercial.tracking_code)
+        
+        return jsonify({
+            'id': commercial.id,
+            'message': 'Commercial créé avec succès',
+            'tracking_code': commercial.tracking_code
+        }), 201
+    except IntegrityError:
+        # Code de tracking fourni déjà utilisé (index unique)
+        return jsonify({'message': 'Ce code de tracking existe déjà'}), 409
     except Exception as e:
         logger.error(f"Error creating commercial: {str(e)}")
         return jsonify({'message': f'An error occurred: {str(e)}'}), 500
@@ -440,24 +589,16 @@ def get_commercial(commercial_id):
     
     try:
         with engine.connect() as conn:
-            # Vérifier le rôle de l'utilisateur
-            role_query = text("SELECT role FROM users WHERE id = :user_id")
-            role_result = conn.execute(role_query, {"user_id": user_id}).fetchone()
+            # Vérifier le rôle de l'utilisateur (mis en cache)
+            role = get_user_role(conn, user_id)
             
-            if not role_result:
+            if not role:
                 return jsonify({'message': 'User not found'}), 404
             
-            is_admin = role_result.role == 'admin'
-            
-            # Récupérer le commercial
-            query = text("""
-                SELECT c.*, u.full_name as creator_name
-                FROM commerciaux c
-                LEFT JOIN users u ON c.user_id = u.id
-                WHERE c.id = :commercial_id AND (c.user_id = :user_id OR :is_admin)
-            """)
+            is_admin = role == 'admin'
             
-            commercial = conn.execute(query, {
+            # Récupérer le commercial et ses statistiques de vente
+            commercial = conn.execute(_COMMERCIAL_WITH_STATS_QUERY, {
                 "commercial_id": commercial_id,
                 "user_id": user_id,
                 "is_admin": is_admin
@@ -466,31 +607,15 @@ def get_commercial(commercial_id):
             if not commercial:
                 return jsonify({'message': 'Commercial non trouvé ou non autorisé'}), 404
             
-            # Convertir en dictionnaire
-            commercial_dict = {column: getattr(commercial, column) for column in commercial._mapping.keys()}
-            
-            # Conversion des valeurs décimales en float pour la sérialisation JSON
-            if commercial_dict.get('pourcentage'):
-                commercial_dict['pourcentage'] = float(commercial_dict['pourcentage'])
-            
-            # Récupérer les statistiques de vente
-            stats_query = text("""
-                SELECT 
-                    COUNT(v.id) as total_sales,
-                    SUM(v.montant) as total_amount,
-                    SUM(v.commission_commerciale) as total_commission
-                FROM ventes v
-                WHERE v.commercial_id = :commercial_id
-            """)
-            
-            stats = conn.execute(stats_query, {"commercial_id": commercial_id}).fetchone()
+            # Convertir en dictionnaire (les Decimal sont gérés par le fournisseur JSON)
+            commercial_dict = dict(commercial._mapping)
             
-            if stats:
-                commercial_dict['stats'] = {
-                    'total_sales': stats.total_sales or 0,
-                    'total_amount': float(stats.total_amount or 0),
-                    'total_commission': float(stats.total_commission or 0)
-                }
+            # Regrouper les statistiques de vente
+            commercial_dict['stats'] = {
+                'total_sales': commercial_dict.pop('total_sales') or 0,
+                'total_amount': float(commercial_dict.pop('total_amount') or 0),
+                'total_commission': float(commercial_dict.pop('total_commission') or 0)
+            }
             
             return jsonify(commercial_dict)
     except Exception as e:
@@ -511,35 +636,25 @@ def update_commercial(commercial_id):
         return jsonify({'message': 'Database connection error'}), 500
     
     try:
-        with engine.connect() as conn:
-            # Vérifier le rôle de l'utilisateur
-            role_query = text("SELECT role FROM users WHERE id = :user_id")
-            role_result = conn.execute(role_query, {"user_id": user_id}).fetchone()
+        with engine.begin() as conn:
+            # Vérifier le rôle de l'utilisateur (mis en cache)
+            role = get_user_role(conn, user_id)
             
-            if not role_result:
+            if not role:
                 return jsonify({'message': 'User not found'}), 404
             
-            is_admin = role_result.role == 'admin'
+            is_admin = role == 'admin'
             
-            # Vérifier l'accès au commercial
-            check_query = text("""
-                SELECT id FROM commerciaux
-                WHERE id = :commercial_id AND (user_id = :user_id OR :is_admin)
-            """)
-            
-            commercial = conn.execute(check_query, {
-                "commercial_id": commercial_id,
-                "user_id": user_id,
-                "is_admin": is_admin
-            }).fetchone()
-            
-            if not commercial:
-                return jsonify({'message': 'Commercial non trouvé ou non autorisé'}), 404
-            
-            # Construire la requête de mise à jour
+            # Construire la requête de mise à jour ; l'accès et l'unicité de
+            # l'email et du code de tracking sont vérifiés par la même requête
             update_parts = []
+            conditions = []
             params = {
-                "commercial_id": commercial_id
+                "commercial_id": commercial_id,
+                "user_id": user_id,
+                "is_admin": is_admin,
+                "email": None,
+                "tracking_code": None
             }
             
             # Champs modifiables
@@ -548,21 +663,11 @@ def update_commercial(commercial_id):
                 params["full_name"] = data['full_name']
             
             if 'email' in data:
-                # Vérifier que l'email n'existe pas déjà
-                check_email_query = text("""
-                    SELECT id FROM commerciaux
-                    WHERE email = :email AND id != :commercial_id
-                """)
-                
-                existing = conn.execute(check_email_query, {
-                    "email": data['email'],
-                    "commercial_id": commercial_id
-                }).fetchone()
-                
-                if existing:
-                    return jsonify({'message': 'Un commercial avec cet email existe déjà'}), 409
-                
+                # L'email ne doit pas être utilisé par un autre commercial
                 update_parts.append("email = :email")
+                conditions.append(
+                    "AND NOT EXISTS (SELECT 1 FROM commerciaux o WHERE o.email = :email AND o.id <> :commercial_id)"
+                )
                 params["email"] = data['email']
             
             if 'pourcentage' in data:
@@ -580,21 +685,11 @@ def update_commercial(commercial_id):
                 params["status"] = data['status']
             
             if 'tracking_code' in data:
-                # Vérifier que le code n'existe pas déjà
-                check_code_query = text("""
-                    SELECT id FROM commerciaux
-                    WHERE tracking_code = :tracking_code AND id != :commercial_id
-                """)
-                
-                existing = conn.execute(check_code_query, {
-                    "tracking_code": data['tracking_code'],
-                    "commercial_id": commercial_id
-                }).fetchone()
-                
-                if existing:
-                    return jsonify({'message': 'Ce code de tracking existe déjà'}), 409
-                
+                # Le code ne doit pas être utilisé par un autre commercial
                 update_parts.append("tracking_code = :tracking_code")
+                conditions.append(
+                    "AND NOT EXISTS (SELECT 1 FROM commerciaux o WHERE o.tracking_code = :tracking_code AND o.id <> :commercial_id)"
+                )
                 params["tracking_code"] = data['tracking_code']
             
             if 'contract_signed_at' in data:
@@ -609,23 +704,36 @@ def update_commercial(commercial_id):
             update_query = text(f"""
                 UPDATE commerciaux
                 SET {", ".join(update_parts)}
-                WHERE id = :commercial_id
+                WHERE id = :commercial_id AND (user_id = :user_id OR :is_admin)
+                {" ".join(conditions)}
                 RETURNING id
             """)
             
-            result = conn.execute(update_query, params)
-            updated = result.fetchone()
+            updated = conn.execute(update_query, params).fetchone()
             
             if not updated:
+                # Déterminer la cause de l'échec
+                failure = conn.execute(_COMMERCIAL_UPDATE_FAILURE_QUERY, params).one()
+                
+                if not failure.found:
+                    return jsonify({'message': 'Commercial non trouvé ou non autorisé'}), 404
+                if failure.email_taken:
+                    return jsonify({'message': 'Un commercial avec cet email existe déjà'}), 409
+                if failure.code_taken:
+                    return jsonify({'message': 'Ce code de tracking existe déjà'}), 409
                 return jsonify({'message': 'Échec de la mise à jour'}), 500
-            
-            # Commit les changements
-            conn.commit()
-            
-            return jsonify({
-                'message': 'Commercial mis à jour avec succès',
-                'id': commercial_id
-            })
+        
+        # Un nouveau code a pu être mis en cache comme inconnu
+        if params["tracking_code"]:
+            invalidate_tracking_code('commercial', params["tracking_code"])
+        
+        return jsonify({
+            'message': 'Commercial mis à jour avec succès',
+            'id': commercial_id
+        })
+    except IntegrityError:
+        # Email ou code pris par une requête concurrente (index uniques)
+        return jsonify({'message': 'Un commercial avec cet email ou ce code de tracking existe déjà'}), 409
     except Exception as e:
         logger.error(f"Error updating commercial: {str(e)}")
         return jsonify({'message': f'An error occurred: {str(e)}'}), 500
@@ -704,6 +812,11 @@ def get_partenaires():
         type: integer
         default: 0
         description: Décalage pour la pagination
+      - in: query
+        name: include
+        type: string
+        enum: [stats]
+        description: Inclure les statistiques de vente de chaque élément
     responses:
       200:
         description: Liste des partenaires
@@ -764,6 +877,7 @@ def get_partenaires():
     type_partenaire = request.args.get('type')
     limit = request.args.get('limit', 50, type=int)
     offset = request.args.get('offset', 0, type=int)
+    include_stats = 'stats' in request.args.get('include', '').split(',')
     
     engine = current_app.config.get('db_engine')
     if not engine:
@@ -771,59 +885,33 @@ def get_partenaires():
     
     try:
         with engine.connect() as conn:
-            # Vérifier le rôle de l'utilisateur
-            role_query = text("SELECT role FROM users WHERE id = :user_id")
-            role_result = conn.execute(role_query, {"user_id": user_id}).fetchone()
+            # Vérifier le rôle de l'utilisateur (mis en cache)
+            role = get_user_role(conn, user_id)
             
-            if not role_result:
+            if not role:
                 return jsonify({'message': 'User not found'}), 404
             
-            is_admin = role_result.role == 'admin'
+            is_admin = role == 'admin'
             
-            # Construire la requête SQL avec les filtres
-            query_parts = [
-                "SELECT p.*, u.full_name as creator_name",
-                "FROM partenaires p",
-                "LEFT JOIN users u ON p.user_id = u.id",
-                "WHERE 1=1"
-            ]
-            
-            params = {}
-            
-            # Si non admin, limiter aux partenaires créés par l'utilisateur
+            # Requête correspondant aux filtres fournis
+            params = {"limit": limit, "offset": offset}
             if not is_admin:
-                query_parts.append("AND p.user_id = :user_id")
                 params["user_id"] = user_id
-            
-            # Ajouter les filtres
             if status:
-                query_parts.append("AND p.status = :status")
                 params["status"] = status
-                
             if type_partenaire:
-                query_parts.append("AND p.type = :type")
                 params["type"] = type_partenaire
             
-            # Ajouter l'ordre et la pagination
-            query_parts.append("ORDER BY p.created_at DESC")
-            query_parts.append("LIMIT :limit OFFSET :offset")
-            params["limit"] = limit
-            params["offset"] = offset
-            
-            # Exécuter la requête
-            query = text(" ".join(query_parts))
+            query = _build_partenaires_query(is_admin, bool(status), bool(type_partenaire))
             partenaires = conn.execute(query, params).fetchall()
             
-            # Convertir les résultats en liste de dictionnaires
-            result = []
-            for partenaire in partenaires:
-                partenaire_dict = {column: getattr(partenaire, column) for column in partenaire._mapping.keys()}
-                
-                # Conversion des valeurs décimales en float pour la sérialisation JSON
-                if partenaire_dict.get('pourcentage'):
-                    partenaire_dict['pourcentage'] = float(partenaire_dict['pourcentage'])
-                
-                result.append(partenaire_dict)
+            # Convertir les résultats en liste de dictionnaires (les Decimal sont
+            # encodés en nombres directement par le fournisseur JSON orjson)
+            result = [dict(partenaire._mapping) for partenaire in partenaires]
+            
+            # Statistiques de vente de toute la page en une requête
+            if include_stats:
+                _attach_sales_stats(conn, _PARTENAIRE_STATS_QUERY, result)
             
             return jsonify(result)
     except Exception as e:
@@ -852,7 +940,8 @@ def create_partenaire():
     pourcentage = float(data['pourcentage'])
     status = data.get('status', 'actif')
     tracking_url = data.get('tracking_url', '')
-    tracking_code = data.get('tracking_code', str(uuid.uuid4()).split('-')[0].upper())
+    # Sans code fourni, un code de tracking est généré à l'insertion
+    tracking_code = data.get('tracking_code')
     
     # Valider le pourcentage (entre 0 et 15)
     if not 0 <= pourcentage <= 15:
@@ -863,28 +952,9 @@ def create_partenaire():
         return jsonify({'message': 'Database connection error'}), 500
     
     try:
-        with engine.connect() as conn:
-            # Vérifier si un partenaire avec cet email existe déjà
-            check_query = text("SELECT id FROM partenaires WHERE email_contact = :email")
-            existing = conn.execute(check_query, {"email": email_contact}).fetchone()
-            
-            if existing:
-                return jsonify({'message': 'Un partenaire avec cet email existe déjà'}), 409
-            
-            # Insérer le partenaire
-            insert_query = text("""
-                INSERT INTO partenaires (
-                    nom, type, email_contact, pourcentage, tracking_url,
-                    tracking_code, status, user_id, created_at
-                )
-                VALUES (
-                    :nom, :type, :email_contact, :pourcentage, :tracking_url,
-                    :tracking_code, :status, :user_id, NOW()
-                )
-                RETURNING id
-            """)
-            
-            result = conn.execute(insert_query, {
+        with engine.begin() as conn:
+            # Insérer le partenaire (aucune ligne si l'email existe déjà)
+            partenaire = _insert_with_tracking_code(conn, _INSERT_PARTENAIRE_QUERY, {
                 "nom": nom,
                 "type": type_partenaire,
                 "email_contact": email_contact,
@@ -894,17 +964,21 @@ def create_partenaire():
                 "status": status,
                 "user_id": user_id
             })
-            
-            partenaire_id = result.fetchone()[0]
-            
-            # Commit les changements
-            conn.commit()
-            
-            return jsonify({
-                'id': partenaire_id,
-                'message': 'Partenaire créé avec succès',
-                'tracking_code': tracking_code
-            }), 201
+        
+        if not partenaire:
+            return jsonify({'message': 'Un partenaire avec cet email existe déjà'}), 409
+        
+        # Un code déjà demandé a pu être mis en cache comme inconnu
+        invalidate_tracking_code('partenaire', partenaire.tracking_code)
+        
+        return jsonify({
+            'id': partenaire.id,
+            'message': 'Partenaire créé avec succès',
+            'tracking_code': partenaire.tracking_code
+        }), 201
+    except IntegrityError:
+        # Code de tracking fourni déjà utilisé (index unique)
+        return jsonify({'message': 'Ce code de tracking existe déjà'}), 409
     except Exception as e:
         logger.error(f"Error creating partenaire: {str(e)}")
         return jsonify({'message': f'An error occurred: {str(e)}'}), 500
@@ -923,14 +997,13 @@ def get_partenaire(partenaire_id):
     
     try:
         with engine.connect() as conn:
-            # Vérifier le rôle de l'utilisateur
-            role_query = text("SELECT role FROM users WHERE id = :user_id")
-            role_result = conn.execute(role_query, {"user_id": user_id}).fetchone()
+            # Vérifier le rôle de l'utilisateur (mis en cache)
+            role = get_user_role(conn, user_id)
             
-            if not role_result:
+            if not role:
                 return jsonify({'message': 'User not found'}), 404
             
-            is_admin = role_result.role == 'admin'
+            is_admin = role == 'admin'
             
             # Récupérer le partenaire
             query = text("""
@@ -949,12 +1022,8 @@ def get_partenaire(partenaire_id):
             if not partenaire:
                 return jsonify({'message': 'Partenaire non trouvé ou non autorisé'}), 404
             
-            # Convertir en dictionnaire
-            partenaire_dict = {column: getattr(partenaire, column) for column in partenaire._mapping.keys()}
-            
-            # Conversion des valeurs décimales en float pour la sérialisation JSON
-            if partenaire_dict.get('pourcentage'):
-                partenaire_dict['pourcentage'] = float(partenaire_dict['pourcentage'])
+            # Convertir en dictionnaire (les Decimal sont gérés par le fournisseur JSON)
+            partenaire_dict = dict(partenaire._mapping)
             
             # Récupérer les statistiques de vente
             stats_query = text("""
@@ -1011,35 +1080,25 @@ def update_partenaire(partenaire_id):
         return jsonify({'message': 'Database connection error'}), 500
     
     try:
-        with engine.connect() as conn:
-            # Vérifier le rôle de l'utilisateur
-            role_query = text("SELECT role FROM users WHERE id = :user_id")
-            role_result = conn.execute(role_query, {"user_id": user_id}).fetchone()
+        with engine.begin() as conn:
+            # Vérifier le rôle de l'utilisateur (mis en cache)
+            role = get_user_role(conn, user_id)
             
-            if not role_result:
+            if not role:
                 return jsonify({'message': 'User not found'}), 404
             
-            is_admin = role_result.role == 'admin'
+            is_admin = role == 'admin'
             
-            # Vérifier l'accès au partenaire
-            check_query = text("""
-                SELECT id FROM partenaires
-                WHERE id = :partenaire_id AND (user_id = :user_id OR :is_admin)
-            """)
-            
-            partenaire = conn.execute(check_query, {
-                "partenaire_id": partenaire_id,
-                "user_id": user_id,
-                "is_admin": is_admin
-            }).fetchone()
-            
-            if not partenaire:
-                return jsonify({'message': 'Partenaire non trouvé ou non autorisé'}), 404
-            
-            # Construire la requête de mise à jour
+            # Construire la requête de mise à jour ; l'accès et l'unicité de
+            # l'email et du code de tracking sont vérifiés par la même requête
             update_parts = []
+            conditions = []
             params = {
-                "partenaire_id": partenaire_id
+                "partenaire_id": partenaire_id,
+                "user_id": user_id,
+                "is_admin": is_admin,
+                "email_contact": None,
+                "tracking_code": None
             }
             
             # Champs modifiables
@@ -1052,21 +1111,11 @@ def update_partenaire(partenaire_id):
                 params["type"] = data['type']
             
             if 'email_contact' in data:
-                # Vérifier que l'email n'existe pas déjà
-                check_email_query = text("""
-                    SELECT id FROM partenaires
-                    WHERE email_contact = :email AND id != :partenaire_id
-                """)
-                
-                existing = conn.execute(check_email_query, {
-                    "email": data['email_contact'],
-                    "partenaire_id": partenaire_id
-                }).fetchone()
-                
-                if existing:
-                    return jsonify({'message': 'Un partenaire avec cet email existe déjà'}), 409
-                
+                # L'email ne doit pas être utilisé par un autre partenaire
                 update_parts.append("email_contact = :email_contact")
+                conditions.append(
+                    "AND NOT EXISTS (SELECT 1 FROM partenaires o WHERE o.email_contact = :email_contact AND o.id <> :partenaire_id)"
+                )
                 params["email_contact"] = data['email_contact']
             
             if 'pourcentage' in data:
@@ -1088,21 +1137,11 @@ def update_partenaire(partenaire_id):
                 params["tracking_url"] = data['tracking_url']
             
             if 'tracking_code' in data:
-                # Vérifier que le code n'existe pas déjà
-                check_code_query = text("""
-                    SELECT id FROM partenaires
-                    WHERE tracking_code = :tracking_code AND id != :partenaire_id
-                """)
-                
-                existing = conn.execute(check_code_query, {
-                    "tracking_code": data['tracking_code'],
-                    "partenaire_id": partenaire_id
-                }).fetchone()
-                
-                if existing:
-                    return jsonify({'message': 'Ce code de tracking existe déjà'}), 409
-                
+                # Le code ne doit pas être utilisé par un autre partenaire
                 update_parts.append("tracking_code = :tracking_code")
+                conditions.append(
+                    "AND NOT EXISTS (SELECT 1 FROM partenaires o WHERE o.tracking_code = :tracking_code AND o.id <> :partenaire_id)"
+                )
                 params["tracking_code"] = data['tracking_code']
             
             if 'contract_signed_at' in data:
@@ -1117,23 +1156,36 @@ def update_partenaire(partenaire_id):
             update_query = text(f"""
                 UPDATE partenaires
                 SET {", ".join(update_parts)}
-                WHERE id = :partenaire_id
+                WHERE id = :partenaire_id AND (user_id = :user_id OR :is_admin)
+                {" ".join(conditions)}
                 RETURNING id
             """)
             
-            result = conn.execute(update_query, params)
-            updated = result.fetchone()
+            updated = conn.execute(update_query, params).fetchone()
             
             if not updated:
+                # Déterminer la cause de l'échec
+                failure = conn.execute(_PARTENAIRE_UPDATE_FAILURE_QUERY, params).one()
+                
+                if not failure.found:
+                    return jsonify({'message': 'Partenaire non trouvé ou non autorisé'}), 404
+                if failure.email_taken:
+                    return jsonify({'message': 'Un partenaire avec cet email existe déjà'}), 409
+                if failure.code_taken:
+                    return jsonify({'message': 'Ce code de tracking existe déjà'}), 409
                 return jsonify({'message': 'Échec de la mise à jour'}), 500
-            
-            # Commit les changements
-            conn.commit()
-            
-            return jsonify({
-                'message': 'Partenaire mis à jour avec succès',
-                'id': partenaire_id
-            })
+        
+        # Un nouveau code a pu être mis en cache comme inconnu
+        if params["tracking_code"]:
+            invalidate_tracking_code('partenaire', params["tracking_code"])
+        
+        return jsonify({
+            'message': 'Partenaire mis à jour avec succès',
+            'id': partenaire_id
+        })
+    except IntegrityError:
+        # Email ou code pris par une requête concurrente (index uniques)
+        return jsonify({'message': 'Un partenaire avec cet email ou ce code de tracking existe déjà'}), 409
     except Exception as e:
         logger.error(f"Error updating partenaire: {str(e)}")
         return jsonify({'message': f'An error occurred: {str(e)}'}), 500
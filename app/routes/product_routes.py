@@ -3,6 +3,8 @@ from flask import Blueprint, request, jsonify, current_app
 from sqlalchemy import text
 from functools import wraps
 
+from app.utils.jwt_utils import get_bearer_token, verify_access_token
+
 # Configurer le logging
 logger = logging.getLogger(__name__)
 
@@ -13,22 +15,14 @@ product_bp = Blueprint('product', __name__, url_prefix='/produits')
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = None
-        auth_header = request.headers.get('Authorization')
-        
-        if auth_header:
-            parts = auth_header.split()
-            if len(parts) == 2 and parts[0].lower() == 'bearer':
-                token = parts[1]
+        token = get_bearer_token(request.headers.get('Authorization'))
         
         if not token:
             return jsonify({'message': 'Token is missing!'}), 401
         
-        # Importer decode_token depuis jwt_utils
-        from app.utils.jwt_utils import decode_token
-        
         try:
-            payload = decode_token(token)
+            # Signature, type et révocation du token vérifiés au même endroit pour toutes les routes
+            payload = verify_access_token(token, current_app.config.get('redis_client'))
             if not payload:
                 return jsonify({'message': 'Token is invalid!'}), 401
             
@@ -3,6 +3,9 @@ from flask import Blueprint, request, jsonify, current_app
 from sqlalchemy import text
 from functools import wraps
 
+from app.utils.jwt_utils import get_bearer_token, verify_access_token
+from app.utils.redis_utils import invalidate_user
+
 # Configurer le logging
 logger = logging.getLogger(__name__)
 
@@ -13,22 +16,14 @@ review_bp = Blueprint('review', __name__, url_prefix='/avis')
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = None
-        auth_header = request.headers.get('Authorization')
-        
-        if auth_header:
-            parts = auth_header.split()
-            if len(parts) == 2 and parts[0].lower() == 'bearer':
-                token = parts[1]
+        token = get_bearer_token(request.headers.get('Authorization'))
         
         if not token:
             return jsonify({'message': 'Token is missing!'}), 401
         
-        # Importer decode_token depuis jwt_utils
-        from app.utils.jwt_utils import decode_token
-        
         try:
-            payload = decode_token(token)
+            # Signature, type et révocation du token vérifiés au même endroit pour toutes les routes
+            payload = verify_access_token(token, current_app.config.get('redis_client'))
             if not payload:
                 return jsonify({'message': 'Token is invalid!'}), 401
             
@@ -503,6 +498,7 @@ def create_freelance_review():
             
             # Commit les changements
             conn.commit()
+            invalidate_user(current_app.config.get('redis_client'), freelance_id)
             
             return jsonify({
                 'id': review_id,
@@ -761,6 +757,9 @@ def moderate_review(review_id):
             # Commit les changements
             conn.commit()
             
+            if review_type == 'freelance' and updated_review.user_id:
+                invalidate_user(current_app.config.get('redis_client'), updated_review.user_id)
+            
             return jsonify({
                 'message': 'Statut de visibilité mis à jour avec succès',
                 'visible': visible
@@ -5,6 +5,7 @@ from flask import Blueprint, request, jsonify, redirect, url_for, current_app
 from sqlalchemy import text
 from functools import wraps
 
+from app.utils.jwt_utils import get_bearer_token, verify_access_token
 from app.utils.stripe_utils import (
     create_checkout_session,
     create_connect_account,
@@ -12,6 +13,7 @@ from app.utils.stripe_utils import (
     check_account_status,
     handle_checkout_session_completed
 )
+from app.utils.redis_utils import invalidate_user
 
 # Configurer le logging
 logger = logging.getLogger(__name__)
@@ -26,22 +28,14 @@ STRIPE_WEBHOOK_SECRET = os.environ.get("STRIPE_WEBHOOK_SECRET")
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = None
-        auth_header = request.headers.get('Authorization')
-        
-        if auth_header:
-            parts = auth_header.split()
-            if len(parts) == 2 and parts[0].lower() == 'bearer':
-                token = parts[1]
+        token = get_bearer_token(request.headers.get('Authorization'))
         
         if not token:
             return jsonify({'message': 'Token is missing!'}), 401
         
-        # Importer decode_token depuis jwt_utils
-        from app.utils.jwt_utils import decode_token
-        
         try:
-            payload = decode_token(token)
+            # Signature, type et révocation du token vérifiés au même endroit pour toutes les routes
+            payload = verify_access_token(token, current_app.config.get('redis_client'))
             if not payload:
                 return jsonify({'message': 'Token is invalid!'}), 401
             
@@ -286,6 +280,7 @@ def create_stripe_connect():
             
             # Commit les changements
             conn.commit()
+            invalidate_user(current_app.config.get('redis_client'), user_id)
             
             # Retourner le lien d'activation
             return jsonify({
@@ -435,6 +430,7 @@ def get_account_status():
             
             # Commit les changements
             conn.commit()
+            invalidate_user(current_app.config.get('redis_client'), user_id)
             
             return jsonify(status)
     except Exception as e:
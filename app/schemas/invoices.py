@@ -14,6 +14,14 @@ class DocumentStatus(str, Enum):
     ENVOYE = "envoyé"
     PAYE = "payé"
     ANNULE = "annulé"
+    EN_PAIEMENT = "en_paiement"
+
+
+def _reject_payment_lock(v):
+    # en_paiement is set and cleared by the payment flow only
+    if v == DocumentStatus.EN_PAIEMENT:
+        raise ValueError('en_paiement is managed by the payment flow and cannot be set directly')
+    return v
 
 class LigneType(str, Enum):
     PRODUIT = "produit"
@@ -87,6 +95,8 @@ class DevisFactureBase(BaseModel):
 # Schema for creating a new invoice/quote
 class DevisFactureCreate(DevisFactureBase):
     lignes: List[LigneCreate] = []
+    
+    _status_writable = validator('status', allow_reuse=True)(_reject_payment_lock)
 
 
 # Schema for updating an invoice/quote
@@ -96,6 +106,8 @@ class DevisFactureUpdate(BaseModel):
     payment_date: Optional[datetime] = None
     payment_method: Optional[str] = None
     notes: Optional[str] = None
+    
+    _status_writable = validator('status', allow_reuse=True)(_reject_payment_lock)
 
 
 # Schema for returning an invoice/quote
@@ -9,8 +9,15 @@ from fastapi import HTTPException, status
 
 from app.config import settings
 
-# Password hashing context
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Password hashing context (argon2id, bcrypt kept to verify older hashes)
+pwd_context = CryptContext(
+    schemes=["argon2", "bcrypt"],
+    deprecated="auto",
+    argon2__type="ID",
+    argon2__time_cost=2,
+    argon2__memory_cost=19456,
+    argon2__parallelism=1
+)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify if the plain password matches the hashed password"""
@@ -0,0 +1,28 @@
+from flask import current_app, g
+
+def get_request_connection():
+    """
+    Renvoie la connexion à la base partagée par toute la requête en cours
+
+    La connexion est prise dans le pool au premier appel, puis réutilisée par
+    les appels suivants de la même requête ; elle est rendue au pool par
+    close_request_connection à la fin de la requête.
+
+    Returns:
+        Connection: La connexion de la requête, ou None si la base n'est pas configurée
+    """
+    conn = g.get('db_conn')
+    if conn is None:
+        engine = current_app.config.get('db_engine')
+        if engine is None:
+            return None
+        conn = g.db_conn = engine.connect()
+    return conn
+
+def close_request_connection(exc=None):
+    """
+    Rend au pool la connexion de la requête (enregistrée en teardown de l'application)
+    """
+    conn = g.pop('db_conn', None)
+    if conn is not None:
+        conn.close()
@@ -0,0 +1,54 @@
+import decimal
+from datetime import date
+
+import orjson
+from flask.json.provider import JSONProvider
+from werkzeug.http import http_date
+
+# Les dates sont passées à _default pour garder le format HTTP de Flask
+ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+def _default(o):
+    """
+    Sérialise les types non gérés nativement par orjson
+    """
+    if isinstance(o, date):
+        return http_date(o)
+
+    # Les montants Decimal des requêtes SQL sont renvoyés comme des nombres
+    if isinstance(o, decimal.Decimal):
+        return float(o)
+
+    if hasattr(o, "__html__"):
+        return str(o.__html__())
+
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+# Les dates sont encodées directement par orjson au format ISO 8601
+ORJSON_ISO_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+def dumps_bytes(obj, iso_dates=False):
+    """
+    Encode un objet en JSON (bytes) avec les mêmes règles que jsonify
+
+    Avec iso_dates=True, les dates sont au format ISO 8601 (comme isoformat())
+    au lieu du format HTTP de jsonify
+    """
+    option = ORJSON_ISO_OPTIONS if iso_dates else ORJSON_OPTIONS
+    return orjson.dumps(obj, default=_default, option=option)
+
+class OrjsonProvider(JSONProvider):
+    """
+    Fournisseur JSON Flask basé sur orjson (utilisé par jsonify et request.json)
+    """
+
+    def dumps(self, obj, **kwargs):
+        return dumps_bytes(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Encoder directement en bytes, sans passer par une chaîne intermédiaire
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps_bytes(obj), mimetype="application/json")
@@ -1,38 +1,69 @@
 import os
 import jwt
+import hashlib
 import logging
+import secrets
+import threading
 import time
 import urllib.parse
 from datetime import datetime, timedelta
 from typing import Dict, Optional, Union, Tuple
+from cachetools import TLRUCache
+
+from app.utils.redis_utils import is_token_blacklisted
 
 # Configuration du logger
 logger = logging.getLogger(__name__)
 
 # Obtenir les clés et paramètres depuis les variables d'environnement
 JWT_SECRET_KEY = os.environ.get("JWT_SECRET_KEY", "super_secret_key_change_this_in_production")
+# HS256 par défaut ; EdDSA (JWT_SECRET_KEY = clé privée Ed25519 au format PEM) signe
+# plus vite que RS256 et nécessite le backend cryptography (PyJWT[crypto])
 JWT_ALGORITHM = os.environ.get("JWT_ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
 REFRESH_TOKEN_EXPIRE_DAYS = int(os.environ.get("REFRESH_TOKEN_EXPIRE_DAYS", 7))
 FRONTEND_URL = os.environ.get("FRONTEND_URL", "https://bemynet.fr")
+# Préfixe de la page du frontend qui reçoit les tokens OAuth
+OAUTH_REDIRECT_BASE = f"{FRONTEND_URL}/auth/oauth?"
 
 # Avertissement si la clé par défaut est utilisée
 if JWT_SECRET_KEY == "super_secret_key_change_this_in_production":
     logger.warning("JWT_SECRET_KEY not provided, using temporary key (will change on restart)")
 
+# Clés préparées une seule fois au chargement (évite de re-parser la clé à chaque appel)
+_jwt_algorithm = jwt.get_algorithm_by_name(JWT_ALGORITHM)
+_SIGNING_KEY = _jwt_algorithm.prepare_key(JWT_SECRET_KEY)
+# Pour les algorithmes asymétriques, la vérification se fait avec la clé publique
+_VERIFYING_KEY = _SIGNING_KEY.public_key() if hasattr(_SIGNING_KEY, 'public_key') else _SIGNING_KEY
+
+# Claims indispensables, vérifiés par PyJWT lors du décodage
+_DECODE_OPTIONS = {'require': ['exp', 'sub', 'type']}
+
+# Durée maximale de conservation d'un token déjà vérifié
+TOKEN_CACHE_TTL_SECONDS = 60
+
+def _token_cache_expiry(key: str, payload: Dict, now: float) -> float:
+    # Une entrée n'est jamais conservée au-delà de l'expiration du token
+    return min(now + TOKEN_CACHE_TTL_SECONDS, payload.get('exp', now))
+
+# Cache des payloads vérifiés, indexé par le SHA-256 du token
+_token_cache = TLRUCache(maxsize=10000, ttu=_token_cache_expiry, timer=time.time)
+_token_cache_lock = threading.Lock()
+
 def create_access_token(user_id: Union[str, int], name: Optional[str] = None, email: Optional[str] = None, role: Optional[str] = None) -> str:
     expiration = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     payload = {
         'sub': str(user_id),
         'exp': int(expiration.timestamp()),
         'iat': int(time.time()),
-        'type': 'access'
+        'type': 'access',
+        'jti': secrets.token_hex(8)
     }
     if name: payload['name'] = name
     if email: payload['email'] = email
     if role: payload['role'] = role
 
-    return jwt.encode(payload, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
+    return jwt.encode(payload, _SIGNING_KEY, algorithm=JWT_ALGORITHM)
 
 def create_refresh_token(user_id: Union[str, int]) -> str:
     """
@@ -52,17 +83,75 @@ def create_refresh_token(user_id: Union[str, int]) -> str:
         'sub': str(user_id),
         'exp': int(expiration.timestamp()),
         'iat': int(time.time()),
-        'type': 'refresh'
+        'type': 'refresh',
+        'jti': secrets.token_hex(8)
     }
     
     # Génération du token
     try:
-        token = jwt.encode(payload, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
+        token = jwt.encode(payload, _SIGNING_KEY, algorithm=JWT_ALGORITHM)
         return token
     except Exception as e:
         logger.error(f"Erreur lors de la création du refresh token: {str(e)}")
         raise
 
+def create_token_pair(user_id: Union[str, int], name: Optional[str] = None, email: Optional[str] = None, role: Optional[str] = None) -> Tuple[str, str]:
+    """
+    Crée un token d'accès et un token de rafraîchissement en partageant les claims communs.
+    
+    Args:
+        user_id: L'identifiant de l'utilisateur
+        name: Nom complet ajouté au token d'accès (optionnel)
+        email: Adresse email ajoutée au token d'accès (optionnel)
+        role: Rôle ajouté au token d'accès (optionnel)
+        
+    Returns:
+        Tuple[str, str]: Tuple contenant (access_token, refresh_token)
+    """
+    now = int(time.time())
+    base = {'sub': str(user_id), 'iat': now}
+    
+    access_payload = {
+        **base,
+        'exp': now + ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+        'type': 'access',
+        'jti': secrets.token_hex(8)
+    }
+    if name: access_payload['name'] = name
+    if email: access_payload['email'] = email
+    if role: access_payload['role'] = role
+    
+    refresh_payload = {
+        **base,
+        'exp': now + REFRESH_TOKEN_EXPIRE_DAYS * 86400,
+        'type': 'refresh',
+        'jti': secrets.token_hex(8)
+    }
+    
+    return (
+        jwt.encode(access_payload, _SIGNING_KEY, algorithm=JWT_ALGORITHM),
+        jwt.encode(refresh_payload, _SIGNING_KEY, algorithm=JWT_ALGORITHM)
+    )
+
+def get_bearer_token(auth_header: Optional[str]) -> Optional[str]:
+    """
+    Extrait le token d'un en-tête Authorization "Bearer <token>".
+    
+    Le schéma est comparé sans tenir compte de la casse (RFC 7235).
+    
+    Args:
+        auth_header: La valeur de l'en-tête Authorization (ou None)
+        
+    Returns:
+        Optional[str]: Le token, ou None si l'en-tête est absent ou mal formé
+    """
+    if not auth_header:
+        return None
+    parts = auth_header.split()
+    if len(parts) == 2 and parts[0].lower() == 'bearer':
+        return parts[1]
+    return None
+
 def decode_token(token: str) -> Optional[Dict]:
     """
     Décode et vérifie un token JWT.
@@ -75,7 +164,7 @@ def decode_token(token: str) -> Optional[Dict]:
     """
     try:
         # Décodage et vérification du token
-        payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
+        payload = jwt.decode(token, _VERIFYING_KEY, algorithms=[JWT_ALGORITHM], options=_DECODE_OPTIONS)
         return payload
     except jwt.ExpiredSignatureError:
         logger.warning("Token expiré")
@@ -87,6 +176,54 @@ def decode_token(token: str) -> Optional[Dict]:
         logger.error(f"Erreur lors du décodage du token: {str(e)}")
         return None
 
+def decode_token_cached(token: str) -> Optional[Dict]:
+    """
+    Décode un token JWT en réutilisant le résultat d'une vérification récente.
+    
+    Seuls les tokens valides sont mis en cache, pour au plus
+    TOKEN_CACHE_TTL_SECONDS et jamais au-delà de leur expiration.
+    
+    Args:
+        token: Le token JWT à vérifier
+        
+    Returns:
+        Optional[Dict]: Les données décodées du token ou None si invalide
+    """
+    key = hashlib.sha256(token.encode()).hexdigest()
+    
+    with _token_cache_lock:
+        payload = _token_cache.get(key)
+    if payload is not None:
+        return payload
+    
+    payload = decode_token(token)
+    if payload:
+        with _token_cache_lock:
+            _token_cache[key] = payload
+    return payload
+
+def verify_access_token(token: str, redis_client=None) -> Optional[Dict]:
+    """
+    Vérifie le token d'accès présenté à une route protégée.
+    
+    La signature et l'expiration sont vérifiées via decode_token_cached ; le
+    type du token et sa révocation (blacklist Redis) sont contrôlés à chaque
+    appel, pour qu'un token révoqué par /auth/logout soit refusé partout.
+    
+    Args:
+        token: Le token JWT à vérifier
+        redis_client: Client Redis de la blacklist (None si Redis n'est pas configuré)
+        
+    Returns:
+        Optional[Dict]: Les données décodées du token ou None s'il est refusé
+    """
+    payload = decode_token_cached(token)
+    if not payload or payload.get('type') != 'access':
+        return None
+    if is_token_blacklisted(redis_client, payload):
+        return None
+    return payload
+
 def create_oauth_tokens(user_id: int, full_name: str, email: str, role: str) -> Tuple[str, str]:
     """
     Crée des tokens d'accès et de rafraîchissement pour un utilisateur OAuth.
@@ -101,32 +238,7 @@ def create_oauth_tokens(user_id: int, full_name: str, email: str, role: str) ->
         Tuple[str, str]: Tuple contenant (access_token, refresh_token)
     """
     try:
-        # Créer un access token avec des informations supplémentaires
-        expiration = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-        access_payload = {
-            'sub': str(user_id),
-            'exp': int(expiration.timestamp()),
-            'iat': int(time.time()),
-            'type': 'access',
-            'name': full_name,
-            'email': email,
-            'role': role
-        }
-        
-        access_token = jwt.encode(access_payload, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
-        
-        # Créer un refresh token
-        expiration = datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
-        refresh_payload = {
-            'sub': str(user_id),
-            'exp': int(expiration.timestamp()),
-            'iat': int(time.time()),
-            'type': 'refresh'
-        }
-        
-        refresh_token = jwt.encode(refresh_payload, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
-        
-        return access_token, refresh_token
+        return create_token_pair(user_id, name=full_name, email=email, role=role)
     
     except Exception as e:
         logger.error(f"Erreur lors de la création des tokens OAuth: {str(e)}")
@@ -145,18 +257,12 @@ def generate_oauth_redirect_url(access_token: str, refresh_token: str, is_new_us
         str: URL de redirection avec les tokens en query params
     """
     try:
-        # Construire l'URL avec les paramètres
-        params = {
+        # Ajouter les paramètres au préfixe précalculé de l'URL du frontend
+        return OAUTH_REDIRECT_BASE + urllib.parse.urlencode({
             'access_token': access_token,
             'refresh_token': refresh_token,
             'is_new_user': '1' if is_new_user else '0'
-        }
-        
-        # Ajouter les paramètres à l'URL du frontend
-        query_string = urllib.parse.urlencode(params)
-        redirect_url = f"{FRONTEND_URL}/auth/oauth?{query_string}"
-        
-        return redirect_url
+        })
     
     except Exception as e:
         logger.error(f"Erreur lors de la génération de l'URL de redirection: {str(e)}")
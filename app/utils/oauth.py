@@ -1,5 +1,6 @@
 import os
 import logging
+import jwt
 import requests
 from urllib.parse import urlencode
 
@@ -12,6 +13,7 @@ GOOGLE_CLIENT_SECRET = os.environ.get("GOOGLE_OAUTH_CLIENT_SECRET")
 GOOGLE_AUTH_URL = "https://accounts.google.com/o/oauth2/v2/auth"
 GOOGLE_TOKEN_URL = "https://oauth2.googleapis.com/token"
 GOOGLE_USERINFO_URL = "https://www.googleapis.com/oauth2/v3/userinfo"
+GOOGLE_ISSUERS = ("https://accounts.google.com", "accounts.google.com")
 
 # Configuration Discord OAuth
 DISCORD_CLIENT_ID = os.environ.get("DISCORD_CLIENT_ID")
@@ -20,6 +22,15 @@ DISCORD_AUTH_URL = "https://discord.com/api/oauth2/authorize"
 DISCORD_TOKEN_URL = "https://discord.com/api/oauth2/token"
 DISCORD_USERINFO_URL = "https://discord.com/api/users/@me"
 
+# Session HTTP partagée : les connexions TCP/TLS vers Google et Discord sont
+# gardées ouvertes et réutilisées d'un callback à l'autre
+_http = requests.Session()
+_http.mount("https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=32))
+
+# Délais (connexion, lecture) des appels aux fournisseurs, pour qu'un fournisseur
+# lent ne bloque pas indéfiniment un worker
+HTTP_TIMEOUT = (3.05, 10)
+
 def get_google_auth_url(redirect_uri):
     """
     Génère l'URL d'authentification Google
@@ -34,7 +45,7 @@ def get_google_auth_url(redirect_uri):
         "client_id": GOOGLE_CLIENT_ID,
         "redirect_uri": redirect_uri,
         "response_type": "code",
-        "scope": "email profile",
+        "scope": "openid email profile",
         "access_type": "offline",
         "prompt": "consent"
     }
@@ -61,7 +72,7 @@ def get_google_token(code, redirect_uri):
         "grant_type": "authorization_code"
     }
     
-    response = requests.post(GOOGLE_TOKEN_URL, data=data)
+    response = _http.post(GOOGLE_TOKEN_URL, data=data, timeout=HTTP_TIMEOUT)
     return response.json()
 
 def get_google_user_info(access_token):
@@ -75,9 +86,39 @@ def get_google_user_info(access_token):
         dict: Informations de l'utilisateur Google
     """
     headers = {"Authorization": f"Bearer {access_token}"}
-    response = requests.get(GOOGLE_USERINFO_URL, headers=headers)
+    response = _http.get(GOOGLE_USERINFO_URL, headers=headers, timeout=HTTP_TIMEOUT)
     return response.json()
 
+def get_google_id_token_claims(token_data):
+    """
+    Extrait les informations de l'utilisateur de l'id_token Google, sans
+    appel supplémentaire à l'endpoint userinfo
+    
+    L'id_token est reçu directement de l'endpoint token de Google en HTTPS,
+    sa signature n'a donc pas à être vérifiée (OpenID Connect Core 3.1.3.7) ;
+    l'audience et l'émetteur sont contrôlés.
+    
+    Args:
+        token_data: Données du token Google renvoyées par get_google_token
+    
+    Returns:
+        dict: Informations de l'utilisateur Google, ou None si l'id_token est absent ou invalide
+    """
+    id_token = token_data.get("id_token")
+    if not id_token or not GOOGLE_CLIENT_ID:
+        return None
+    
+    try:
+        return jwt.decode(
+            id_token,
+            options={"verify_signature": False, "verify_aud": True, "verify_iss": True},
+            audience=GOOGLE_CLIENT_ID,
+            issuer=GOOGLE_ISSUERS
+        )
+    except jwt.InvalidTokenError as e:
+        logger.warning("Invalid Google id_token, falling back to userinfo: %s", e)
+        return None
+
 def get_discord_auth_url(redirect_uri):
     """
     Génère l'URL d'authentification Discord
@@ -121,7 +162,7 @@ def get_discord_token(code, redirect_uri):
         "Content-Type": "application/x-www-form-urlencoded"
     }
     
-    response = requests.post(DISCORD_TOKEN_URL, data=data, headers=headers)
+    response = _http.post(DISCORD_TOKEN_URL, data=data, headers=headers, timeout=HTTP_TIMEOUT)
     return response.json()
 
 def get_discord_user_info(access_token):
@@ -135,5 +176,5 @@ def get_discord_user_info(access_token):
         dict: Informations de l'utilisateur Discord
     """
     headers = {"Authorization": f"Bearer {access_token}"}
-    response = requests.get(DISCORD_USERINFO_URL, headers=headers)
+    response = _http.get(DISCORD_USERINFO_URL, headers=headers, timeout=HTTP_TIMEOUT)
     return response.json()
\ No newline at end of file
@@ -0,0 +1,17 @@
+import base64
+import binascii
+from datetime import datetime
+
+def encode_cursor(date, row_id):
+    """Encode la position (date, id) de la dernière ligne en curseur opaque (date éventuellement None)"""
+    raw = f"{date.isoformat() if date is not None else ''}:{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor):
+    """Décode un curseur en tuple (date, id), lève ValueError si invalide (date None si vide)"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+    except (binascii.Error, UnicodeDecodeError) as e:
+        raise ValueError('Invalid cursor') from e
+    date_str, _, row_id = raw.rpartition(':')
+    return (datetime.fromisoformat(date_str) if date_str else None), int(row_id)
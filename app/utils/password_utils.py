@@ -1,28 +1,29 @@
 import bcrypt
 import logging
+from argon2 import PasswordHasher
+from argon2.exceptions import VerificationError
 
 # Configuration du logger
 logger = logging.getLogger(__name__)
 
+# Hasheur argon2id (paramètres recommandés par l'OWASP), thread-safe et partagé
+_password_hasher = PasswordHasher(time_cost=2, memory_cost=19456, parallelism=1)
+
+def _is_argon2_hash(hashed_password: str) -> bool:
+    return hashed_password.startswith('$argon2')
+
 def hash_password(password: str) -> str:
     """
-    Hash un mot de passe en utilisant bcrypt.
+    Hash un mot de passe en utilisant argon2id.
     
     Args:
         password: Le mot de passe en clair à hacher
         
     Returns:
-        str: Le mot de passe haché en format string UTF-8
+        str: Le mot de passe haché au format PHC ($argon2id$...)
     """
     try:
-        # Générer un salt aléatoire et hacher le mot de passe
-        # 12 est un bon équilibre entre sécurité et performance
-        password_bytes = password.encode('utf-8')
-        salt = bcrypt.gensalt(rounds=12)
-        hashed = bcrypt.hashpw(password_bytes, salt)
-        
-        # Retourner le hash sous forme de chaîne
-        return hashed.decode('utf-8')
+        return _password_hasher.hash(password)
     except Exception as e:
         logger.error(f"Erreur lors du hachage du mot de passe: {str(e)}")
         raise
@@ -39,12 +40,29 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
         bool: True si le mot de passe correspond, False sinon
     """
     try:
-        # Encoder les entrées en bytes
+        if _is_argon2_hash(hashed_password):
+            return _password_hasher.verify(hashed_password, plain_password)
+        
+        # Anciens hashs bcrypt
         password_bytes = plain_password.encode('utf-8')
         hashed_bytes = hashed_password.encode('utf-8')
-        
-        # Vérifier le mot de passe
         return bcrypt.checkpw(password_bytes, hashed_bytes)
+    except VerificationError:
+        return False
     except Exception as e:
         logger.error(f"Erreur lors de la vérification du mot de passe: {str(e)}")
-        return False
\ No newline at end of file
+        return False
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    """
+    Indique si un hash doit être recalculé (ancien hash bcrypt ou paramètres argon2 obsolètes).
+    
+    Args:
+        hashed_password: Le hash du mot de passe stocké
+        
+    Returns:
+        bool: True si le hash doit être remplacé après une connexion réussie
+    """
+    if not _is_argon2_hash(hashed_password):
+        return True
+    return _password_hasher.check_needs_rehash(hashed_password)
@@ -35,6 +35,8 @@ class InvoicePDF(FPDF):
         
     def format_date(self, date_str):
         """Formate une date ISO en format lisible"""
+        if isinstance(date_str, datetime):
+            return date_str.strftime('%d/%m/%Y')
         try:
             date_obj = datetime.fromisoformat(date_str.replace('Z', '+00:00'))
             return date_obj.strftime('%d/%m/%Y')
@@ -93,7 +95,8 @@ class InvoicePDF(FPDF):
             'en_attente': 'En attente',
             'envoyé': 'Envoyé',
             'payé': 'Payé',
-            'annulé': 'Annulé'
+            'annulé': 'Annulé',
+            'en_paiement': 'Paiement en cours'
         }
         status = status_map.get(self.doc_data.get('status', 'en_attente'), 'En attente')
         self.cell(0, 7, status, 0, 1)
@@ -0,0 +1,156 @@
+import time
+import logging
+from typing import Dict, Optional
+
+import redis
+
+# Configuration du logger
+logger = logging.getLogger(__name__)
+
+# Durée de conservation du profil renvoyé par /auth/me
+USER_CACHE_TTL_SECONDS = 60
+
+# Durée pendant laquelle une session de paiement est renvoyée pour un même document
+PAYMENT_SESSION_TTL_SECONDS = 600
+
+def create_redis_client(redis_url: Optional[str]) -> Optional[redis.Redis]:
+    """
+    Crée le client Redis partagé par les applications Flask et FastAPI
+
+    Les délais courts évitent qu'un Redis indisponible ne bloque les requêtes,
+    les appelants traitant les erreurs Redis comme un cache manquant.
+
+    Returns:
+        Optional[redis.Redis]: Le client, ou None si Redis n'est pas configuré
+    """
+    if not redis_url:
+        return None
+    return redis.Redis.from_url(
+        redis_url,
+        socket_timeout=0.5,
+        socket_connect_timeout=0.5
+    )
+
+def user_cache_key(user_id: int) -> str:
+    return f"user:{user_id}"
+
+def _blacklist_key(jti: str) -> str:
+    return f"jwt:blacklist:{jti}"
+
+def _payment_session_key(doc_id: int) -> str:
+    return f"pay:{doc_id}"
+
+def blacklist_token(redis_client: Optional[redis.Redis], payload: Dict) -> bool:
+    """
+    Ajoute un token à la blacklist jusqu'à son expiration.
+
+    Args:
+        redis_client: Client Redis (None si Redis n'est pas configuré)
+        payload: Les données décodées du token
+
+    Returns:
+        bool: True si le token a été révoqué
+    """
+    jti = payload.get('jti')
+    if redis_client is None or not jti:
+        return False
+
+    ttl = int(payload.get('exp', 0) - time.time())
+    if ttl <= 0:
+        return True
+
+    try:
+        redis_client.setex(_blacklist_key(jti), ttl, 1)
+        return True
+    except redis.RedisError as e:
+        logger.warning("Redis SETEX failed for token blacklist: %s", e)
+        return False
+
+def is_token_blacklisted(redis_client: Optional[redis.Redis], payload: Dict) -> bool:
+    """
+    Vérifie si un token a été révoqué (considéré valide si Redis est indisponible).
+    """
+    jti = payload.get('jti')
+    if redis_client is None or not jti:
+        return False
+
+    try:
+        return bool(redis_client.exists(_blacklist_key(jti)))
+    except redis.RedisError as e:
+        logger.warning("Redis EXISTS failed for token blacklist: %s", e)
+        return False
+
+def get_cached_user(redis_client: Optional[redis.Redis], user_id: int) -> Optional[bytes]:
+    """
+    Récupère le profil JSON mis en cache d'un utilisateur, ou None.
+    """
+    if redis_client is None:
+        return None
+
+    try:
+        return redis_client.get(user_cache_key(user_id))
+    except redis.RedisError as e:
+        logger.warning("Redis GET failed for user %s: %s", user_id, e)
+        return None
+
+def cache_user(redis_client: Optional[redis.Redis], user_id: int, user_json: bytes) -> None:
+    """
+    Met en cache le profil JSON d'un utilisateur pour USER_CACHE_TTL_SECONDS.
+    """
+    if redis_client is None:
+        return
+
+    try:
+        redis_client.setex(user_cache_key(user_id), USER_CACHE_TTL_SECONDS, user_json)
+    except redis.RedisError as e:
+        logger.warning("Redis SETEX failed for user %s: %s", user_id, e)
+
+def invalidate_user(redis_client: Optional[redis.Redis], user_id: int) -> None:
+    """
+    Retire le profil d'un utilisateur du cache après une modification.
+    """
+    if redis_client is None:
+        return
+
+    try:
+        redis_client.delete(user_cache_key(user_id))
+    except redis.RedisError as e:
+        logger.warning("Redis DEL failed for user %s: %s", user_id, e)
+
+def get_cached_payment_session(redis_client: Optional[redis.Redis], doc_id: int) -> Optional[bytes]:
+    """
+    Récupère la session de paiement (JSON) déjà créée pour un document, ou None.
+    """
+    if redis_client is None:
+        return None
+
+    try:
+        return redis_client.get(_payment_session_key(doc_id))
+    except redis.RedisError as e:
+        logger.warning("Redis GET failed for payment session of document %s: %s", doc_id, e)
+        return None
+
+def cache_payment_session(redis_client: Optional[redis.Redis], doc_id: int, session_json: bytes) -> None:
+    """
+    Mémorise la session de paiement d'un document pour PAYMENT_SESSION_TTL_SECONDS
+    (une session déjà mémorisée n'est pas remplacée).
+    """
+    if redis_client is None:
+        return
+
+    try:
+        redis_client.set(_payment_session_key(doc_id), session_json, nx=True, ex=PAYMENT_SESSION_TTL_SECONDS)
+    except redis.RedisError as e:
+        logger.warning("Redis SET failed for payment session of document %s: %s", doc_id, e)
+
+def invalidate_payment_session(redis_client: Optional[redis.Redis], doc_id: int) -> None:
+    """
+    Oublie la session de paiement d'un document après un changement de statut.
+    """
+    if redis_client is None:
+        return
+
+    try:
+        redis_client.delete(_payment_session_key(doc_id))
+    except redis.RedisError as e:
+        logger.warning("Redis DEL failed for payment session of document %s: %s", doc_id, e)
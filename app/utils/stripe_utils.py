@@ -29,7 +29,8 @@ def create_checkout_session(
     montant, 
     description, 
     freelance_stripe_id=None,
-    metadata=None
+    metadata=None,
+    montant_cents=None
 ):
     """
     Crée une session de paiement Stripe avec partage de paiement si possible
@@ -38,10 +39,11 @@ def create_checkout_session(
         client_id: ID du client
         product_id: ID du produit
         freelance_id: ID du freelance
-        montant: Montant en centimes
+        montant: Montant en euros (ignoré si montant_cents est fourni)
         description: Description de l'achat
         freelance_stripe_id: ID Stripe du freelance pour le partage (optionnel)
         metadata: Métadonnées additionnelles pour la session (optionnel)
+        montant_cents: Montant entier en centimes, transmis tel quel à Stripe (optionnel)
         
     Returns:
         Session Stripe créée
@@ -62,6 +64,9 @@ def create_checkout_session(
         if metadata:
             session_metadata.update(metadata)
         
+        # Montant en centimes (conversion depuis les euros si besoin)
+        unit_amount = montant_cents if montant_cents is not None else int(montant * 100)
+        
         session_params = {
             "payment_method_types": ["card"],
             "line_items": [{
@@ -70,7 +75,7 @@ def create_checkout_session(
                     "product_data": {
                         "name": description,
                     },
-                    "unit_amount": int(montant * 100),  # Conversion euros -> centimes
+                    "unit_amount": unit_amount,
                 },
                 "quantity": 1,
             }],
@@ -83,7 +88,7 @@ def create_checkout_session(
         # Si le freelance a un compte Stripe Connect, configurer le partage de paiement
         if freelance_stripe_id:
             # Calcul de la commission plateforme (15% par défaut)
-            application_fee_amount = int(montant * 100 * 0.15)  # 15% en centimes
+            application_fee_amount = unit_amount * 15 // 100  # 15% en centimes
             
             # Configurer le transfert vers le compte du freelance
             session_params["payment_intent_data"] = {
@@ -98,7 +103,7 @@ def create_checkout_session(
         
         return checkout_session
     except Exception as e:
-        logger.error(f"Error creating Stripe checkout session: {str(e)}")
+        logger.error("Error creating Stripe checkout session: %s", e)
         raise
 
 def create_connect_account(email, country="FR", refresh_url=None, return_url=None):
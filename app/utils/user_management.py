@@ -1,11 +1,110 @@
 import logging
+import threading
 from datetime import datetime
+from cachetools import TTLCache
 from sqlalchemy import text
 from werkzeug.security import generate_password_hash
 
 # Configurer le logging
 logger = logging.getLogger(__name__)
 
+# Cache des rôles utilisateurs (user_id -> role), propre à chaque processus.
+# Les rôles ne sont modifiés que par l'API FastAPI (PUT /users/me et /users/{id}),
+# qui ne peut pas vider ce cache : un changement de rôle, y compris le retrait du rôle admin
+# contrôlé par admin_required, n'est pris en compte qu'après au plus
+# ROLE_CACHE_TTL_SECONDS secondes.
+ROLE_CACHE_TTL_SECONDS = 60
+_role_cache = TTLCache(maxsize=5000, ttl=ROLE_CACHE_TTL_SECONDS)
+_role_cache_lock = threading.Lock()
+
+_ROLE_QUERY = text("SELECT role FROM users WHERE id = :user_id")
+
+def _cached_user_role(user_id):
+    with _role_cache_lock:
+        return _role_cache.get(user_id)
+
+def get_user_role(conn, user_id):
+    """
+    Récupère le rôle d'un utilisateur en évitant la requête si le rôle est en cache
+    
+    Args:
+        conn: Connection à la base de données
+        user_id: ID de l'utilisateur
+    
+    Returns:
+        str: Le rôle de l'utilisateur, ou None si l'utilisateur n'existe pas
+    """
+    role = _cached_user_role(user_id)
+    if role is not None:
+        return role
+    
+    result = conn.execute(_ROLE_QUERY, {"user_id": user_id}).fetchone()
+    if not result:
+        return None
+    
+    with _role_cache_lock:
+        _role_cache[user_id] = result.role
+    return result.role
+
+def load_user_role(engine, user_id):
+    """
+    Comme get_user_role, mais n'ouvre une connexion que si le rôle n'est pas en cache
+    
+    Args:
+        engine: Moteur SQLAlchemy
+        user_id: ID de l'utilisateur
+    
+    Returns:
+        str: Le rôle de l'utilisateur, ou None si l'utilisateur n'existe pas
+    """
+    role = _cached_user_role(user_id)
+    if role is not None:
+        return role
+    
+    with engine.connect() as conn:
+        return get_user_role(conn, user_id)
+
+# Connexion sociale en une requête :
+# - authentification existante : mise à jour des dates de dernière connexion
+# - sinon : création de l'utilisateur (ou réutilisation du compte ayant le même
+#   email) puis de l'authentification ; xmax = 0 indique une ligne insérée
+_SOCIAL_LOGIN_QUERY = text("""
+    WITH existing_auth AS (
+        UPDATE authentifications
+        SET last_login_at = NOW()
+        WHERE provider = :provider AND provider_user_id = :provider_user_id
+        RETURNING user_id
+    ),
+    touched_user AS (
+        UPDATE users
+        SET last_login_at = NOW()
+        WHERE id IN (SELECT user_id FROM existing_auth)
+        RETURNING id, full_name, email, role
+    ),
+    new_user AS (
+        INSERT INTO users (
+            full_name, email, role,
+            account_status, created_at, last_login_at
+        )
+        SELECT :full_name, :email, 'freelance', 'active', NOW(), NOW()
+        WHERE NOT EXISTS (SELECT 1 FROM existing_auth)
+        ON CONFLICT (email) DO UPDATE SET last_login_at = NOW()
+        RETURNING id, full_name, email, role, (xmax = 0) as is_new
+    ),
+    new_auth AS (
+        INSERT INTO authentifications (
+            user_id, provider, provider_user_id,
+            email, created_at, last_login_at
+        )
+        SELECT id, :provider, :provider_user_id, :email, NOW(), NOW()
+        FROM new_user
+        ON CONFLICT (provider, provider_user_id) DO NOTHING
+    )
+    SELECT id, full_name, email, role, FALSE as is_new FROM touched_user
+    UNION ALL
+    SELECT id, full_name, email, role, is_new FROM new_user
+""")
+
 def find_or_create_social_user(conn, provider, provider_user_id, email, full_name=None):
     """
     Trouve un utilisateur existant ou en crée un nouveau à partir d'une authentification sociale
@@ -21,121 +120,19 @@ def find_or_create_social_user(conn, provider, provider_user_id, email, full_nam
         dict: Les informations de l'utilisateur trouvé ou créé
     """
     try:
-        # Vérifier si une authentification existe déjà pour ce fournisseur et cet ID
-        auth_query = text("""
-            SELECT a.*, u.* 
-            FROM authentifications a
-            JOIN users u ON a.user_id = u.id
-            WHERE a.provider = :provider AND a.provider_user_id = :provider_user_id
-            LIMIT 1
-        """)
-        
-        existing_auth = conn.execute(auth_query, {
-            "provider": provider,
-            "provider_user_id": provider_user_id
-        }).fetchone()
-        
-        if existing_auth:
-            # Mettre à jour la date de dernière connexion
-            update_login_query = text("""
-                UPDATE authentifications
-                SET last_login_at = NOW()
-                WHERE id = :auth_id
-            """)
-            
-            conn.execute(update_login_query, {
-                "auth_id": existing_auth.id
-            })
-            
-            # Mettre à jour la date de dernière connexion de l'utilisateur
-            update_user_query = text("""
-                UPDATE users
-                SET last_login_at = NOW()
-                WHERE id = :user_id
-            """)
-            
-            conn.execute(update_user_query, {
-                "user_id": existing_auth.user_id
-            })
-            
-            # Retourner l'utilisateur existant
-            return {
-                "id": existing_auth.user_id,
-                "full_name": existing_auth.full_name,
-                "email": existing_auth.email,
-                "role": existing_auth.role,
-                "is_new": False
-            }
-        
-        # Vérifier si un utilisateur existe avec cet email
-        user_query = text("""
-            SELECT * FROM users
-            WHERE email = :email
-            LIMIT 1
-        """)
-        
-        existing_user = conn.execute(user_query, {
-            "email": email
-        }).fetchone()
-        
-        user_id = None
-        is_new = False
-        
-        if existing_user:
-            # Utiliser l'utilisateur existant
-            user_id = existing_user.id
-            user_role = existing_user.role
-            user_name = existing_user.full_name
-        else:
-            # Créer un nouvel utilisateur
-            insert_user_query = text("""
-                INSERT INTO users (
-                    full_name, email, role, 
-                    account_status, created_at, last_login_at
-                )
-                VALUES (
-                    :full_name, :email, 'freelance',
-                    'active', NOW(), NOW()
-                )
-                RETURNING id, full_name, email, role
-            """)
-            
-            new_user = conn.execute(insert_user_query, {
-                "full_name": full_name or email.split('@')[0],
-                "email": email
-            }).fetchone()
-            
-            user_id = new_user.id
-            user_role = new_user.role
-            user_name = new_user.full_name
-            is_new = True
-        
-        # Créer une entrée d'authentification pour cet utilisateur
-        insert_auth_query = text("""
-            INSERT INTO authentifications (
-                user_id, provider, provider_user_id,
-                email, created_at, last_login_at
-            )
-            VALUES (
-                :user_id, :provider, :provider_user_id,
-                :email, NOW(), NOW()
-            )
-        """)
-        
-        conn.execute(insert_auth_query, {
-            "user_id": user_id,
+        user = conn.execute(_SOCIAL_LOGIN_QUERY, {
             "provider": provider,
             "provider_user_id": provider_user_id,
-            "email": email
-        })
+            "email": email,
+            "full_name": full_name or email.split('@')[0]
+        }).one()
         
-        # Retourner les informations de l'utilisateur
         return {
-            "id": user_id,
-            "full_name": user_name,
-            "email": email,
-            "role": user_role,
-            "is_new": is_new
+            "id": user.id,
+            "full_name": user.full_name,
+            "email": user.email,
+            "role": user.role,
+            "is_new": user.is_new
         }
     except Exception as e:
         logger.error(f"Error in find_or_create_social_user: {str(e)}")
@@ -0,0 +1,173 @@
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from cachetools import TLRUCache
+from sqlalchemy import bindparam, text
+
+# Configurer le logging
+logger = logging.getLogger(__name__)
+
+# Cache des codes de tracking: (source_type, code) -> source_id
+# Le cache est propre à chaque processus : invalidate_tracking_code ne vide que
+# celui du processus qui a modifié le code, les autres workers peuvent attribuer
+# les visites à l'ancien code (ou l'ignorer) jusqu'à l'expiration de l'entrée
+TRACKING_CODE_CACHE_TTL_SECONDS = 60
+# Les codes inconnus sont gardés moins longtemps, le temps qu'ils soient éventuellement créés
+UNKNOWN_CODE_CACHE_TTL_SECONDS = 30
+NOT_FOUND = object()
+
+def _code_cache_expiry(key, source_id, now):
+    if source_id is NOT_FOUND:
+        return now + UNKNOWN_CODE_CACHE_TTL_SECONDS
+    return now + TRACKING_CODE_CACHE_TTL_SECONDS
+
+_code_cache = TLRUCache(maxsize=10000, ttu=_code_cache_expiry, timer=time.monotonic)
+_code_cache_lock = threading.Lock()
+
+_SOURCE_IDS_BY_CODE_QUERIES = {
+    'commercial': text(
+        "SELECT id, tracking_code FROM commerciaux WHERE tracking_code IN :codes"
+    ).bindparams(bindparam('codes', expanding=True)),
+    'partenaire': text(
+        "SELECT id, tracking_code FROM partenaires WHERE tracking_code IN :codes"
+    ).bindparams(bindparam('codes', expanding=True)),
+}
+
+_INSERT_VISITS_QUERY = text("""
+    INSERT INTO visit_tracking (source_type, source_id, ip_address, user_agent, visited_at)
+    VALUES (:source_type, :source_id, :ip_address, :user_agent, :visited_at)
+""")
+
+def invalidate_tracking_code(source_type, code):
+    """
+    Retire un code de tracking du cache du processus courant (à appeler une
+    fois la création ou la modification du code validée en base)
+    """
+    with _code_cache_lock:
+        _code_cache.pop((source_type, code), None)
+
+def resolve_tracking_codes(conn, source_type, codes):
+    """
+    Résout des codes de tracking en IDs de source, en n'interrogeant la base
+    que pour les codes absents du cache
+
+    Returns:
+        dict: code -> source_id pour les codes existants
+    """
+    resolved = {}
+    missing = []
+    with _code_cache_lock:
+        for code in codes:
+            source_id = _code_cache.get((source_type, code))
+            if source_id is None:
+                missing.append(code)
+            else:
+                resolved[code] = source_id
+
+    if missing:
+        rows = conn.execute(_SOURCE_IDS_BY_CODE_QUERIES[source_type], {"codes": missing}).fetchall()
+        found = {row.tracking_code: row.id for row in rows}
+        with _code_cache_lock:
+            for code in missing:
+                _code_cache[(source_type, code)] = found.get(code, NOT_FOUND)
+        resolved.update(found)
+
+    return {code: source_id for code, source_id in resolved.items() if source_id is not NOT_FOUND}
+
+class VisitBuffer:
+    """
+    Tampon borné des visites de tracking, écrit en base par lots.
+
+    Les visites sont ajoutées en mémoire depuis les requêtes puis insérées
+    par un thread d'arrière-plan toutes les flush_interval secondes, ou dès
+    que batch_size visites sont en attente. Au-delà de maxlen visites en
+    attente, les plus anciennes sont abandonnées.
+    """
+
+    def __init__(self, engine, batch_size=500, flush_interval=1.0, maxlen=10000):
+        self._engine = engine
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._events = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def add(self, source_type, code, ip_address, user_agent):
+        """
+        Ajoute une visite au tampon (sans accès à la base)
+        """
+        event = {
+            "code": code,
+            "ip_address": ip_address,
+            "user_agent": user_agent,
+            "visited_at": datetime.utcnow()
+        }
+
+        with self._lock:
+            self._events.append((source_type, event))
+            pending = len(self._events)
+
+            # Démarrer le thread au premier ajout (après un éventuel fork du serveur)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='visit-buffer', daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+        if pending >= self._batch_size:
+            self._wakeup.set()
+
+    def flush(self):
+        """
+        Insère toutes les visites en attente en une transaction
+
+        Returns:
+            int: Le nombre de visites traitées
+        """
+        with self._lock:
+            events = list(self._events)
+            self._events.clear()
+
+        if not events:
+            return 0
+
+        # Regrouper les codes par type de source pour les résoudre par lot
+        codes_by_type = {}
+        for source_type, event in events:
+            codes_by_type.setdefault(source_type, set()).add(event["code"])
+
+        try:
+            with self._engine.begin() as conn:
+                source_ids = {
+                    source_type: resolve_tracking_codes(conn, source_type, codes)
+                    for source_type, codes in codes_by_type.items()
+                }
+
+                # Les visites sur des codes inconnus sont ignorées
+                rows = []
+                for source_type, event in events:
+                    source_id = source_ids[source_type].get(event["code"])
+                    if source_id is not None:
+                        rows.append({
+                            "source_type": source_type,
+                            "source_id": source_id,
+                            "ip_address": event["ip_address"],
+                            "user_agent": event["user_agent"],
+                            "visited_at": event["visited_at"]
+                        })
+
+                if rows:
+                    conn.execute(_INSERT_VISITS_QUERY, rows)
+        except Exception as e:
+            logger.error("Error flushing %s tracking visits: %s", len(events), e)
+
+        return len(events)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self._flush_interval)
+            self._wakeup.clear()
+            self.flush()
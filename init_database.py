@@ -19,14 +19,20 @@ if not database_url:
 # Create engine
 engine = create_engine(database_url)
 
-# Function to execute SQL safely
+# Descriptions of the statements that failed
+failed_statements = []
+
+# Function to execute SQL safely: each statement runs in its own savepoint so a
+# failure is rolled back alone instead of aborting the whole transaction
 def execute_sql(conn, sql, description="SQL"):
     try:
-        conn.execute(text(sql))
+        with conn.begin_nested():
+            conn.execute(text(sql))
         logger.info(f"Success: {description}")
         return True
     except SQLAlchemyError as e:
         logger.warning(f"Error in {description}: {str(e)}")
+        failed_statements.append(description)
         return False
 
 try:
@@ -143,7 +149,7 @@ try:
         for enum_name, enum_values in [
             ("statut_paiement_enum", "('payé', 'en_attente', 'remboursé')"),
             ("type_document_enum", "('devis', 'facture')"),
-            ("status_document_enum", "('en_attente', 'envoyé', 'payé', 'annulé')"),
+            ("status_document_enum", "('en_attente', 'envoyé', 'payé', 'annulé', 'en_paiement')"),
             ("type_ligne_enum", "('produit', 'service', 'texte', 'remise', 'custom')"),
             ("source_type_enum", "('commercial', 'partenaire', 'lien')")
         ]:
@@ -156,6 +162,13 @@ try:
                 enum_sql = f"CREATE TYPE {enum_name} AS ENUM {enum_values}"
                 execute_sql(conn, enum_sql, f"Create {enum_name}")
         
+        # Add enum values introduced after the initial schema
+        execute_sql(
+            conn,
+            "ALTER TYPE status_document_enum ADD VALUE IF NOT EXISTS 'en_paiement'",
+            "Add en_paiement to status_document_enum"
+        )
+        
         # Create ventes table
         ventes_sql = """
         CREATE TABLE IF NOT EXISTS ventes (
@@ -318,6 +331,62 @@ try:
         """
         execute_sql(conn, authentifications_sql, "Create authentifications table")
         
+        # Create visit_tracking table
+        visit_tracking_sql = """
+        CREATE TABLE IF NOT EXISTS visit_tracking (
+            id SERIAL PRIMARY KEY,
+            source_type source_type_enum,
+            source_id INT,
+            ip_address VARCHAR(45),
+            user_agent TEXT,
+            visited_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+        execute_sql(conn, visit_tracking_sql, "Create visit_tracking table")
+        
+        # Add columns used by the API routes that older schemas lack
+        for table_name, column_sql in [
+            ("commerciaux", "user_id INT REFERENCES users(id) ON DELETE SET NULL"),
+            ("partenaires", "user_id INT REFERENCES users(id) ON DELETE SET NULL"),
+            ("partenaires", "tracking_code VARCHAR(20)"),
+            ("devis_factures", "stripe_session_id VARCHAR(255)"),
+            ("devis_factures", "payment_claimed_at TIMESTAMP"),
+        ]:
+            execute_sql(
+                conn,
+                f"ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS {column_sql}",
+                f"Add {column_sql.split()[0]} to {table_name}"
+            )
+        
+        # Create indexes
+        for index_name, index_sql in [
+            ("ix_users_role_id", "CREATE INDEX IF NOT EXISTS ix_users_role_id ON users (role, id)"),
+            ("ix_users_email", "CREATE UNIQUE INDEX IF NOT EXISTS ix_users_email ON users (email)"),
+            ("ix_authentifications_email", "CREATE INDEX IF NOT EXISTS ix_authentifications_email ON authentifications (email)"),
+            ("ix_authentifications_provider_user", "CREATE UNIQUE INDEX IF NOT EXISTS ix_authentifications_provider_user ON authentifications (provider, provider_user_id)"),
+            ("ix_ventes_commercial", "CREATE INDEX IF NOT EXISTS ix_ventes_commercial ON ventes (commercial_id)"),
+            ("ix_ventes_partenaire", "CREATE INDEX IF NOT EXISTS ix_ventes_partenaire ON ventes (partenaire_id)"),
+            ("ix_ventes_date_id", "CREATE INDEX IF NOT EXISTS ix_ventes_date_id ON ventes (date DESC, id DESC) INCLUDE (user_id, montant)"),
+            ("ix_affiliations_source", "CREATE INDEX IF NOT EXISTS ix_affiliations_source ON affiliations (source_type, source_id)"),
+            ("ix_affiliations_vente", "CREATE INDEX IF NOT EXISTS ix_affiliations_vente ON affiliations (vente_id)"),
+            ("ix_ventes_sort_date", "CREATE INDEX IF NOT EXISTS ix_ventes_sort_date ON ventes ((COALESCE(date, '-infinity'::timestamp)) DESC, id)"),
+            ("ix_commerciaux_tracking_code", "CREATE UNIQUE INDEX IF NOT EXISTS ix_commerciaux_tracking_code ON commerciaux (tracking_code)"),
+            ("ix_partenaires_tracking_code", "CREATE UNIQUE INDEX IF NOT EXISTS ix_partenaires_tracking_code ON partenaires (tracking_code)"),
+            ("ix_commerciaux_email", "CREATE UNIQUE INDEX IF NOT EXISTS ix_commerciaux_email ON commerciaux (email)"),
+            ("ix_partenaires_email_contact", "CREATE UNIQUE INDEX IF NOT EXISTS ix_partenaires_email_contact ON partenaires (email_contact)"),
+            ("ix_commerciaux_user_id", "CREATE INDEX IF NOT EXISTS ix_commerciaux_user_id ON commerciaux (user_id, id)"),
+            ("ix_partenaires_user_id", "CREATE INDEX IF NOT EXISTS ix_partenaires_user_id ON partenaires (user_id, id)"),
+            ("ix_devis_factures_user_date", "CREATE INDEX IF NOT EXISTS ix_devis_factures_user_date ON devis_factures (user_id, date DESC, id DESC)"),
+            ("ix_devis_factures_client_date", "CREATE INDEX IF NOT EXISTS ix_devis_factures_client_date ON devis_factures (client_id, date DESC)"),
+            ("ix_devis_factures_date", "CREATE INDEX IF NOT EXISTS ix_devis_factures_date ON devis_factures (date DESC, id DESC)"),
+            ("ix_devis_factures_lignes_devis_ordre", "CREATE INDEX IF NOT EXISTS ix_devis_factures_lignes_devis_ordre ON devis_factures_lignes (devis_id, ordre)"),
+        ]:
+            execute_sql(conn, index_sql, f"Create index {index_name}")
+        
+    if failed_statements:
+        logger.error(f"Database schema initialization failed for: {', '.join(failed_statements)}")
+        sys.exit(1)
+    
     logger.info("Database schema initialization completed successfully")
     
 except SQLAlchemyError as e: